@@ -0,0 +1,147 @@
+"""
+Helpers to load the definitions of the IPython startup files without a Sirepo server.
+
+The startup files are executed by IPython into one namespace and most of them
+connect to Sirepo and create devices at the module level. The benchmarks only
+need the functions and classes, so the files are parsed and only the imports,
+the function and class definitions and the module-level assignments to plain
+names are executed (the ``with`` blocks, which create the devices, are skipped).
+"""
+import ast
+import os
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+# The plots of the startup files are only rendered into files.
+matplotlib.use("Agg")
+
+# When run by asv, the startup files and the data of the benchmarked commit are
+# copied into the environment by the install command (see asv.conf.json).
+# Otherwise, the files of the working tree are used.
+PROFILE_DIR = os.path.join(os.environ.get("ASV_ENV_DIR", ""), "profile")
+if not os.path.isdir(PROFILE_DIR):
+    PROFILE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_DIR = os.path.join(PROFILE_DIR, "startup")
+DATA_DIR = os.path.join(PROFILE_DIR, "data")
+
+# Production sizes: the shipped scan has 21 spectra of 2000 points, the
+# calibration scans go up to ~200 magnetic fields and the high-resolution
+# spectra up to 20000 points.
+SIZES = ["21x2000", "201x2000", "21x20000"]
+
+
+def load_startup(*filenames, namespace=None, skip=()):
+    """
+    Load the definitions of the startup files into the namespace.
+
+    Usage
+    -----
+
+        ns = load_startup("20-peak-finding.py")
+        ns["detect_peaks"](energies, intensities)
+
+    """
+    if namespace is None:
+        namespace = {}
+    namespace.setdefault("__name__", "profile_startup")
+    for filename in filenames:
+        path = os.path.join(STARTUP_DIR, filename)
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in tree.body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                pass
+            elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                if node.name in skip:
+                    continue
+            elif isinstance(node, ast.Assign) and all(
+                isinstance(target, ast.Name) for target in node.targets
+            ):
+                if any(target.id in skip for target in node.targets):
+                    continue
+            else:
+                continue
+            code = compile(ast.Module(body=[node], type_ignores=[]), path, "exec")
+            exec(code, namespace)
+    return namespace
+
+
+def synthetic_spectra(size, seed=0):
+    """
+    Return the (energies, intensities, mag_fields) arrays of a synthetic scan.
+
+    ``size`` is "<number of spectra>x<number of points>". The spectra have the
+    odd harmonics of an undulator with the parameters of the ARI EPU on top of a
+    ripple with many small local maxima, like the simulated spectra.
+    """
+    num_spectra, num_points = (int(n) for n in size.split("x"))
+    rng = np.random.default_rng(seed)
+    mag_fields = np.linspace(0.075, 1.5, num_spectra)
+    energies = np.tile(np.linspace(0.1, 1100.0, num_points), (num_spectra, 1))
+    intensities = np.zeros((num_spectra, num_points))
+    fundamental = 1221.1 / (1 + (6.54 * mag_fields) ** 2 / 2)
+    for i, e1 in enumerate(fundamental):
+        energy = energies[i]
+        for harm_num in range(1, int(1100.0 / e1) + 2, 2):
+            center = harm_num * e1
+            width = 0.5 + 0.002 * center
+            intensities[i] += np.exp(-0.5 * ((energy - center) / width) ** 2) / harm_num
+        ripple = 0.01 * (1 + np.cos(energy / (0.3 + e1 / 50)))
+        intensities[i] += ripple * (1 + 0.1 * rng.random(num_points))
+    return energies, intensities, mag_fields
+
+
+def synthetic_scan(size, seed=0):
+    """Return the synthetic scan as a table like the ones from databroker."""
+    energies, intensities, mag_fields = synthetic_spectra(size, seed=seed)
+    return pd.DataFrame(
+        {
+            "single_electron_spectrum_photon_energy": list(energies),
+            "single_electron_spectrum_image": list(intensities),
+            "undulator_verticalAmplitude": mag_fields,
+        }
+    )
+
+
+def load_devices():
+    """
+    Load the definitions of the base, peak finding, EPU and PGM startup files.
+
+    The ``EPU`` class is derived from the Sirepo undulator class, which is
+    replaced by a plain ``ophyd.Device`` with the two magnetic field signals, so
+    the energy conversions run without a Sirepo server. The ``PGM`` device needs
+    the Sirepo beamline elements and is not loaded. From the base file, only the
+    timers are needed (the catalog is not set up).
+    """
+    from ophyd import Device
+    from sirepo_bluesky.sirepo_ophyd import SirepoSignal
+
+    class Undulator(Device):
+        pass
+
+    sirepo_dict = {"verticalAmplitude": 0.5, "horizontalAmplitude": 0.0}
+    undulator = Undulator(name="undulator")
+    for param in sirepo_dict:
+        setattr(
+            undulator,
+            param,
+            SirepoSignal(
+                name=f"undulator_{param}", sirepo_dict=sirepo_dict, sirepo_param=param
+            ),
+        )
+    namespace = {"classes": {"undulator": Undulator}, "undulator": undulator}
+    return load_startup(
+        "00-base.py",
+        "20-peak-finding.py",
+        "30-epu-energy.py",
+        "31-pgm-energy.py",
+        namespace=namespace,
+        skip=(
+            "DATABROKER_CONFIG_DIR",
+            "_",
+            "PGM",
+        ),
+    )
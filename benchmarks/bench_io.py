@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+import pandas as pd
+
+from ._startup import DATA_DIR, SIZES, load_startup, synthetic_scan
+
+SCAN_JSON = os.path.join(DATA_DIR, "scan-spectra-vs-und-magn-field.json")
+
+
+class LoadScan:
+    """Loading the spectra of a scan exported to JSON, as in the README."""
+
+    params = SIZES
+    param_names = ["size"]
+    timeout = 300
+
+    def setup(self, size):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        if size == "21x2000":
+            self.path = SCAN_JSON
+        else:
+            self.path = os.path.join(self.tmpdir.name, "scan.json")
+            synthetic_scan(size).to_json(self.path)
+
+    def teardown(self, size):
+        self.tmpdir.cleanup()
+
+    def time_read_json(self, size):
+        pd.read_json(self.path)
+
+
+class LoadSpectraArchive:
+    """Loading the same spectra from the memory-mapped archive."""
+
+    params = SIZES
+    param_names = ["size"]
+
+    def setup(self, size):
+        self.ns = load_startup("20-peak-finding.py")
+        if "export_spectra" not in self.ns:
+            raise NotImplementedError
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "scan.spectra")
+        self.ns["export_spectra"](synthetic_scan(size), path=self.path)
+
+    def teardown(self, size):
+        self.tmpdir.cleanup()
+
+    def time_load_spectra(self, size):
+        spectra = self.ns["load_spectra"](path=self.path)
+        spectra["single_electron_spectrum_image"].sum()
+
+
+class LoadHarmonics:
+    def setup(self):
+        self.ns = load_startup("20-peak-finding.py")
+
+    def time_load_harmonics_json(self):
+        self.ns["load_harmonics_json"](path=os.path.join(DATA_DIR, "harmonics.json"))
@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+
+from ._startup import DATA_DIR, load_devices
+
+HARMONICS_JSON = os.path.join(DATA_DIR, "harmonics.json")
+HARMONICS_MODEL_JSON = os.path.join(DATA_DIR, "harmonics-model.json")
+
+# The ARI PGM parameters, as set up by the PGM device in 31-pgm-energy.py.
+PGM_KWARGS = {"r2": 11_500.0, "r1": 32_100.0, "m": 1}
+PGM_ANGLE_KWARGS = {"x_inc": 90, "x_diff": 90, "b": 1}
+
+
+class EPUConversion:
+    """The energy <-> magnetic field conversions of the EPU."""
+
+    params = (["table", "model"], [1, 10_000])
+    param_names = ["source", "num_points"]
+
+    def setup(self, source, num_points):
+        self.ns = load_devices()
+        df_harm = self.ns["load_harmonics_json"](path=HARMONICS_JSON)
+        if source == "table":
+            self.epu = self.ns["EPU"](name="epu", harmonics_df=df_harm)
+        else:
+            if not os.path.exists(HARMONICS_MODEL_JSON):
+                raise NotImplementedError
+            model = self.ns["load_harmonics_model"](path=HARMONICS_MODEL_JSON)
+            self.epu = self.ns["EPU"](name="epu", harmonics_df=df_harm, model=model)
+        if num_points == 1:
+            self.energies, self.magn_fields = 500.0, 0.5
+        else:
+            self.energies = np.linspace(100.0, 1000.0, num_points)
+            self.magn_fields = np.linspace(0.1, 1.4, num_points)
+
+    def time_get_magn_field(self, source, num_points):
+        self.epu._get_magn_field(self.energies)
+
+    def time_get_energy(self, source, num_points):
+        self.epu._get_energy(self.magn_fields)
+
+    def time_set_energy(self, source, num_points):
+        # The scalar path of a step scan: energy -> field -> energy readback.
+        self.epu.energy.set(500.0)
+
+
+class PGMMath:
+    """The cff, angles and energy relations of the PGM."""
+
+    params = (["LowE", "HighE", "HighR"], [1, 100_000])
+    param_names = ["grating", "num_points"]
+
+    def setup(self, grating, num_points):
+        self.ns = load_devices()
+        self.gratings = self.ns["_ari_gratings"]
+        if num_points == 1:
+            self.energies = 500.0
+        else:
+            self.energies = np.geomspace(20.0, 2000.0, num_points)
+        with np.errstate(invalid="ignore"):
+            self.theta_m2, self.theta_gr = self.get_pgm_angles(grating)
+
+    def get_pgm_angles(self, grating):
+        return self.ns["_get_pgm_angles"](
+            self.energies,
+            grating,
+            gratings=self.gratings,
+            **PGM_KWARGS,
+            **PGM_ANGLE_KWARGS,
+        )
+
+    def time_get_cff(self, grating, num_points):
+        with np.errstate(invalid="ignore"):
+            self.ns["_get_cff"](
+                self.energies, grating, gratings=self.gratings, **PGM_KWARGS
+            )
+
+    def time_get_pgm_angles(self, grating, num_points):
+        with np.errstate(invalid="ignore"):
+            self.get_pgm_angles(grating)
+
+    def time_get_pgm_energy(self, grating, num_points):
+        with np.errstate(invalid="ignore"):
+            self.ns["_get_pgm_energy"](
+                self.theta_m2,
+                self.theta_gr,
+                grating,
+                m=PGM_KWARGS["m"],
+                gratings=self.gratings,
+                **PGM_ANGLE_KWARGS,
+            )
+
+
+class PGMLookupTable:
+    def setup(self):
+        self.ns = load_devices()
+        if "PGMLookupTable" not in self.ns:
+            raise NotImplementedError
+
+    def time_build_lookup_table(self):
+        self.ns["PGMLookupTable"](
+            self.ns["_ari_gratings"], **PGM_KWARGS, **PGM_ANGLE_KWARGS
+        )
@@ -0,0 +1,118 @@
+import contextlib
+import io
+import os
+import tempfile
+
+import matplotlib.pyplot as plt
+
+from ._startup import SIZES, load_startup, synthetic_scan, synthetic_spectra
+
+
+class DetectPeaks:
+    """Peak detection of all spectra of a scan at once (the engine of the plots)."""
+
+    params = (["scipy", "peakutils"], SIZES)
+    param_names = ["method", "size"]
+
+    def setup(self, method, size):
+        self.ns = load_startup("20-peak-finding.py")
+        if "detect_peaks" not in self.ns:
+            raise NotImplementedError
+        self.energies, self.intensities, self.mag_fields = synthetic_spectra(size)
+
+    def time_detect_peaks(self, method, size):
+        self.ns["detect_peaks"](self.energies, self.intensities, method=method)
+
+    def time_detect_and_split_peaks(self, method, size):
+        peaks = self.ns["detect_peaks"](self.energies, self.intensities, method=method)
+        self.ns["split_peaks"](peaks, self.mag_fields)
+
+    def peakmem_detect_peaks(self, method, size):
+        self.ns["detect_peaks"](self.energies, self.intensities, method=method)
+
+
+class SweepPeaks:
+    params = SIZES
+    param_names = ["size"]
+
+    def setup(self, size):
+        self.ns = load_startup("20-peak-finding.py")
+        if "sweep_peaks" not in self.ns:
+            raise NotImplementedError
+        self.df = synthetic_scan(size)
+        self.sweep_params = [
+            (method, thres, 0.20)
+            for method in ["scipy", "peakutils"]
+            for thres in [0.05, 0.07, 0.10]
+        ]
+
+    def time_sweep_peaks(self, size):
+        self.ns["sweep_peaks"](self.df, self.sweep_params, max_workers=1)
+
+
+class FindPeaks:
+    """The per-spectrum ``find_peaks()`` with peakutils and the lookup plot."""
+
+    params = SIZES
+    param_names = ["size"]
+
+    def setup(self, size):
+        self.ns = load_startup("20-peak-finding.py")
+        self.df = synthetic_scan(size)
+        self.fig, self.ax = plt.subplots()
+
+    def teardown(self, size):
+        plt.close("all")
+
+    def time_find_peaks(self, size):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.ns["find_peaks"](self.df, ax=self.ax)
+
+
+class PlotAllPeaks:
+    """The grid of the spectra with their peaks, as for the shipped scan."""
+
+    params = ["scipy", "peakutils"]
+    param_names = ["method"]
+    # A single call renders and saves the whole grid of plots, which is slow.
+    number = 1
+    repeat = 1
+    warmup_time = 0
+    timeout = 300
+
+    def setup(self, method):
+        self.ns = load_startup("20-peak-finding.py")
+        self.df = synthetic_scan("21x2000")
+        # The figure is saved into the current directory.
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+
+    def teardown(self, method):
+        plt.close("all")
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def time_plot_all_peaks(self, method):
+        self.ns["plot_all_peaks"](self.df, method=method)
+
+
+class HarmonicsTable:
+    params = [21, 201, 2001]
+    param_names = ["num_spectra"]
+
+    def setup(self, num_spectra):
+        self.ns = load_startup("20-peak-finding.py")
+        if "detect_peaks" not in self.ns:
+            raise NotImplementedError
+        energies, intensities, mag_fields = synthetic_spectra(f"{num_spectra}x2000")
+        peaks = self.ns["detect_peaks"](energies, intensities)
+        self.all_energies = self.ns["split_peaks"](peaks, mag_fields)
+
+    def time_create_harmonics_dataframe(self, num_spectra):
+        self.ns["create_harmonics_dataframe"](self.all_energies)
+
+    def time_fit_harmonics_model(self, num_spectra):
+        if "fit_harmonics_model" not in self.ns:
+            raise NotImplementedError
+        self.ns["fit_harmonics_model"](self.all_energies)
@@ -1,25 +1,173 @@
+import contextlib
 import datetime
+import functools
+import os
+import time
 
-print(f"{datetime.datetime.now().isoformat()} Loading {__file__}...")
 
-import databroker
-import matplotlib.pyplot as plt
-import nslsii
-from ophyd.utils import make_dir_tree
-from sirepo_bluesky.shadow_handler import ShadowFileHandler
-from sirepo_bluesky.srw_handler import SRWFileHandler
+class StartupTimer:
+    """
+    Collect the load time of each startup file and of the phases inside them.
 
-nslsii.configure_base(get_ipython().user_ns, "local")
+    Usage
+    -----
+
+        startup_timer.start_file(__file__)
+        with startup_timer.phase("imports"):
+            import ...
+        ...
+        startup_timer.report()
+
+    """
+
+    def __init__(self):
+        self.records = []  # (file, phase, duration in seconds)
+        self._file = None
+        self._file_start = None
+
+    def _finish_file(self):
+        if self._file is not None:
+            duration = time.perf_counter() - self._file_start
+            self.records.append((self._file, "total", duration))
+            self._file = None
+
+    def start_file(self, path):
+        self._finish_file()
+        self._file = os.path.basename(path)
+        self._file_start = time.perf_counter()
+        print(f"Loading {path}...")
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.records.append((self._file, name, time.perf_counter() - start))
+
+    def report(self):
+        """Finish the current file and print the timings of all files and phases."""
+        self._finish_file()
+        width = max([len(file) for file, _, _ in self.records] + [4])
+        lines = [f"{'File':<{width}}  {'Phase':<24}  {'Time [s]':>8}"]
+        for file, phase, duration in self.records:
+            lines.append(f"{file:<{width}}  {phase:<24}  {duration:8.3f}")
+        total = sum(d for _, phase, d in self.records if phase == "total")
+        lines.append(f"{'':<{width}}  {'startup total':<24}  {total:8.3f}")
+        print("\n".join(lines))
+
+
+class HotPathTimer:
+    """
+    Accumulate the time spent in the hot-path stages of the scans.
+
+    The stages (setting the Sirepo model parameters, the EPU/PGM calculations, the
+    Sirepo run and download, the handler decoding and the document insertion) are
+    timed with ``time(stage)``. The durations are summed per point until
+    ``take_point()`` is called (see ``HotPathTimingCallback``). When the timer is
+    disabled, ``time()`` returns a shared no-op context manager, so the
+    instrumentation costs one method call per stage.
+
+    Usage
+    -----
+
+        hot_path_timer.enabled = True  # or HOT_PATH_TIMING=yes before startup
+        with hot_path_timer.time("pgm.cff"):
+            ...
+        hot_path_timer.take_point()  # {"pgm.cff": 1.2e-05, ...}
+
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._point = {}
+
+    def time(self, stage):
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _HotPathStage(self._point, stage)
+
+    def wrap(self, stage, func):
+        """Return ``func`` timed as the stage."""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.time(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def take_point(self):
+        """Return the durations of the stages since the last call and reset them."""
+        point, self._point = self._point, {}
+        return point
+
+
+class _HotPathStage:
+    def __init__(self, point, stage):
+        self._point = point
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self._start
+        self._point[self._stage] = self._point.get(self._stage, 0.0) + duration
+
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+startup_timer = StartupTimer()
+startup_timer.start_file(__file__)
+
+hot_path_timer = HotPathTimer(
+    enabled=os.getenv("HOT_PATH_TIMING", "no").lower() in ["y", "yes", "1", "true"]
+)
+
+with startup_timer.phase("imports"):
+    import databroker
+    import intake
+    import matplotlib.pyplot as plt
+    import nslsii
+    from ophyd.utils import make_dir_tree
+
+# The catalog: "local" (MongoDB, see configs/databroker/local.yml) or the name of
+# a catalog in configs/databroker, e.g. "local-embedded" (msgpack files, no
+# database server).
+DATABROKER_CONFIG = os.getenv("DATABROKER_CONFIG", "local")
+DATABROKER_CONFIG_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "configs", "databroker"
+)
+
+
+def _get_broker(name):
+    """
+    Return the broker to pass to ``nslsii.configure_base()``.
+
+    "local" is looked up by databroker in ~/.config/databroker as before. Other
+    names are intake catalogs read from the profile's configs/databroker
+    directory, so the embedded catalog works without installing its config.
+    """
+    if name == "local":
+        return databroker.Broker.named(name)
+    catalog = intake.open_catalog(os.path.join(DATABROKER_CONFIG_DIR, f"{name}.yml"))
+    for path in catalog[name].describe()["args"].get("paths", []):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return databroker.v1.Broker(catalog[name].get())
+
+
+with startup_timer.phase("nslsii.configure_base"):
+    db = _get_broker(DATABROKER_CONFIG)
+    # The insertion of the documents is timed as a hot-path stage:
+    db.insert = hot_path_timer.wrap("db.insert", db.insert)
+    nslsii.configure_base(get_ipython().user_ns, db)
 
 try:
     databroker.assets.utils.install_sentinels(db.reg.config, version=1)
 except Exception:
     pass
 
-db.reg.register_handler("srw", SRWFileHandler, overwrite=True)
-db.reg.register_handler("shadow", ShadowFileHandler, overwrite=True)
-db.reg.register_handler("SIREPO_FLYER", SRWFileHandler, overwrite=True)
-
 plt.ion()
 
 root_dir = "/tmp/sirepo-bluesky-data"
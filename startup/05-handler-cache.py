@@ -0,0 +1,272 @@
+startup_timer.start_file(__file__)
+
+import collections
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+with startup_timer.phase("imports"):
+    from sirepo_bluesky import sirepo_ophyd
+    from sirepo_bluesky.shadow_handler import ShadowFileHandler
+    from sirepo_bluesky.srw_handler import SRWFileHandler
+
+
+class HandlerCache:
+    """
+    LRU cache of the data decoded by the file handlers, bounded by its size in bytes.
+
+    The data are keyed on the handler specs, the file path, modification time and
+    size, and the resource/datum kwargs, so a rewritten file is decoded again. The
+    cached arrays are read-only, as they are shared by all the readers. A datum
+    being decoded by one thread (e.g. by ``prefetch_run()``) is waited for by the
+    others instead of being decoded twice. The results of the Sirepo detectors
+    are cached as soon as the detectors read them (see
+    ``_caching_read_srw_file()``).
+
+    Usage
+    -----
+
+        hdr.table(fill=True)  # decodes the files
+        hdr.table(fill=True)  # served from the cache
+        handler_cache.stats()
+        handler_cache.max_bytes = 4 * 1024**3
+
+    """
+
+    def __init__(self, max_bytes=1024**3):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._bytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, load):
+        """Return the data of the key, decoding them with ``load()`` if missing."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+                self.misses += 1
+        if not owner:
+            return future.result()
+        try:
+            data = np.asarray(load())
+            data.flags.writeable = False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key)
+        with self._lock:
+            self._store(key, data)
+        future.set_result(data)
+        return data
+
+    def _store(self, key, data):
+        if data.nbytes > self.max_bytes:
+            return
+        self._data[key] = data
+        self._bytes += data.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def discard(self, key):
+        """Remove the data of the key from the cache, if present."""
+        with self._lock:
+            data = self._data.pop(key, None)
+            if data is not None:
+                self._bytes -= data.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+            self.hits = self.misses = 0
+
+
+handler_cache = HandlerCache(
+    max_bytes=int(os.getenv("HANDLER_CACHE_BYTES", str(1024**3)))
+)
+
+
+def _get_handler_key(specs, filename, resource_kwargs, datum_kwargs):
+    """
+    Return the ``handler_cache`` key of a datum.
+
+    databroker subclasses the registered handlers, so the handlers are identified
+    by their specs rather than by their class.
+    """
+    stat = os.stat(filename)
+    return (
+        tuple(sorted(specs)),
+        os.path.abspath(filename),
+        stat.st_mtime_ns,
+        stat.st_size,
+        tuple(sorted(resource_kwargs.items())),
+        tuple(sorted(datum_kwargs.items())),
+    )
+
+
+class _CachingHandlerMixin:
+    """Serve the data of a file handler from ``handler_cache``."""
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self._filename = filename
+        self._resource_kwargs = kwargs
+
+    def _get_key(self, datum_kwargs):
+        return _get_handler_key(
+            self.specs, self._filename, self._resource_kwargs, datum_kwargs
+        )
+
+    @property
+    def _stage(self):
+        return f"handler.{'/'.join(sorted(self.specs))}"
+
+    def __call__(self, **kwargs):
+        return handler_cache.get(self._get_key(kwargs), lambda: self._decode(**kwargs))
+
+    def evict(self, **kwargs):
+        """Remove the datum from the cache (e.g. before deleting its file)."""
+        handler_cache.discard(self._get_key(kwargs))
+
+    def _decode(self, **kwargs):
+        with hot_path_timer.time(self._stage):
+            return super().__call__(**kwargs)
+
+
+def _read_srw_data(filename, ndim=2):
+    """
+    Read the data of an SRW result file, as ``read_srw_file()`` does.
+
+    The values are parsed in one pass with NumPy, and the beam statistics which
+    ``read_srw_file()`` also computes are skipped, as the handlers only return the
+    data.
+    """
+    with open(filename, "rb") as f:
+        header = [f.readline() for _ in range(11)]
+        body = f.read()
+    if not header[-1].startswith(b"#"):  # no number of components line
+        body = header.pop() + body
+    if ndim not in (1, 2):
+        raise ValueError(f"The value ndim={ndim} is not supported.")
+    data = np.array(body.split(), dtype=float)
+    if ndim == 2:
+        nx, ny = [int(header[i].lstrip(b"#").split()[0]) for i in [6, 9]]
+        data = data.reshape((ny, nx), order="C")
+    return data
+
+
+class CachingSRWFileHandler(_CachingHandlerMixin, SRWFileHandler):
+    def _decode(self, **kwargs):
+        if kwargs:  # not produced by the Sirepo detectors, decoded as upstream
+            return super()._decode(**kwargs)
+        with hot_path_timer.time(self._stage):
+            return _read_srw_data(self._name, ndim=self._ndim)
+
+
+class CachingShadowFileHandler(_CachingHandlerMixin, ShadowFileHandler):
+    pass
+
+
+def _caching_read_srw_file(read_srw_file):
+    """
+    Wrap ``read_srw_file()`` to keep the data it decodes in ``handler_cache``.
+
+    The Sirepo detectors read each result file right after writing it, so their
+    data are cached before the datum is even stored, under the key of the
+    ``CachingSRWFileHandler`` which will read it back: filling a run after the
+    scan (or reducing it on the fly, see ``BeamStatistics``) does not parse the
+    files again.
+    """
+
+    @functools.wraps(read_srw_file)
+    def wrapper(filename, ndim=2):
+        ret = read_srw_file(filename, ndim=ndim)
+        key = _get_handler_key(
+            CachingSRWFileHandler.specs, filename, {"ndim": ndim}, {}
+        )
+        handler_cache.get(key, lambda: ret["data"])
+        return ret
+
+    return wrapper
+
+
+sirepo_ophyd.read_srw_file = _caching_read_srw_file(sirepo_ophyd.read_srw_file)
+
+handler_registry = {
+    "srw": CachingSRWFileHandler,
+    "shadow": CachingShadowFileHandler,
+    "SIREPO_FLYER": CachingSRWFileHandler,
+}
+for spec, handler in handler_registry.items():
+    db.reg.register_handler(spec, handler, overwrite=True)
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=1)
+
+
+def prefetch_run(hdr, stream_name="primary"):
+    """
+    Decode the external data of the run into ``handler_cache`` in the background.
+
+    The datums are decoded in the order of the run, so reading the run right after
+    (e.g. ``hdr.table(fill=True)``) waits only for the datums not decoded yet. The
+    prefetching stops when the cache is full, so it does not evict the datums it
+    has just decoded.
+
+    Returns a ``concurrent.futures.Future`` of the number of prefetched datums.
+
+    Usage
+    -----
+
+        prefetch_run(db[uid])
+        tbl = db[uid].table(fill=True)
+
+    """
+
+    def prefetch():
+        resources = {}
+        count = 0
+        prefetched_bytes = 0
+        for name, doc in hdr.documents(stream_name=stream_name, fill=False):
+            if name == "resource":
+                resources[doc["uid"]] = doc
+            elif name == "datum":
+                resource = resources[doc["resource"]]
+                handler = handler_registry[resource["spec"]](
+                    os.path.join(resource["root"], resource["resource_path"]),
+                    **resource["resource_kwargs"],
+                )
+                data = handler(**doc["datum_kwargs"])
+                count += 1
+                prefetched_bytes += data.nbytes
+                if prefetched_bytes > handler_cache.max_bytes:
+                    break
+        return count
+
+    return _prefetch_executor.submit(prefetch)
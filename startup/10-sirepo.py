@@ -1,29 +1,133 @@
-print(f"{datetime.datetime.now().isoformat()} Loading {__file__}...")
+startup_timer.start_file(__file__)
 
+import json
 import os
+import re
 import warnings
 
-from sirepo_bluesky.sirepo_bluesky import SirepoBluesky
-from sirepo_bluesky.sirepo_ophyd import create_classes
+import requests
+
+with startup_timer.phase("imports"):
+    import sirepo_bluesky.sirepo_bluesky
+    from sirepo_bluesky.sirepo_bluesky import SirepoBluesky
+    from sirepo_bluesky.sirepo_ophyd import create_classes
 
 if os.getenv("USE_SIREPO", "no").lower() in ["y", "yes", "1", "true"]:
     USE_SIREPO = True
 else:
     USE_SIREPO = False
 
+if os.getenv("SIREPO_OFFLINE", "no").lower() in ["y", "yes", "1", "true"]:
+    SIREPO_OFFLINE = True
+else:
+    SIREPO_OFFLINE = False
+
+# The Sirepo server; point it to tools/sirepo_standin.py for offline load tests.
+SIREPO_URL = os.getenv("SIREPO_URL", "http://localhost:8000")
+
+SIMULATION_CACHE_VERSION = 1
+SIMULATION_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "profile_sirepo_ari"
+)
+
+
+def _get_simulation_cache_path(
+    server, sim_type, sim_id, cache_dir=SIMULATION_CACHE_DIR
+):
+    server = re.sub(r"[^A-Za-z0-9.-]+", "_", server).strip("_")
+    return os.path.join(cache_dir, server, f"{sim_type}-{sim_id}.json")
+
+
+def _load_simulation_cache(path, server):
+    """
+    Return the cached simulation of the server or None if it is missing or
+    outdated.
+    """
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if cached.get("version") != SIMULATION_CACHE_VERSION:
+        return None
+    if cached.get("server") != server:
+        return None
+    return cached
+
+
+def _run_simulation_offline(*args, **kwargs):
+    raise sirepo_bluesky.sirepo_bluesky.SirepoBlueskyClientException(
+        "The profile is in the read-only offline mode, simulations cannot be run."
+    )
+
+
+def auth_with_cache(connection, sim_type, sim_id, offline=False):
+    """
+    Authenticate to the simulation and keep a local copy of its data and schema.
+
+    The local copy of each server and simulation is rewritten only when the
+    simulation changed on the server (its ``simulationSerial`` changed). If the
+    server is unreachable or ``offline`` is True, the connection is set up from the
+    local copy in the read-only mode: the devices can be created and inspected,
+    but running a simulation raises an exception.
+
+    Returns the (data, schema) tuple, like ``connection.auth()``.
+    """
+    path = _get_simulation_cache_path(connection.server, sim_type, sim_id)
+    cached = _load_simulation_cache(path, connection.server)
+
+    if not offline:
+        try:
+            data, schema = connection.auth(sim_type, sim_id)
+        except requests.exceptions.ConnectionError as e:
+            warnings.warn(f"Sirepo is unreachable ({e}). Using the cached simulation.")
+        else:
+            serial = data["models"]["simulation"].get("simulationSerial")
+            if cached is None or cached["serial"] != serial:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "w") as f:
+                    json.dump(
+                        {
+                            "version": SIMULATION_CACHE_VERSION,
+                            "server": connection.server,
+                            "serial": serial,
+                            "data": data,
+                            "schema": schema,
+                        },
+                        f,
+                    )
+            return data, schema
+
+    if cached is None:
+        raise RuntimeError(
+            f"Cannot start offline: there is no cached simulation at {path}"
+        )
+    connection.cookies = None
+    connection.sim_type = sim_type
+    connection.sim_id = sim_id
+    connection.data = cached["data"]
+    connection.schema = cached["schema"]
+    connection.run_simulation = _run_simulation_offline
+    return connection.data, connection.schema
+
+
 if USE_SIREPO:
     # Assumption: there is a running local instance of Sirepo. Please follow the
     # instructions at https://nsls-ii.github.io/sirepo-bluesky/installation.html to
     # install/configure Sirepo and Sirepo-Bluesky.
-    connection = SirepoBluesky("http://localhost:8000")
+    connection = SirepoBluesky(SIREPO_URL)
 
     # See https://nsls-ii.github.io/sirepo-bluesky/simulations.html for the list of
     # simulations.
-    data, schema = connection.auth("srw", "00000004")
-    classes, objects = create_classes(
-        connection=connection,
-        extra_model_fields=["undulator", "intensityReport"],
-    )
+    with startup_timer.phase("Sirepo auth"):
+        data, schema = auth_with_cache(
+            connection, "srw", "00000004", offline=SIREPO_OFFLINE
+        )
+    with startup_timer.phase("create_classes"):
+        classes, objects = create_classes(
+            connection=connection,
+            extra_model_fields=["undulator", "intensityReport"],
+        )
     globals().update(**objects)
 
     # In [234]: classes
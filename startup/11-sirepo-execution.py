@@ -0,0 +1,411 @@
+startup_timer.start_file(__file__)
+
+import copy
+import hashlib
+import json
+import numbers
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sirepo_bluesky import sirepo_ophyd
+
+
+def _get_model_hash(connection, data=None, report=None):
+    """
+    Return the canonical hash of the simulation models and the report to run.
+
+    The data are those of the connection by default. The Sirepo server and the
+    simulation of the connection are part of the hash, and the models are
+    serialized with sorted keys, so equal models give equal hashes regardless of
+    the order in which they were updated.
+    """
+    if data is None:
+        data = connection.data
+    if report is None:
+        report = data.get("report")
+    json_str = json.dumps(
+        {
+            "server": connection.server,
+            "sim_type": connection.sim_type,
+            "sim_id": connection.sim_id,
+            "models": data["models"],
+            "report": report,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(json_str.encode()).hexdigest()
+
+
+def _get_report_name(det):
+    """Return the name of the Sirepo report run by the detector's trigger()."""
+    if isinstance(det, sirepo_ophyd.SingleElectronSpectrumReport):
+        return "intensityReport"
+    elif isinstance(det, sirepo_ophyd.SirepoWatchpoint):
+        return f"watchpointReport{det.id._sirepo_dict['id']}"
+    raise TypeError(f"{det.name} is not a Sirepo detector")
+
+
+class ModelTransaction:
+    """
+    Apply a batch of edits of the Sirepo model at once.
+
+    The edits are recorded with ``set()`` (for Sirepo signals) or ``set_param()``
+    (for any model dictionary), the last edit of a parameter wins. When the block
+    exits, the edits which do not change the model are skipped, the numeric values
+    are checked to be finite, and the remaining edits are applied together. If the
+    block raises or a value is invalid, the model is left untouched.
+
+    The readbacks of the signals are not updated by the transaction: the caller
+    updates them after the block, once the edits are applied.
+
+    Usage
+    -----
+
+        with ModelTransaction() as transaction:
+            transaction.set(pgm.cff, cff)
+            transaction.set_param(connection.data["models"]["simulation"], "photonEnergy", 250.0)
+        transaction.diff  # [(param, old value, new value), ...]
+
+        # The edits can also be applied to a copy of the data instead:
+        data = transaction.apply(connection.data)
+
+    """
+
+    def __init__(self):
+        self._edits = {}
+        self.diff = []
+
+    def set(self, signal, value):
+        """Record the edit of the model parameter of the Sirepo signal."""
+        self.set_param(signal._sirepo_dict, signal._sirepo_param, value)
+
+    def set_param(self, sirepo_dict, param, value):
+        """Record the edit of the parameter of the model dictionary."""
+        self._edits[(id(sirepo_dict), param)] = (sirepo_dict, param, value)
+
+    def commit(self):
+        edits = [
+            (sirepo_dict, param, value)
+            for sirepo_dict, param, value in self._edits.values()
+            if param not in sirepo_dict or sirepo_dict[param] != value
+        ]
+        for _, param, value in edits:
+            if isinstance(value, numbers.Number) and not np.isfinite(value):
+                raise ValueError(
+                    f"Invalid value {value!r} of {param!r}, the model is not updated."
+                )
+        self.diff = [
+            (param, sirepo_dict.get(param), value)
+            for sirepo_dict, param, value in edits
+        ]
+        for sirepo_dict, param, value in edits:
+            sirepo_dict[param] = value
+        self._edits = {}
+        return self.diff
+
+    def apply(self, data):
+        """
+        Return a copy of the Sirepo data (e.g. ``connection.data``) with the
+        recorded edits applied, leaving the model itself untouched.
+        """
+        memo = {}
+        data = copy.deepcopy(data, memo)
+        transaction = ModelTransaction()
+        for sirepo_dict, param, value in self._edits.values():
+            if id(sirepo_dict) not in memo:
+                raise ValueError(f"The parameter {param!r} is not in the Sirepo data")
+            transaction.set_param(memo[id(sirepo_dict)], param, value)
+        transaction.commit()
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.commit()
+
+
+class SimulationPipeline:
+    """
+    Run Sirepo simulations ahead of a scan, on copies of the simulation.
+
+    The simulations for the upcoming models are submitted with ``submit()`` and run
+    concurrently (at most ``depth`` at a time) on ``depth`` copies of the
+    simulation, so Sirepo does not cancel them in favor of each other. While the
+    pipeline is installed, ``connection.run_simulation()`` and
+    ``connection.get_datafile()`` return the prefetched results when the model of
+    the connection matches a submitted one, and run the simulation directly
+    otherwise. With a ``cache`` (a ``SimulationCache``), the models which are
+    already cached are not submitted, and the new results are stored in it.
+
+    Usage
+    -----
+
+        with SimulationPipeline(connection, depth=3) as pipeline:
+            pipeline.submit(data_of_the_next_point)
+            ...
+
+    """
+
+    def __init__(self, connection, depth=3, sim_name="bluesky-pipeline", cache=None):
+        self._connection = connection
+        self._depth = depth
+        self._cache = cache
+        self._sim_name = sim_name
+        self._workers = None
+        self._executor = None
+        self._futures = {}
+        self._datafile = None
+        self._originals = {}
+
+    def _start(self):
+        self._workers = queue.Queue()
+        for i in range(self._depth):
+            self._workers.put(self._connection.copy_sim(f"{self._sim_name}-{i}"))
+        self._executor = ThreadPoolExecutor(max_workers=self._depth)
+
+    def submit(self, data, report=None):
+        """Submit the simulation of ``data`` (the models and the report to run)."""
+        if self._executor is None:
+            self._start()
+        data = copy.deepcopy(data)
+        if report is not None:
+            data["report"] = report
+        key = _get_model_hash(self._connection, data)
+        if self._cache is not None and key in self._cache:
+            return None
+        if key not in self._futures:
+            self._futures[key] = self._executor.submit(self._run, key, data)
+        return self._futures[key]
+
+    def _run(self, key, data):
+        worker = self._workers.get()
+        try:
+            simulation = worker.data["models"]["simulation"]
+            models = copy.deepcopy(data["models"])
+            models["simulation"].update(
+                {
+                    field: simulation[field]
+                    for field in ["simulationId", "name", "folder"]
+                    if field in simulation
+                }
+            )
+            worker.data["models"] = models
+            worker.data["report"] = data["report"]
+            result = worker.run_simulation()
+            datafile = worker.get_datafile(file_index=-1)
+        finally:
+            self._workers.put(worker)
+        if self._cache is not None:
+            self._cache.store(key, result[0], datafile)
+        return result, datafile
+
+    def _run_simulation(self, *args, **kwargs):
+        future = self._futures.pop(_get_model_hash(self._connection), None)
+        if future is None:
+            self._datafile = None
+            return self._originals["run_simulation"](*args, **kwargs)
+        result, self._datafile = future.result()
+        return result
+
+    def _get_datafile(self, *args, **kwargs):
+        if self._datafile is None:
+            return self._originals["get_datafile"](*args, **kwargs)
+        datafile, self._datafile = self._datafile, None
+        return datafile
+
+    def install(self):
+        """Serve the prefetched results through the connection."""
+        for name in ["run_simulation", "get_datafile"]:
+            self._originals[name] = getattr(self._connection, name)
+            setattr(self._connection, name, getattr(self, f"_{name}"))
+
+    def uninstall(self):
+        for name, method in self._originals.items():
+            setattr(self._connection, name, method)
+        self._originals = {}
+
+    def close(self):
+        """Uninstall the pipeline, wait for the running simulations and clean up."""
+        self.uninstall()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._futures = {}
+        while self._workers is not None and not self._workers.empty():
+            self._workers.get().delete_copy()
+        self._workers = None
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SimulationCache:
+    """
+    Content-addressed on-disk cache of Sirepo simulation results.
+
+    The results are stored in ``path`` under the canonical hash of the simulation
+    models, the report name and the simulation (see ``_get_model_hash()``). While
+    the cache is installed, ``connection.run_simulation()`` returns immediately
+    when the current model was already simulated, and the following
+    ``connection.get_datafile()`` returns the stored data file. The least recently
+    used results are evicted when the cache grows over ``max_bytes``.
+
+    Usage
+    -----
+
+        simulation_cache.stats()
+        simulation_cache.clear()
+
+    """
+
+    def __init__(self, connection, path=None, max_bytes=2 * 1024**3):
+        self._connection = connection
+        self.path = path or os.path.join(root_dir, "simulation-cache")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._datafile = None
+        self._originals = {}
+        self._lock = threading.Lock()  # results are also stored by the pipeline
+        os.makedirs(self.path, exist_ok=True)
+
+    def _paths(self, key):
+        return (
+            os.path.join(self.path, f"{key}.json"),
+            os.path.join(self.path, f"{key}.dat"),
+        )
+
+    def __contains__(self, key):
+        return all(os.path.exists(path) for path in self._paths(key))
+
+    def load(self, key):
+        """Return the stored (result, datafile) for the key or None if missing."""
+        result_path, datafile_path = self._paths(key)
+        try:
+            with open(result_path) as f:
+                res = json.load(f)
+            with open(datafile_path, "rb") as f:
+                datafile = f.read()
+        except FileNotFoundError:
+            return None
+        for path in [result_path, datafile_path]:
+            os.utime(path)  # mark as recently used
+        return res, datafile
+
+    def store(self, key, res, datafile):
+        result_path, datafile_path = self._paths(key)
+        with self._lock:
+            with open(datafile_path, "wb") as f:
+                f.write(datafile)
+            # The result is written last, and renamed into place once complete,
+            # so an interrupted write is a cache miss.
+            with open(f"{result_path}.tmp", "w") as f:
+                json.dump(res, f)
+            os.replace(f"{result_path}.tmp", result_path)
+            self._evict()
+
+    def _run_simulation(self, *args, **kwargs):
+        key = _get_model_hash(self._connection)
+        start_time = time.monotonic()
+        cached = self.load(key)
+        if cached is not None:
+            self.hits += 1
+            res, self._datafile = cached
+            return res, time.monotonic() - start_time
+
+        self.misses += 1
+        res, duration = self._originals["run_simulation"](*args, **kwargs)
+        self._datafile = self._originals["get_datafile"](file_index=-1)
+        self.store(key, res, self._datafile)
+        return res, duration
+
+    def _get_datafile(self, *args, **kwargs):
+        if self._datafile is None:
+            return self._originals["get_datafile"](*args, **kwargs)
+        datafile, self._datafile = self._datafile, None
+        return datafile
+
+    def _entries(self):
+        """Return the (mtime, size, key) of the cached results."""
+        entries = {}
+        with os.scandir(self.path) as it:
+            for entry in it:
+                key, ext = os.path.splitext(entry.name)
+                if ext not in [".json", ".dat"]:
+                    continue
+                stat = entry.stat()
+                mtime, size = entries.get(key, (0, 0))
+                entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size)
+        return [(mtime, size, key) for key, (mtime, size) in entries.items()]
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self):
+        for _, _, key in self._entries():
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.hits = self.misses = 0
+
+    def install(self):
+        for name in ["run_simulation", "get_datafile"]:
+            self._originals[name] = getattr(self._connection, name)
+            setattr(self._connection, name, getattr(self, f"_{name}"))
+
+    def uninstall(self):
+        for name, method in self._originals.items():
+            setattr(self._connection, name, method)
+        self._originals = {}
+
+
+if USE_SIREPO:
+    # The Sirepo runs and the downloads of the results are timed on the
+    # connection itself, under the cache, so the cache hits are not counted as
+    # Sirepo runs.
+    for _name in ["run_simulation", "get_datafile"]:
+        setattr(
+            connection,
+            _name,
+            hot_path_timer.wrap(f"sirepo.{_name}", getattr(connection, _name)),
+        )
+
+if USE_SIREPO and os.getenv("USE_SIREPO_CACHE", "yes").lower() in [
+    "y",
+    "yes",
+    "1",
+    "true",
+]:
+    simulation_cache = SimulationCache(connection)
+    simulation_cache.install()
+else:
+    simulation_cache = None
@@ -1,57 +1,352 @@
-print(f"{datetime.datetime.now().isoformat()} Loading {__file__}...")
+startup_timer.start_file(__file__)
 
 import json
+import multiprocessing
 import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import peakutils
-import scipy.signal
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from scipy.optimize import least_squares
 
 DATA_DIR = "data"
 HARMONICS_JSON = os.path.join(DATA_DIR, "harmonics.json")
+HARMONICS_MODEL_JSON = os.path.join(DATA_DIR, "harmonics-model.json")
+HARMONICS_MODEL_VERSION = 1
+FLUX_MAP_JSON = os.path.join(DATA_DIR, "flux-map.json")
+FLUX_MAP_VERSION = 1
+SPECTRA_ARCHIVE = os.path.join(DATA_DIR, "scan-spectra-vs-und-magn-field.spectra")
+SPECTRA_ARCHIVE_VERSION = 1
+SPECTRA_COLUMNS = [
+    "single_electron_spectrum_photon_energy",
+    "single_electron_spectrum_image",
+    "undulator_verticalAmplitude",
+]
 
+PEAK_METHODS = ["scipy", "peakutils"]
 
-def find_peaks(df, harm_num=0, thres=0.10, filter_thres=0.2, ax=None):
-    """Find peaks for the pandas dataframe."""
+# Ragged-array form of the detected peaks: the peaks of spectrum ``i`` are
+# ``indices[offsets[i]:offsets[i + 1]]`` (and the same slices of ``energies`` and
+# ``intensities``).
+Peaks = namedtuple("Peaks", ["offsets", "indices", "energies", "intensities"])
 
-    energies = np.array(list(df["single_electron_spectrum_photon_energy"]))
-    intensities = np.array(list(df["single_electron_spectrum_image"]))
-    mag_fields = np.array(list(df["undulator_verticalAmplitude"]))
 
-    lookup = pd.DataFrame(columns=["mag_field", "energy"])
+def _get_spectra_arrays(df):
+    """
+    Return the (energies, intensities, mag_fields) arrays of a spectra table.
 
-    if ax is None:
-        fig, ax = plt.subplots(nrows=1, ncols=1)
+    The spectra of different lengths (e.g. from the windowed scan) are padded to
+    the longest one by repeating their last sample, which adds no peaks.
+    """
+    arrays = []
+    for key in SPECTRA_COLUMNS:
+        column = df[key]
+        if isinstance(column, np.ndarray):
+            arrays.append(column)
+            continue
+        rows = [np.asarray(row) for row in column]
+        lengths = {row.size for row in rows if row.ndim == 1}
+        if len(lengths) > 1:
+            length = max(lengths)
+            rows = [np.pad(row, (0, length - row.size), mode="edge") for row in rows]
+        arrays.append(np.array(rows))
+    return tuple(arrays)
 
-    ax.grid(visible=True)
-    ax.set_xlabel("Vertical Magn. Field [T]")
-    ax.set_ylabel("Energy [eV]")
-    ax.set_title(f"Energy vs. Magn. Field")
 
-    for i in range(len(df)):
-        energy, intensity, mag_field = energies[i], intensities[i], mag_fields[i]
+def _local_maxima(intensities):
+    """
+    Find the local maxima of each row of the 2D intensity matrix.
+
+    Returns the (row, column) indices of the samples which are strictly greater
+    than both of their neighbors, sorted in the row-major order.
+    """
+    center = intensities[:, 1:-1]
+    mask = (center > intensities[:, :-2]) & (center > intensities[:, 2:])
+    rows, cols = np.nonzero(mask)
+    return rows, cols + 1
+
+
+def _relative_heights(intensities, rows, cols, method="scipy"):
+    """
+    Return the heights of the peaks relative to their spectrum, in the same units
+    as the ``thres`` parameter of the corresponding ``method``.
+    """
+    heights = intensities[rows, cols]
+    if method == "scipy":
+        return heights / intensities.max(axis=1)[rows]
+    elif method == "peakutils":
+        min_ = intensities.min(axis=1)[rows]
+        return (heights - min_) / (intensities.max(axis=1)[rows] - min_)
+    raise ValueError(f"Unknown method: {method}. Allowed methods: {PEAK_METHODS}")
+
+
+def _filter_peaks(rows, heights, filter_thres):
+    """
+    Return the mask of the peaks which survive the ``filter_thres`` filter: a peak is
+    kept if it is the first peak of its spectrum or if its ratio to the previous
+    peak is above ``filter_thres``.
+    """
+    same_row = rows[1:] == rows[:-1]
+    ratios = heights[1:] / heights[:-1]
+    return np.r_[
+        np.ones(min(len(rows), 1), dtype=bool), ~same_row | (ratios > filter_thres)
+    ]
+
+
+def _to_peaks(num_spectra, rows, cols, energies, intensities):
+    """Pack the (row, column) indices of the peaks into the ragged ``Peaks`` form."""
+    offsets = np.zeros(num_spectra + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_spectra), out=offsets[1:])
+    if energies.ndim == 1:
+        peak_energies = energies[cols]
+    else:
+        peak_energies = energies[rows, cols]
+    return Peaks(offsets, cols, peak_energies, intensities[rows, cols])
+
+
+def detect_peaks(energies, intensities, method="scipy", thres=0.10, filter_thres=0.2):
+    """
+    Find the filtered peaks of all spectra of a scan at once.
+
+    This is the plotting-free engine behind ``plot_all_peaks()``. The threshold
+    semantics follow the corresponding ``method``: ``intensity.max() * thres`` for
+    "scipy" and ``thres * (intensity.max() - intensity.min()) + intensity.min()``
+    for "peakutils". Plateau peaks (several equal samples at the top) are not
+    detected, which is irrelevant for the simulated spectra.
+
+    Parameters
+    ----------
+    energies : numpy.ndarray
+        The energy grid, either shared by all spectra (shape ``(M,)``) or one row
+        per spectrum (shape ``(N, M)``).
+    intensities : numpy.ndarray
+        The ``(N, M)`` intensity matrix.
+    method : str, optional
+        The thresholding method, one of ``PEAK_METHODS``.
+    thres : float, optional
+        The peak detection threshold relative to the spectrum.
+    filter_thres : float or None, optional
+        The minimal ratio of a peak to the previous peak of the same spectrum
+        (None keeps all the peaks above ``thres``).
+
+    Returns
+    -------
+    peaks : Peaks
+        The detected peaks in the ragged-array form.
+
+    Usage
+    -----
+
+        energies, intensities, mag_fields = _get_spectra_arrays(df)
+        peaks = detect_peaks(energies, intensities, method="peakutils", thres=0.05)
+        all_energies = split_peaks(peaks, mag_fields)
+    """
+    intensities = np.asarray(intensities)
+    energies = np.asarray(energies)
+    rows, cols = _local_maxima(intensities)
+
+    heights = _relative_heights(intensities, rows, cols, method=method)
+    if method == "scipy":
+        above = heights >= thres
+    else:
+        above = heights > thres
+    rows, cols = rows[above], cols[above]
 
-        idx = peakutils.indexes(intensity, thres=thres)
-        # idx = scipy.signal.find_peaks(intensity, height=intensity.max() * thres)[0]
+    if filter_thres is not None:
+        keep = _filter_peaks(rows, intensities[rows, cols], filter_thres)
+        rows, cols = rows[keep], cols[keep]
+    return _to_peaks(len(intensities), rows, cols, energies, intensities)
 
-        filtered_peaks_idx = [idx[0]]
 
-        for idx in idx[1:]:
-            print(
-                f"{intensity[idx] = :2g}  {intensity[idx-1] =:2e}  {intensity[idx-1] / intensity[idx] = }"
+def split_peaks(peaks, mag_fields):
+    """
+    Convert the ragged ``Peaks`` to the ``{mag_field: peak_energies}`` dictionary
+    used by ``create_harmonics_dataframe()``.
+    """
+    return {
+        mag_field: peaks.energies[start:stop]
+        for mag_field, start, stop in zip(
+            mag_fields, peaks.offsets[:-1], peaks.offsets[1:]
+        )
+    }
+
+
+def _select_by_height(rows, rel_heights, num_spectra, thresholds, inclusive):
+    """
+    Select the candidate peaks above each threshold using the candidates sorted by
+    their relative height within each spectrum.
+
+    The sort key places every spectrum in its own unit interval and orders its
+    candidates from the highest to the lowest one, so the peaks above a threshold
+    are a prefix of each spectrum's block, found with a binary search. Yields the
+    indices of the selected candidates in the original (row-major) order.
+    """
+    key = rows + (1 - rel_heights) * 0.5
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+    spectra = np.arange(num_spectra)
+    starts = np.searchsorted(key, spectra, side="left")
+    side = "right" if inclusive else "left"
+    for thres in thresholds:
+        counts = np.searchsorted(key, spectra + (1 - thres) * 0.5, side=side) - starts
+        shifts = starts - np.r_[0, np.cumsum(counts)[:-1]]
+        selected = np.repeat(shifts, counts) + np.arange(counts.sum())
+        yield np.sort(order[selected])
+
+
+def _sweep_chunk(energies, intensities, params):
+    """
+    Detect the candidate peaks of a chunk of spectra once and answer all the
+    (method, thres, filter_thres) combinations from them.
+    """
+    rows, cols = _local_maxima(intensities)
+    heights = intensities[rows, cols]
+    results = {}
+    for method in {method for method, _, _ in params}:
+        method_params = [p for p in params if p[0] == method]
+        selections = _select_by_height(
+            rows,
+            _relative_heights(intensities, rows, cols, method=method),
+            len(intensities),
+            [thres for _, thres, _ in method_params],
+            inclusive=(method == "scipy"),
+        )
+        for (_, thres, filter_thres), selected in zip(method_params, selections):
+            keep = selected[
+                _filter_peaks(rows[selected], heights[selected], filter_thres)
+            ]
+            results[(method, thres, filter_thres)] = _to_peaks(
+                len(intensities), rows[keep], cols[keep], energies, intensities
             )
-            if intensity[idx - 1] / intensity[idx] >= filter_thres:
-                filtered_peaks_idx.append(idx)
+    return results
+
+
+def sweep_peaks(df, params, chunk_size=64, max_workers=None):
+    """
+    Find peaks for many (method, thres, filter_thres) combinations in one pass.
+
+    The candidate peaks of every spectrum are detected once, and each combination
+    is then answered as a cheap filter of the candidates. Chunks of ``chunk_size``
+    spectra are processed in parallel in a process pool (a single chunk, or
+    ``max_workers=1``, is processed in the current process).
 
-        print(
-            f"{energy[filtered_peaks_idx][harm_num] = :8.3f} [eV]  "
-            f"{intensity[filtered_peaks_idx][harm_num] = :3g} [arb.u.]  "
-            f"{mag_field = :.3f} [T]"
+    Returns a tidy dataframe with one row per detected peak.
+
+    Usage
+    -----
+
+        params = [
+            (method, thres, 0.20)
+            for method in ["scipy", "peakutils"]
+            for thres in [0.05, 0.07, 0.10]
+        ]
+        peaks_df = sweep_peaks(df, params)
+        peaks_df.groupby(["method", "thres"]).size()
+
+    """
+    params = [(method, float(thres), float(fthres)) for method, thres, fthres in params]
+    for method, _, _ in params:
+        if method not in PEAK_METHODS:
+            raise ValueError(
+                f"Unknown method: {method}. Allowed methods: {PEAK_METHODS}"
+            )
+
+    energies, intensities, mag_fields = _get_spectra_arrays(df)
+    starts = range(0, len(intensities), chunk_size)
+    chunks = [
+        (
+            energies if energies.ndim == 1 else energies[start : start + chunk_size],
+            intensities[start : start + chunk_size],
+            params,
         )
+        for start in starts
+    ]
+
+    if max_workers == 1 or len(chunks) == 1:
+        chunk_results = [_sweep_chunk(*chunk) for chunk in chunks]
+    else:
+        # The functions of the profile live in the IPython namespace, so the workers
+        # have to be forked to see them.
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            chunk_results = list(executor.map(_sweep_chunk, *zip(*chunks)))
+
+    tables = []
+    for param in params:
+        for start, results in zip(starts, chunk_results):
+            peaks = results[param]
+            counts = np.diff(peaks.offsets)
+            spectra = np.repeat(np.arange(len(counts)), counts) + start
+            tables.append(
+                pd.DataFrame(
+                    {
+                        "method": param[0],
+                        "thres": param[1],
+                        "filter_thres": param[2],
+                        "spectrum": spectra,
+                        "mag_field": mag_fields[spectra],
+                        "peak": np.arange(len(spectra))
+                        - np.repeat(peaks.offsets[:-1], counts),
+                        "index": peaks.indices,
+                        "energy": peaks.energies,
+                        "intensity": peaks.intensities,
+                    }
+                )
+            )
+
+    return pd.concat(tables, ignore_index=True)
+
+
+def _filter_rising_edges(peaks, energies, intensities, filter_thres):
+    """
+    Keep the first peak of each spectrum and the peaks whose previous sample is at
+    least ``filter_thres`` of the peak, which rejects the narrow peaks rising
+    within one sample.
+    """
+    rows = np.repeat(np.arange(len(intensities)), np.diff(peaks.offsets))
+    cols = peaks.indices
+    keep = intensities[rows, cols - 1] / peaks.intensities >= filter_thres
+    keep[peaks.offsets[:-1][np.diff(peaks.offsets) > 0]] = True
+    return _to_peaks(len(intensities), rows[keep], cols[keep], energies, intensities)
 
-        lookup.loc[len(lookup)] = mag_field, energy[filtered_peaks_idx][harm_num]
+
+def find_peaks(df, harm_num=0, thres=0.10, filter_thres=0.2, ax=None):
+    """
+    Find the energy of the peak ``harm_num`` (0 is the first peak) of each spectrum
+    of the pandas dataframe and plot it against the magnetic field.
+
+    The peaks are detected by ``detect_peaks()`` with the "peakutils" method, but
+    filtered like the peaks of the original ``find_peaks()``: a peak is kept if it
+    is the first peak of its spectrum or if the sample right before it is at least
+    ``filter_thres`` of the peak (see ``_filter_rising_edges()``), so the lookup
+    tables are the same as before. The spectra with fewer peaks are left out of
+    the returned lookup table.
+    """
+    energies, intensities, mag_fields = _get_spectra_arrays(df)
+    peaks = detect_peaks(
+        energies, intensities, method="peakutils", thres=thres, filter_thres=None
+    )
+    peaks = _filter_rising_edges(peaks, energies, intensities, filter_thres)
+    found = np.diff(peaks.offsets) > harm_num
+    lookup = pd.DataFrame(
+        {
+            "mag_field": mag_fields[found],
+            "energy": peaks.energies[peaks.offsets[:-1][found] + harm_num],
+        }
+    )
+
+    if ax is None:
+        fig, ax = plt.subplots(nrows=1, ncols=1)
+
+    ax.grid(visible=True)
+    ax.set_xlabel("Vertical Magn. Field [T]")
+    ax.set_ylabel("Energy [eV]")
+    ax.set_title(f"Energy vs. Magn. Field")
 
     ax.plot(
         lookup["mag_field"],
@@ -66,6 +361,33 @@ def find_peaks(df, harm_num=0, thres=0.10, filter_thres=0.2, ax=None):
     return lookup
 
 
+def _draw_all_peaks(fig, axes, title, energies, intensities, mag_fields, peaks):
+    """Draw the spectra with their peaks into the axes (one spectrum per axis)."""
+    fig.suptitle(title)
+    for i, ax in enumerate(axes):
+        ax.grid()
+        energy = energies if energies.ndim == 1 else energies[i]
+        intensity, mag_field = intensities[i], mag_fields[i]
+        filtered_peaks_idx = peaks.indices[peaks.offsets[i] : peaks.offsets[i + 1]]
+
+        ax.plot(energy, intensity, label=f"{i:3d}: {mag_field:.2f}T full")
+        ax.plot(
+            energy[filtered_peaks_idx],
+            intensity[filtered_peaks_idx],
+            marker="x",
+            label=f"{i:3d}: {mag_field:.2f}T peaks",
+        )
+        ax.legend(prop={"size": 6})
+    fig.tight_layout()
+
+
+def _get_peaks_title(method, thres, filter_thres):
+    return (
+        f"{method} / threshold={thres * 100:.0f}% / "
+        f"filter threshold={filter_thres * 100:.0f}%"
+    )
+
+
 def plot_all_peaks(
     df, method="scipy", thres=0.10, filter_thres=0.2, num_plots=21, ncols=7, nrows=3
 ):
@@ -78,63 +400,123 @@ def plot_all_peaks(
 
     """
 
-    allowed_methods = ["scipy", "peakutils"]
-    if method not in allowed_methods:
-        raise ValueError("Unknown method: {method}. Allowed methods: {allowed_methods}")
+    if method not in PEAK_METHODS:
+        raise ValueError(f"Unknown method: {method}. Allowed methods: {PEAK_METHODS}")
 
-    energies = np.array(list(df["single_electron_spectrum_photon_energy"]))
-    intensities = np.array(list(df["single_electron_spectrum_image"]))
-    mag_fields = np.array(list(df["undulator_verticalAmplitude"]))
+    energies, intensities, mag_fields = _get_spectra_arrays(df)
+    peaks = detect_peaks(
+        energies, intensities, method=method, thres=thres, filter_thres=filter_thres
+    )
+    all_energies = split_peaks(peaks, mag_fields)
 
     fig, axes = plt.subplots(ncols=ncols, nrows=nrows, figsize=(ncols * 4, nrows * 3))
-    fig.suptitle(
-        f"{method} / threshold={thres * 100:.0f}% / filter threshold={filter_thres * 100:.0f}%"
+    _draw_all_peaks(
+        fig,
+        axes.ravel()[:num_plots],
+        _get_peaks_title(method, thres, filter_thres),
+        energies,
+        intensities,
+        mag_fields,
+        peaks,
     )
+    fig.savefig(f"{method}-{thres:.2f}.png")
 
-    all_energies = {}
+    return all_energies
 
-    for i in range(num_plots):
-        ax = axes.ravel()[i]
-        ax.grid()
-        energy, intensity, mag_field = energies[i], intensities[i], mag_fields[i]
 
-        # TODO: implement it via the `find_peaks()` function.
-        if method == "scipy":
-            peaks_idx = scipy.signal.find_peaks(
-                intensity, height=intensity.max() * thres
-            )[0]
-        elif method == "peakutils":
-            peaks_idx = peakutils.indexes(intensity, thres=thres)
+def _render_peaks_report(
+    path, title, ncols, nrows, energies, intensities, mag_fields, peaks
+):
+    """Render the grid of spectra with their peaks into a file (without pyplot)."""
+    fig = Figure(figsize=(ncols * 4, nrows * 3))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(ncols=ncols, nrows=nrows, squeeze=False)
+    _draw_all_peaks(
+        fig,
+        axes.ravel()[: len(intensities)],
+        title,
+        energies,
+        intensities,
+        mag_fields,
+        peaks,
+    )
+    fig.savefig(path)
+    return path
 
-        print(f"{i = }")
 
-        diff_ratios = np.exp(np.diff(np.log(intensity[peaks_idx])))
-        filtered_peaks_idx = peaks_idx[np.r_[True, diff_ratios > filter_thres]]
+def render_peak_reports(
+    df,
+    params,
+    path="{method}-{thres:.2f}.png",
+    num_plots=21,
+    ncols=7,
+    nrows=3,
+    max_workers=None,
+):
+    """
+    Render the report grids of ``plot_all_peaks()`` for many parameters in parallel.
 
-        # filtered_peaks_idx = [peaks_idx[0]]
-        # for idx in peaks_idx[1:]:
-        #     print(f"{intensity[idx] = :2g}  {intensity[idx-1] = :2g}  {intensity[idx-1] / intensity[idx] = :0.3f}")
-        #     if intensity[idx] / intensity[filtered_peaks_idx[-1]] > filter_thres:
-        #         filtered_peaks_idx.append(idx)
-        #     else:
-        #         print(f"  Removing peak idx {idx}")
+    The peaks are detected in the session, and the figures are rendered with the
+    Agg canvas in a pool of worker processes, so the session is not blocked. The
+    ``path`` of each report is formatted with its ``method``, ``thres`` and
+    ``filter_thres``.
 
-        print(f"{len(peaks_idx) = } -> {len(filtered_peaks_idx) = }\n")
+    Returns the ``{(method, thres, filter_thres): future}`` dictionary of the
+    ``concurrent.futures.Future`` of the path of each report.
 
-        ax.plot(energy, intensity, label=f"{i:3d}: {mag_field:.2f}T full")
-        ax.plot(
-            energy[filtered_peaks_idx],
-            intensity[filtered_peaks_idx],
-            marker="x",
-            label=f"{i:3d}: {mag_field:.2f}T peaks",
-        )
-        ax.legend(prop={"size": 6})
-        plt.tight_layout()
-        plt.savefig(f"{method}-{thres:.2f}.png")
+    Usage
+    -----
 
-        all_energies[mag_fields[i]] = energy[filtered_peaks_idx]
+        params = [
+            (method, thres, 0.20)
+            for method in ["scipy", "peakutils"]
+            for thres in [0.05, 0.07, 0.10]
+        ]
+        futures = render_peak_reports(df, params)
+        paths = [future.result() for future in futures.values()]
 
-    return all_energies
+    """
+    energies, intensities, mag_fields = _get_spectra_arrays(df)
+    energies = energies if energies.ndim == 1 else energies[:num_plots]
+    intensities, mag_fields = intensities[:num_plots], mag_fields[:num_plots]
+
+    params = list(params)
+    for method, _, _ in params:
+        if method not in PEAK_METHODS:
+            raise ValueError(
+                f"Unknown method: {method}. Allowed methods: {PEAK_METHODS}"
+            )
+    all_peaks = {
+        (method, thres, filter_thres): detect_peaks(
+            energies, intensities, method=method, thres=thres, filter_thres=filter_thres
+        )
+        for method, thres, filter_thres in params
+    }
+
+    # The functions of the profile live in the IPython namespace, so the workers
+    # have to be forked to see them.
+    executor = ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("fork")
+    )
+    try:
+        futures = {
+            (method, thres, filter_thres): executor.submit(
+                _render_peaks_report,
+                path.format(method=method, thres=thres, filter_thres=filter_thres),
+                _get_peaks_title(method, thres, filter_thres),
+                ncols,
+                nrows,
+                energies,
+                intensities,
+                mag_fields,
+                peaks,
+            )
+            for (method, thres, filter_thres), peaks in all_peaks.items()
+        }
+    finally:
+        # The submitted reports are still rendered, the workers exit when done.
+        executor.shutdown(wait=False)
+    return futures
 
 
 def create_harmonics_dataframe(all_energies, harmonic_list=[1, 3, 5]):
@@ -187,3 +569,483 @@ def load_harmonics_json(path=HARMONICS_JSON):
 
     """
     return pd.read_json(path)
+
+
+class HarmonicsModel:
+    """
+    Closed-form energies of the undulator harmonics vs. the magnetic field.
+
+    The energy of the harmonic ``n`` is ``E_n(B) = n * e0 / (1 + (k * B)**2 / 2)``,
+    where ``e0`` is the energy of the fundamental at zero field and ``k = K / B``
+    is the deflection parameter per tesla (``0.0934 * period[mm]``). The model is
+    fitted to the peaks of the measured spectra with ``fit_harmonics_model()``.
+
+    Usage
+    -----
+
+        harmonics_model = fit_harmonics_model(all_energies)
+        harmonics_model.energy(0.5, harm_num=3)
+        harmonics_model.magn_field(500.0, harm_num=3)
+        df_harm = harmonics_model.harmonics_dataframe(df_harm["magn_field"])
+
+    """
+
+    def __init__(self, e0, k, **stats):
+        self.e0 = float(e0)
+        self.k = float(k)
+        self.stats = stats
+
+    def __repr__(self):
+        return f"{type(self).__name__}(e0={self.e0!r}, k={self.k!r})"
+
+    def energy(self, magn_field, harm_num=1):
+        """Return the energy of the harmonic (float or array_like magn_field)."""
+        magn_field = np.asarray(magn_field, dtype=float)
+        return harm_num * self.e0 / (1 + (self.k * magn_field) ** 2 / 2)
+
+    def magn_field(self, energy, harm_num=1):
+        """
+        Return the magnetic field for the energy (float or array_like) of the harmonic.
+
+        Raises ValueError for the energies which cannot be reached with this
+        harmonic (out of the ``(0, harm_num * e0]`` range).
+        """
+        energy = np.asarray(energy, dtype=float)
+        max_energy = harm_num * self.e0
+        reachable = (energy > 0) & (energy <= max_energy)
+        if not np.all(reachable):
+            unreachable = np.atleast_1d(energy)[~np.atleast_1d(reachable)]
+            raise ValueError(
+                f"The energies {unreachable} eV cannot be reached with the harmonic "
+                f"{harm_num} (up to {max_energy:.1f} eV)"
+            )
+        return np.sqrt(2 * (max_energy / energy - 1)) / self.k
+
+    def harmonics_dataframe(self, magn_field, harmonic_list=[1, 3, 5]):
+        """Tabulate the model like ``create_harmonics_dataframe()`` does."""
+        magn_field = np.asarray(magn_field, dtype=float)
+        data = {"magn_field": magn_field}
+        for harm_num in harmonic_list:
+            data[f"harmonic{harm_num}"] = self.energy(magn_field, harm_num)
+        return pd.DataFrame(data)
+
+    def to_dict(self):
+        return {"e0": self.e0, "k": self.k, **self.stats}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+
+def assign_harmonics(all_energies, model, outlier_thres=5.0):
+    """
+    Assign the harmonic numbers to the peaks of all spectra using the model.
+
+    Each peak is assigned to the closest odd harmonic of the model. The peaks
+    farther than ``outlier_thres`` robust standard deviations (from the median
+    absolute deviation) from their harmonic are marked as outliers.
+
+    Returns a tidy dataframe with the "magn_field", "energy", "harm_num",
+    "residual" (in eV) and "outlier" columns, one row per peak.
+
+    Usage
+    -----
+
+        df_peaks = assign_harmonics(all_energies, harmonics_model)
+        df_peaks[df_peaks["outlier"]]
+
+    """
+    magn_field = np.concatenate(
+        [np.full(len(energies), field) for field, energies in all_energies.items()]
+    )
+    energy = np.concatenate([np.asarray(e, dtype=float) for e in all_energies.values()])
+    return _assign_harmonics(magn_field, energy, model, outlier_thres=outlier_thres)
+
+
+def _assign_harmonics(magn_field, energy, model, outlier_thres=5.0):
+    """``assign_harmonics()`` for the flat arrays of the peaks (one item per peak)."""
+    fundamental = model.energy(magn_field)
+    harm_num = np.maximum(2 * np.round((energy / fundamental - 1) / 2) + 1, 1)
+    residual = energy - harm_num * fundamental
+    scale = max(1.4826 * np.median(np.abs(residual)), np.finfo(float).eps)
+    return pd.DataFrame(
+        {
+            "magn_field": magn_field,
+            "energy": energy,
+            "harm_num": harm_num.astype(int),
+            "residual": residual,
+            "outlier": np.abs(residual) > outlier_thres * scale,
+        }
+    )
+
+
+def fit_harmonics_model(all_energies, outlier_thres=5.0, max_iter=20):
+    """
+    Fit the ``HarmonicsModel`` to the peaks found in the spectra of a scan.
+
+    The initial model is a robust linear fit of ``1 / E_1`` vs. ``B**2``, where the
+    fundamental ``E_1`` of each spectrum is estimated from the spacing of its peaks
+    (``2 * E_1`` between the odd harmonics), so it does not depend on the first
+    peak being found. Then the peaks are assigned to the harmonics
+    (``assign_harmonics()``) and the model is refitted to the non-outlier peaks
+    with a robust (soft L1) loss, until the assignment does not change anymore.
+    This links the peaks across the magnetic fields, so a missing or a spurious
+    peak does not shift the harmonics of the spectrum like it does in
+    ``create_harmonics_dataframe()``.
+
+    Usage
+    -----
+
+        all_energies = plot_all_peaks(df)  # or harmonics_extractor.all_energies
+        harmonics_model = fit_harmonics_model(all_energies)
+        save_harmonics_model(harmonics_model)
+
+    """
+    all_energies = {
+        field: energies for field, energies in all_energies.items() if len(energies)
+    }
+    magn_field = np.array(list(all_energies.keys()), dtype=float)
+    fundamental = np.array(
+        [
+            np.median(np.diff(energies)) / 2 if len(energies) > 1 else energies[0]
+            for energies in all_energies.values()
+        ],
+        dtype=float,
+    )
+    result = least_squares(
+        lambda p: 1 / fundamental - (p[0] + p[1] * magn_field**2),
+        [1 / fundamental.max(), 0.0],
+        loss="soft_l1",
+        f_scale=np.median(1 / fundamental) * 1e-2,
+    )
+    inv_e0, slope = result.x
+    model = HarmonicsModel(1 / inv_e0, np.sqrt(2 * max(slope, 0) / inv_e0))
+
+    assignment = None
+    for _ in range(max_iter):
+        df_peaks = assign_harmonics(all_energies, model, outlier_thres=outlier_thres)
+        current = df_peaks[["harm_num", "outlier"]].to_numpy()
+        if assignment is not None and np.array_equal(current, assignment):
+            break
+        assignment = current
+
+        inliers = df_peaks[~df_peaks["outlier"]]
+        scale = max(1.4826 * np.median(np.abs(inliers["residual"])), 1e-6)
+        result = least_squares(
+            lambda p: inliers["energy"]
+            - HarmonicsModel(*p).energy(inliers["magn_field"], inliers["harm_num"]),
+            [model.e0, model.k],
+            loss="soft_l1",
+            f_scale=scale,
+        )
+        model = HarmonicsModel(*result.x)
+
+    residual = df_peaks["residual"][~df_peaks["outlier"]]
+    model.stats = {
+        "num_peaks": int(len(df_peaks)),
+        "num_outliers": int(df_peaks["outlier"].sum()),
+        "rms_residual": float(np.sqrt(np.mean(residual**2))),
+        "magn_field_range": [float(magn_field.min()), float(magn_field.max())],
+    }
+    return model
+
+
+def save_harmonics_model(model, path=HARMONICS_MODEL_JSON):
+    """
+    Usage
+    -----
+
+        save_harmonics_model(harmonics_model, path="data/harmonics-model.json")
+
+    """
+    with open(path, "w") as f:
+        json.dump({"version": HARMONICS_MODEL_VERSION, **model.to_dict()}, f, indent=2)
+
+
+def load_harmonics_model(path=HARMONICS_MODEL_JSON):
+    """
+    Usage
+    -----
+
+        harmonics_model = load_harmonics_model(path="data/harmonics-model.json")
+
+    """
+    with open(path) as f:
+        d = json.load(f)
+    version = d.pop("version", None)
+    if version != HARMONICS_MODEL_VERSION:
+        raise ValueError(
+            f"Unsupported harmonics model version {version} in {path}. "
+            f"Supported version: {HARMONICS_MODEL_VERSION}"
+        )
+    return HarmonicsModel.from_dict(d)
+
+
+class FluxMap:
+    """
+    Peak flux of the undulator harmonics vs. the energy, from the measured spectra.
+
+    The peaks of the spectra of a scan are assigned to the harmonics of a
+    ``HarmonicsModel`` (see ``assign_harmonics()``), and for each harmonic the
+    (energy, magnetic field, flux) of its peaks are stored sorted by energy. The
+    flux of a harmonic at any energy within the range of its peaks is linearly
+    interpolated between the two neighbouring peaks, found by binary search, so
+    the best harmonic is looked up in logarithmic time.
+
+    Usage
+    -----
+
+        flux_map = FluxMap.from_spectra(df, harmonics_model)
+        flux_map.flux(500.0, harm_num=3)
+        harm_num, magn_field, flux = flux_map.best_harmonic(500.0)
+        save_flux_map(flux_map, path="data/flux-map.json")
+
+    """
+
+    def __init__(self, tables):
+        self.tables = {
+            int(harm_num): {
+                key: np.asarray(table[key], dtype=float)
+                for key in ["energy", "magn_field", "flux"]
+            }
+            for harm_num, table in tables.items()
+        }
+
+    def __repr__(self):
+        return f"{type(self).__name__}(harmonics={self.harmonics})"
+
+    @classmethod
+    def from_spectra(
+        cls, df, model, method="scipy", thres=0.10, filter_thres=0.2, outlier_thres=5.0
+    ):
+        """Build the map from the spectra of a scan (a dataframe or an archive)."""
+        energies, intensities, mag_fields = _get_spectra_arrays(df)
+        peaks = detect_peaks(
+            energies, intensities, method=method, thres=thres, filter_thres=filter_thres
+        )
+        # One row per peak, also when several spectra have the same magnetic field:
+        df_peaks = _assign_harmonics(
+            np.repeat(mag_fields, np.diff(peaks.offsets)),
+            peaks.energies,
+            model,
+            outlier_thres=outlier_thres,
+        )
+        df_peaks["flux"] = peaks.intensities
+        df_peaks = df_peaks[~df_peaks["outlier"]].sort_values("energy")
+        return cls(
+            {
+                harm_num: table[["energy", "magn_field", "flux"]].to_dict("list")
+                for harm_num, table in df_peaks.groupby("harm_num")
+            }
+        )
+
+    @property
+    def harmonics(self):
+        return sorted(self.tables)
+
+    def flux(self, energy, harm_num):
+        """
+        Return the flux of the harmonic at the energy (float or array_like).
+
+        The flux is NaN outside of the energy range of the peaks of the harmonic.
+        """
+        table = self.tables[harm_num]
+        return np.interp(
+            energy, table["energy"], table["flux"], left=np.nan, right=np.nan
+        )
+
+    def best_harmonic(self, energy, harmonic_list=None):
+        """
+        Return the (harm_num, magn_field, flux) with the highest flux at the energy.
+
+        Only the harmonics of ``harmonic_list`` (all harmonics by default) are
+        considered. Returns None if none of them covers the energy.
+        """
+        if harmonic_list is None:
+            harmonic_list = self.harmonics
+        best = None
+        for harm_num in harmonic_list:
+            table = self.tables.get(harm_num)
+            if table is None:
+                continue
+            # energies[lo] < energy <= energies[hi], or lo == hi at the first peak:
+            hi = np.searchsorted(table["energy"], energy)
+            if hi == len(table["energy"]) or (hi == 0 and table["energy"][0] != energy):
+                continue
+            lo = max(hi - 1, 0)
+            e_lo, e_hi = table["energy"][lo], table["energy"][hi]
+            fraction = 0.0 if hi == lo else (energy - e_lo) / (e_hi - e_lo)
+            flux, magn_field = [
+                values[lo] + fraction * (values[hi] - values[lo])
+                for values in [table["flux"], table["magn_field"]]
+            ]
+            if best is None or flux > best[2]:
+                best = (harm_num, float(magn_field), float(flux))
+        return best
+
+    def to_dataframe(self):
+        """Return the map as a tidy dataframe, one row per peak."""
+        return pd.concat(
+            [
+                pd.DataFrame({"harm_num": harm_num, **table})
+                for harm_num, table in self.tables.items()
+            ],
+            ignore_index=True,
+        )
+
+    def to_dict(self):
+        return {
+            "tables": {
+                str(harm_num): {key: list(values) for key, values in table.items()}
+                for harm_num, table in self.tables.items()
+            }
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["tables"])
+
+
+def save_flux_map(flux_map, path=FLUX_MAP_JSON):
+    """
+    Usage
+    -----
+
+        save_flux_map(flux_map, path="data/flux-map.json")
+
+    """
+    with open(path, "w") as f:
+        json.dump({"version": FLUX_MAP_VERSION, **flux_map.to_dict()}, f)
+
+
+def load_flux_map(path=FLUX_MAP_JSON):
+    """
+    Usage
+    -----
+
+        flux_map = load_flux_map(path="data/flux-map.json")
+
+    """
+    with open(path) as f:
+        d = json.load(f)
+    version = d.pop("version", None)
+    if version != FLUX_MAP_VERSION:
+        raise ValueError(
+            f"Unsupported flux map version {version} in {path}. "
+            f"Supported version: {FLUX_MAP_VERSION}"
+        )
+    return FluxMap.from_dict(d)
+
+
+class SpectraArchive:
+    """
+    Lazy, memory-mapped view of the spectra exported with ``export_spectra()``.
+
+    The columns are returned as read-only ``numpy.memmap`` arrays, so only the
+    spectra which are actually accessed are read from disk.
+    """
+
+    def __init__(self, path, rows=None):
+        with open(os.path.join(path, "metadata.json")) as f:
+            self.metadata = json.load(f)
+        version = self.metadata.get("version")
+        if version != SPECTRA_ARCHIVE_VERSION:
+            raise ValueError(
+                f"Unsupported spectra archive version {version} in {path}. "
+                f"Supported version: {SPECTRA_ARCHIVE_VERSION}"
+            )
+        self.path = path
+        self._rows = slice(None) if rows is None else rows
+        self._arrays = {
+            key: np.load(os.path.join(path, f"{key}.npy"), mmap_mode="r")[self._rows]
+            for key in self.metadata["columns"]
+        }
+
+    def __getitem__(self, key):
+        return self._arrays[key]
+
+    def __len__(self):
+        return len(self._arrays[SPECTRA_COLUMNS[-1]])
+
+    def keys(self):
+        return self._arrays.keys()
+
+    def select(self, rows):
+        """Return the archive restricted to the spectra selected by ``rows``."""
+        if isinstance(self._rows, slice):
+            selected = range(self.metadata["num_spectra"])[self._rows]
+        else:
+            selected = np.asarray(self._rows)
+        if isinstance(selected, range) and isinstance(rows, slice):
+            selected = selected[rows]
+            if selected.step > 0:
+                # Slices keep the columns as views of the memory-mapped files.
+                return SpectraArchive(
+                    self.path, rows=slice(selected.start, selected.stop, selected.step)
+                )
+            # A negative step can stop before the first spectrum, which a slice
+            # cannot express, so the rows are listed:
+            return SpectraArchive(self.path, rows=np.asarray(selected))
+        return SpectraArchive(self.path, rows=np.asarray(selected)[rows])
+
+    def to_dataframe(self):
+        """Load the archive into a dataframe like the one from ``pd.read_json()``."""
+        return pd.DataFrame({key: list(value) for key, value in self._arrays.items()})
+
+
+def export_spectra(df, path=SPECTRA_ARCHIVE, chunk_size=64, md=None):
+    """
+    Export the spectra of a scan into a directory of contiguous ``.npy`` arrays.
+
+    Each column listed in ``SPECTRA_COLUMNS`` is written chunk by chunk into its own
+    typed array, and the shapes, dtypes and the ``md`` dictionary are stored in
+    ``metadata.json`` next to them.
+
+    Usage
+    -----
+
+        hdr = db[uid]
+        tbl = hdr.table(fill=True)
+        export_spectra(tbl, path="data/scan-spectra-vs-und-magn-field.spectra")
+
+    """
+    os.makedirs(path, exist_ok=True)
+    num_spectra = len(df)
+    columns = {}
+    for key in SPECTRA_COLUMNS:
+        values = df[key]
+        first = np.asarray(values.iloc[0] if hasattr(values, "iloc") else values[0])
+        array = np.lib.format.open_memmap(
+            os.path.join(path, f"{key}.npy"),
+            mode="w+",
+            dtype=np.float64,
+            shape=(num_spectra, *first.shape),
+        )
+        for start in range(0, num_spectra, chunk_size):
+            chunk = values[start : start + chunk_size]
+            array[start : start + len(chunk)] = np.array(list(chunk))
+        array.flush()
+        columns[key] = {"dtype": str(array.dtype), "shape": list(array.shape)}
+        del array
+
+    metadata = {
+        "version": SPECTRA_ARCHIVE_VERSION,
+        "num_spectra": num_spectra,
+        "columns": columns,
+        "md": md or {},
+    }
+    with open(os.path.join(path, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+
+def load_spectra(path=SPECTRA_ARCHIVE):
+    """
+    Usage
+    -----
+
+        spectra = load_spectra(path="data/scan-spectra-vs-und-magn-field.spectra")
+        lookup_harm1 = find_peaks(spectra, harm_num=0)
+        all_energies = plot_all_peaks(spectra.select(slice(0, 21)), method="scipy")
+
+    """
+    return SpectraArchive(path)
@@ -0,0 +1,224 @@
+startup_timer.start_file(__file__)
+
+import bluesky.plan_stubs as bps
+import bluesky.preprocessors as bpp
+import numpy as np
+from bluesky.callbacks.core import CallbackBase
+from event_model import Filler
+from ophyd import Signal
+
+
+def read_table_stream(df, stream_name):
+    """Read the rows of the dataframe as the events of the ``stream_name`` stream."""
+    signals = [Signal(name=column, value=np.nan) for column in df.columns]
+    for _, row in df.iterrows():
+        for signal in signals:
+            signal.put(float(row[signal.name]))
+        yield from bps.trigger_and_read(signals, name=stream_name)
+
+
+def secondary_streams_wrapper(plan, sources):
+    """
+    Read the secondary streams of the ``sources`` into each run of the plan.
+
+    Right before each ``close_run`` message, the plans returned by the
+    ``stream_plan()`` method of the sources (callbacks which collected data
+    during the run) are inserted, so their streams are regular event streams of
+    the run, stored before its stop document.
+
+    Usage
+    -----
+
+        RE.preprocessors.append(
+            lambda plan: secondary_streams_wrapper(plan, secondary_stream_sources)
+        )
+
+    """
+
+    def insert_streams(msg):
+        if msg.command != "close_run":
+            return None, None
+
+        def head():
+            for source in list(sources):
+                yield from source.stream_plan()
+            return (yield msg)
+
+        return head(), None
+
+    return (yield from bpp.plan_mutator(plan, insert_streams))
+
+
+class HarmonicsExtractor(CallbackBase):
+    """
+    Extract the harmonics from the spectra while the scan is running.
+
+    The peaks of each ``single_electron_spectrum`` event are detected as soon as the
+    event arrives. The harmonics lookup table is read as a secondary
+    ``stream_name`` event stream of the same run right before the run closes,
+    by ``secondary_streams_wrapper()`` (see ``stream_plan()``).
+
+    Usage
+    -----
+
+        harmonics_extractor = HarmonicsExtractor(handler_registry)
+        RE.subscribe(harmonics_extractor)
+        uid, = RE(scan_spectra_vs_mag_field())
+        df_harm = harmonics_extractor.harmonics
+        # or, later:
+        df_harm = db[uid].table("harmonics")
+
+    """
+
+    def __init__(
+        self,
+        handler_registry,
+        harmonic_list=[1, 3, 5],
+        method="scipy",
+        thres=0.10,
+        filter_thres=0.2,
+        energy_key="single_electron_spectrum_photon_energy",
+        intensity_key="single_electron_spectrum_image",
+        field_key="undulator_verticalAmplitude",
+        source_stream="primary",
+        stream_name="harmonics",
+    ):
+        super().__init__()
+        self._handler_registry = handler_registry
+        self._harmonic_list = harmonic_list
+        self._peak_kwargs = {
+            "method": method,
+            "thres": thres,
+            "filter_thres": filter_thres,
+        }
+        self._energy_key = energy_key
+        self._intensity_key = intensity_key
+        self._field_key = field_key
+        self._source_stream = source_stream
+        self._stream_name = stream_name
+        self._run_open = False
+        self._filler = None
+        self._descriptors = set()
+        self.all_energies = {}
+
+    @property
+    def harmonics(self):
+        """The harmonics lookup table of the spectra received so far."""
+        return create_harmonics_dataframe(
+            self.all_energies, harmonic_list=self._harmonic_list
+        )
+
+    def stream_plan(self):
+        """Read the harmonics of the open run as its ``stream_name`` stream."""
+        if self._run_open and self._stream_name is not None and self.all_energies:
+            yield from read_table_stream(self.harmonics, self._stream_name)
+
+    def start(self, doc):
+        self._run_open = True
+        self._filler = Filler(self._handler_registry, inplace=False)
+        self._filler("start", doc)
+        self._descriptors = set()
+        self.all_energies = {}
+
+    def descriptor(self, doc):
+        self._filler("descriptor", doc)
+        keys = {self._energy_key, self._intensity_key, self._field_key}
+        if doc.get("name") == self._source_stream and keys.issubset(doc["data_keys"]):
+            self._descriptors.add(doc["uid"])
+
+    def resource(self, doc):
+        self._filler("resource", doc)
+
+    def datum(self, doc):
+        self._filler("datum", doc)
+
+    def event(self, doc):
+        if doc["descriptor"] not in self._descriptors:
+            return
+        _, doc = self._filler("event", doc)
+        data = doc["data"]
+        peaks = detect_peaks(
+            np.asarray(data[self._energy_key]),
+            np.asarray(data[self._intensity_key])[np.newaxis, :],
+            **self._peak_kwargs,
+        )
+        self.all_energies[data[self._field_key]] = peaks.energies
+
+    def stop(self, doc):
+        self._run_open = False
+        if self._filler is not None:
+            self._filler.close()
+            self._filler = None
+
+
+class LatestSpectra(CallbackBase):
+    """
+    Keep the latest filled spectrum of each event stream of a run.
+
+    Plans use it to make decisions based on the spectra they have just measured,
+    as the documents are dispatched before ``trigger_and_read()`` returns.
+
+    Usage
+    -----
+
+        latest_spectra = LatestSpectra(handler_registry)
+        RE(bpp.subs_wrapper(plan, latest_spectra))
+        energies, intensities = latest_spectra.spectra["primary"]
+
+    """
+
+    def __init__(
+        self,
+        handler_registry,
+        energy_key="single_electron_spectrum_photon_energy",
+        intensity_key="single_electron_spectrum_image",
+    ):
+        super().__init__()
+        self._handler_registry = handler_registry
+        self._energy_key = energy_key
+        self._intensity_key = intensity_key
+        self._filler = None
+        self._streams = {}
+        self.spectra = {}
+
+    def start(self, doc):
+        self._filler = Filler(self._handler_registry, inplace=False)
+        self._filler("start", doc)
+        self._streams = {}
+        self.spectra = {}
+
+    def descriptor(self, doc):
+        self._filler("descriptor", doc)
+        if {self._energy_key, self._intensity_key}.issubset(doc["data_keys"]):
+            self._streams[doc["uid"]] = doc.get("name", "primary")
+
+    def resource(self, doc):
+        self._filler("resource", doc)
+
+    def datum(self, doc):
+        self._filler("datum", doc)
+
+    def event(self, doc):
+        if doc["descriptor"] not in self._streams:
+            return
+        _, doc = self._filler("event", doc)
+        data = doc["data"]
+        self.spectra[self._streams[doc["descriptor"]]] = (
+            np.asarray(data[self._energy_key]),
+            np.asarray(data[self._intensity_key]),
+        )
+
+    def stop(self, doc):
+        if self._filler is not None:
+            self._filler.close()
+            self._filler = None
+
+
+harmonics_extractor = HarmonicsExtractor(handler_registry)
+RE.subscribe(harmonics_extractor)
+
+# The callbacks whose streams are read into the runs before they close:
+secondary_stream_sources = [harmonics_extractor]
+RE.preprocessors.append(
+    lambda plan: secondary_streams_wrapper(plan, secondary_stream_sources)
+)
@@ -0,0 +1,100 @@
+startup_timer.start_file(__file__)
+
+import time
+
+import numpy as np
+import pandas as pd
+from bluesky.callbacks.core import CallbackBase
+
+
+class HotPathTimingCallback(CallbackBase):
+    """
+    Collect the hot-path timings of each point of a run.
+
+    At each event of the ``source_stream``, the stage durations accumulated by the
+    ``timer`` (a ``HotPathTimer``) since the previous event are taken as the
+    timings of the point, together with the wall time of the whole point. The
+    timings are read as a secondary ``stream_name`` event stream of the same run
+    right before the run closes (if ``stream_name`` is not None), by
+    ``secondary_streams_wrapper()``, and summarized per stage when the run stops.
+    The callback does nothing while the timer is disabled.
+
+    Usage
+    -----
+
+        hot_path_timer.enabled = True
+        uid, = RE(bp.scan([after_v_slit], beamline_energy.energy, 790, 810, 11))
+        hot_path_timing.summary  # count/total/mean/max per stage
+        db[uid].table("timing")  # the timings of each point
+
+    """
+
+    def __init__(self, timer, source_stream="primary", stream_name="timing"):
+        super().__init__()
+        self._timer = timer
+        self._source_stream = source_stream
+        self._stream_name = stream_name
+        self._start_doc = None
+        self._descriptors = set()
+        self._last_time = None
+        self.points = []
+        self.summary = None
+
+    @property
+    def timings(self):
+        """The timings (in seconds) of the points of the run, one row per point."""
+        return pd.DataFrame(self.points).fillna(0.0)
+
+    def stream_plan(self):
+        """Read the timings of the open run as its ``stream_name`` stream."""
+        if self._start_doc is None or self._stream_name is None or not self.points:
+            return
+        df = self.timings
+        df.columns = [column.replace(".", "_") for column in df.columns]
+        yield from read_table_stream(df, self._stream_name)
+
+    def start(self, doc):
+        self._start_doc = None
+        if not self._timer.enabled:
+            return
+        self._start_doc = doc
+        self._descriptors = set()
+        self._timer.take_point()  # discard the stages timed before the run
+        self._last_time = time.perf_counter()
+        self.points = []
+        self.summary = None
+
+    def descriptor(self, doc):
+        if self._start_doc is not None and doc.get("name") == self._source_stream:
+            self._descriptors.add(doc["uid"])
+
+    def event(self, doc):
+        if self._start_doc is None or doc["descriptor"] not in self._descriptors:
+            return
+        now = time.perf_counter()
+        point = self._timer.take_point()
+        point["point"] = now - self._last_time
+        self._last_time = now
+        self.points.append(point)
+
+    def stop(self, doc):
+        start_doc, self._start_doc = self._start_doc, None
+        if start_doc is None or not self.points:
+            return
+        df = self.timings
+        self.summary = pd.DataFrame(
+            {
+                "count": (df > 0).sum(),
+                "total": df.sum(),
+                "mean": df.sum() / np.maximum((df > 0).sum(), 1),
+                "max": df.max(),
+                "fraction": df.sum() / df["point"].sum(),
+            }
+        ).sort_values("total", ascending=False)
+        print(f"Hot-path timings [s] of the run {doc['run_start'][:8]}:")
+        print(self.summary.to_string(float_format=lambda x: f"{x:.4g}"))
+
+
+hot_path_timing = HotPathTimingCallback(hot_path_timer)
+RE.subscribe(hot_path_timing)
+secondary_stream_sources.append(hot_path_timing)
@@ -1,5 +1,10 @@
-print(f"{datetime.datetime.now().isoformat()} Loading {__file__}...")
+startup_timer.start_file(__file__)
 
+import bisect
+import os
+import warnings
+
+import numpy as np
 from ophyd import Component as Cpt
 from ophyd import Signal, SignalRO
 from ophyd.sim import NullStatus
@@ -27,17 +32,34 @@ class SirepoSignalWithParent(SirepoSignal):
                 "This class should be used as a component in the EPU class"
             )
 
+    def set(self, value):
+        with hot_path_timer.time("sirepo_signal.set"):
+            return super().set(value)
+
     def put(self, value):
         self.set(value).wait()
 
+    def _record_model(self, transaction, value):
+        """Record the model edits of the move to ``value`` in the transaction."""
+        transaction.set(self, value)
+
 
 class EnergySignal(SignalWithParent):
     def set(self, value):
-        magn_field = self.parent._get_magn_field(value)
-        self.parent.magn_field_ver.put(magn_field)
-        self._readback = float(value)
+        with hot_path_timer.time("epu.energy.set"):
+            magn_field = self.parent._select_magn_field(value)
+            self.parent.magn_field_ver.put(magn_field)
+            self._readback = float(value)
         return NullStatus()
 
+    def _record_model(self, transaction, value):
+        """Record the model edits of the move to ``value`` in the transaction."""
+        epu = self.parent
+        harm_num = None
+        if epu.auto_harmonic.get():
+            harm_num = epu._get_best_harmonic(value)
+        transaction.set(epu.magn_field_ver, epu._get_magn_field(value, harm_num))
+
 
 class MagnFieldSignal(SirepoSignalWithParent):
     def set(self, value):
@@ -54,6 +76,9 @@ class EPU(classes["undulator"]):
 
     energy = Cpt(EnergySignal)
     harm_num = Cpt(Signal, value=1)
+    # Switch to the harmonic with the highest flux (from the flux map) when the
+    # energy is set:
+    auto_harmonic = Cpt(Signal, value=False, kind="config")
     polarization = Cpt(Signal, value="")
     magn_field_ver = Cpt(
         MagnFieldSignal,
@@ -72,45 +97,202 @@ class EPU(classes["undulator"]):
     verticalAmplitude = None
     horizontalAmplitude = None
 
-    def __init__(self, *args, harmonics_df=None, **kwargs):
+    def __init__(self, *args, harmonics_df=None, model=None, flux_map=None, **kwargs):
         super().__init__(*args, **kwargs)
-        if harmonics_df is None:
-            raise ValueError(f"The 'harmonics' kwarg should be a pandas dataframe")
-        self._harmonics_df = harmonics_df
-        self._interp_kwargs = {
-            "kind": "quadratic",
-            "bounds_error": False,
-            "fill_value": "extrapolate",
-        }
+        if harmonics_df is None and model is None:
+            raise ValueError(
+                "The 'harmonics_df' kwarg should be a pandas dataframe "
+                "or the 'model' kwarg should be a HarmonicsModel"
+            )
+        self.harmonics_df = harmonics_df
+        # The closed-form model is used for all harmonics when available, and the
+        # interpolation of the harmonics table otherwise.
+        self.model = model
+        self.flux_map = flux_map
         self.energy.put(self._get_energy())
 
-    def _get_energy(self):
-        magn_field = self.magn_field_ver.get()
-        # https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.interp1d.html
-        interp_func = interpolate.interp1d(
-            self._harmonics_df["magn_field"],
-            self._harmonics_df[f"harmonic{self.harm_num.get()}"],
-            **self._interp_kwargs,
-        )
-        return float(interp_func(magn_field))
+    @property
+    def harmonics_df(self):
+        return self._harmonics_df
 
-    def _get_magn_field(self, energy):
-        interp_func = interpolate.interp1d(
-            self._harmonics_df[f"harmonic{self.harm_num.get()}"],
-            self._harmonics_df["magn_field"],
-            **self._interp_kwargs,
+    @harmonics_df.setter
+    def harmonics_df(self, value):
+        self._harmonics_df = value
+        self._interpolators = {}
+
+    def _get_interpolators(self, harm_num=None):
+        """
+        Return the cached (forward, inverse) interpolators for the harmonic.
+
+        The forward interpolator converts the magnetic field to the energy, and the
+        inverse one converts the energy back to the magnetic field. Both are
+        monotonic (PCHIP) splines built on the points of the harmonics table which
+        form a strictly decreasing energy vs. magnetic field curve.
+        """
+        if harm_num is None:
+            harm_num = self.harm_num.get()
+        try:
+            return self._interpolators[harm_num]
+        except KeyError:
+            pass
+
+        magn_field = np.asarray(self._harmonics_df["magn_field"], dtype=float)
+        energy = np.asarray(self._harmonics_df[f"harmonic{harm_num}"], dtype=float)
+        valid = np.isfinite(magn_field) & np.isfinite(energy)
+        magn_field, energy = magn_field[valid], energy[valid]
+        order = np.argsort(magn_field)
+        magn_field, energy = magn_field[order], energy[order]
+        monotonic = _longest_decreasing_subsequence(energy)
+        magn_field, energy = magn_field[monotonic], energy[monotonic]
+
+        # https://docs.scipy.org/doc/scipy/reference/generated/scipy.interpolate.PchipInterpolator.html
+        interpolators = (
+            interpolate.PchipInterpolator(magn_field, energy, extrapolate=True),
+            interpolate.PchipInterpolator(
+                energy[::-1], magn_field[::-1], extrapolate=True
+            ),
         )
-        return float(interp_func(energy))
+        self._interpolators[harm_num] = interpolators
+        return interpolators
+
+    def _get_energy(self, magn_field=None, harm_num=None):
+        """
+        Convert the magnetic field (the current one by default) to the energy.
+
+        Accepts a scalar or an array of magnetic fields.
+        """
+        if magn_field is None:
+            magn_field = self.magn_field_ver.get()
+        if self.model is not None:
+            if harm_num is None:
+                harm_num = self.harm_num.get()
+            return _as_scalar_or_array(self.model.energy(magn_field, harm_num))
+        forward, _ = self._get_interpolators(harm_num)
+        return _as_scalar_or_array(forward(magn_field))
 
+    def _get_magn_field(self, energy, harm_num=None):
+        """Convert the energy (a scalar or an array) to the magnetic field."""
+        if self.model is not None:
+            if harm_num is None:
+                harm_num = self.harm_num.get()
+            return _as_scalar_or_array(self.model.magn_field(energy, harm_num))
+        _, inverse = self._get_interpolators(harm_num)
+        return _as_scalar_or_array(inverse(energy))
 
-df_harm = load_harmonics_json(path=HARMONICS_JSON)
+    def _get_harmonic_list(self):
+        """Return the harmonics the energy can be converted for (None for all)."""
+        if self.model is not None:
+            return None
+        return [
+            int(column[len("harmonic") :])
+            for column in self._harmonics_df.columns
+            if column.startswith("harmonic")
+        ]
+
+    def _get_best_harmonic(self, energy):
+        """
+        Return the harmonic with the highest flux at the energy (the current one if
+        no harmonic of the flux map covers it).
+        """
+        if self.flux_map is None:
+            raise ValueError("The 'auto_harmonic' mode requires a flux map")
+        best = self.flux_map.best_harmonic(energy, self._get_harmonic_list())
+        if best is None:
+            warnings.warn(
+                f"No harmonic of the flux map covers {energy} eV, "
+                f"keeping the harmonic {self.harm_num.get()}"
+            )
+            return self.harm_num.get()
+        harm_num, _, _ = best
+        return harm_num
+
+    def _select_harmonic(self, energy):
+        """Switch to the harmonic with the highest flux at the energy."""
+        harm_num = self._get_best_harmonic(energy)
+        if harm_num != self.harm_num.get():
+            self.harm_num.put(harm_num)
+
+    def _select_magn_field(self, energy):
+        """
+        Return the magnetic field for the energy, switching to the harmonic with the
+        highest flux first in the 'auto_harmonic' mode.
+
+        The previous harmonic is restored if the energy cannot be reached.
+        """
+        harm_num = self.harm_num.get()
+        if self.auto_harmonic.get():
+            self._select_harmonic(energy)
+        try:
+            magn_field = self._get_magn_field(energy)
+            if not np.isfinite(magn_field):
+                raise ValueError(
+                    f"The energy {energy} eV cannot be reached with the harmonic "
+                    f"{self.harm_num.get()}"
+                )
+        except ValueError:
+            if self.harm_num.get() != harm_num:
+                self.harm_num.put(harm_num)
+            raise
+        return magn_field
+
+
+def _longest_decreasing_subsequence(values):
+    """Return the indices of the longest strictly decreasing subsequence."""
+    tails = []  # negated tail values of the subsequences of each length
+    tail_indices = []
+    previous = np.full(len(values), -1)
+    for i, value in enumerate(values):
+        length = bisect.bisect_left(tails, -value)
+        if length > 0:
+            previous[i] = tail_indices[length - 1]
+        if length == len(tails):
+            tails.append(-value)
+            tail_indices.append(i)
+        else:
+            tails[length] = -value
+            tail_indices[length] = i
+    indices = []
+    i = tail_indices[-1] if tail_indices else -1
+    while i >= 0:
+        indices.append(i)
+        i = previous[i]
+    return np.array(indices[::-1], dtype=int)
+
+
+def _as_scalar_or_array(value):
+    value = np.asarray(value)
+    if value.ndim == 0:
+        return float(value)
+    return value
+
+
+with startup_timer.phase("load harmonics"):
+    df_harm = load_harmonics_json(path=HARMONICS_JSON)
+    harmonics_model = None
+    if os.path.exists(HARMONICS_MODEL_JSON):
+        harmonics_model = load_harmonics_model(path=HARMONICS_MODEL_JSON)
+    flux_map = None
+    if os.path.exists(FLUX_MAP_JSON):
+        flux_map = load_flux_map(path=FLUX_MAP_JSON)
 
 # HINT: How to use interpolation interactively:
-# f = interpolate.interp1d(df_harm["magn_field"], df_harm["harmonic1"],
-#                          kind="quadratic", bounds_error=False, fill_value="extrapolate")
+# f, f_inv = epu._get_interpolators(harm_num=1)
 # plt.plot(df_harm["magn_field"], df_harm["harmonic1"])
 # plt.scatter(df_harm["magn_field"]-0.05, f(df_harm["magn_field"]-0.05))
-
-epu = EPU(name="epu", harmonics_df=df_harm)
+#
+# Whole trajectories are converted in one call:
+# magn_fields = epu._get_magn_field(np.linspace(100, 800, 71))
+#
+# Switch between the fitted model and the interpolation of the table:
+# epu.model = None
+# epu.model = harmonics_model
+#
+# Select the harmonic with the highest flux automatically:
+# epu.auto_harmonic.put(True)
+# epu.flux_map.best_harmonic(500.0)  # (harm_num, magn_field, flux)
+with startup_timer.phase("device construction"):
+    epu = EPU(
+        name="epu", harmonics_df=df_harm, model=harmonics_model, flux_map=flux_map
+    )
 epu.kind = "hinted"
 epu.energy.kind = "hinted"
@@ -1,4 +1,6 @@
-print(f"{datetime.datetime.now().isoformat()} Loading {__file__}...")
+startup_timer.start_file(__file__)
+
+import warnings
 
 import numpy as np
 from ophyd import Component as Cpt
@@ -34,7 +36,7 @@ def _get_cff(e_ph, grating, r2, r1, m, gratings):
 
     Parameters
     ----------
-    e_ph : float
+    e_ph : float or array_like
         The photon energy in eV.
     grating : string
         The grating name.
@@ -49,10 +51,12 @@ def _get_cff(e_ph, grating, r2, r1, m, gratings):
 
     Returns
     -------
-    cff : float
-        The fine focus constant.
+    cff : float or numpy.ndarray
+        The fine focus constant (an array of the same shape as ``e_ph`` for an
+        array of energies).
     """
 
+    e_ph = np.asarray(e_ph, dtype=float)
     lambda_ = (12398.4197 / e_ph) * 1e-7  # wavelength in mm from e_ph in eV
     A1 = -0.5 * m * lambda_ * r2 * gratings[grating]["a1"]
     A0 = m * lambda_ * gratings[grating]["a0"]
@@ -94,7 +98,7 @@ def _get_pgm_angles(e_ph, grating, r2, r1, m, gratings, x_inc, x_diff, b, cff=No
 
     Parameters
     ----------
-    E_ph : float
+    E_ph : float or array_like
         The photon energy in eV.
     grating : string
         The grating name.
@@ -116,11 +120,12 @@ def _get_pgm_angles(e_ph, grating, r2, r1, m, gratings, x_inc, x_diff, b, cff=No
 
     Returns
     -------
-    (theta_m2, theta_gr) : (float, float)
+    (theta_m2, theta_gr) : (float, float) or (numpy.ndarray, numpy.ndarray)
         The required angles for M2 and the grating in degrees.
     """
     ##NOTE if I choose to read in cff from a read-only ophyd signal then I no longer
     ## need r2 and r1 as args/kwargs (but I will need cff as an arg)
+    e_ph = np.asarray(e_ph, dtype=float)
     lambda_ = (12398.4197 / e_ph) * 1e-7  # wavelength in mm from e_ph in eV
     # NOTE the next line may be better read from the read-only axis instead of calculating
 
@@ -162,9 +167,9 @@ def _get_pgm_energy(theta_m2, theta_gr, grating, m, gratings, x_inc, x_diff, b):
 
     Parameters
     ----------
-    theta_m2 : float
+    theta_m2 : float or array_like
         The angle of the M2 mirror
-    theta_gr : float
+    theta_gr : float or array_like
         The angle of the Grating
     grating : string
         The grating name.
@@ -182,10 +187,12 @@ def _get_pgm_energy(theta_m2, theta_gr, grating, m, gratings, x_inc, x_diff, b):
 
     Returns
     -------
-    e_ph : float
+    e_ph : float or numpy.ndarray
         The photon energy of the PGM in eV.
     """
 
+    theta_m2 = np.asarray(theta_m2, dtype=float)
+    theta_gr = np.asarray(theta_gr, dtype=float)
     beta = -90 + b * (theta_gr - x_diff)
     alpha = 180 + beta + b * (x_diff + x_inc - 2 * theta_m2)
     lambda_ = (np.sin(np.radians(alpha)) + np.sin(np.radians(beta))) / (
@@ -196,22 +203,181 @@ def _get_pgm_energy(theta_m2, theta_gr, grating, m, gratings, x_inc, x_diff, b):
     return e_ph
 
 
+class PGMLookupTable:
+    """
+    Dense per-grating lookup tables of the PGM kinematics.
+
+    The cff and the M2/grating angles are precomputed with ``_get_cff()`` and
+    ``_get_pgm_angles()`` on a dense logarithmic energy grid for each grating and
+    are then linearly interpolated for whole energy vectors at once.
+
+    Usage
+    -----
+
+        tables = PGMLookupTable.from_pgm(pgm, gratings=_sxn_gratings)
+        energies = np.linspace(250, 1500, 10_000)
+        cff = tables.cff(energies, "HighE")
+        theta_m2, theta_gr = tables.angles(energies, "HighE")
+        tables.round_trip_error()
+
+    """
+
+    def __init__(
+        self,
+        gratings,
+        r2,
+        r1,
+        m,
+        x_inc,
+        x_diff,
+        b,
+        energy_range=(20.0, 2000.0),
+        num_points=20_001,
+    ):
+        self._gratings = gratings
+        self._kwargs = {"r2": r2, "r1": r1, "m": m}
+        self._angle_kwargs = {"x_inc": x_inc, "x_diff": x_diff, "b": b}
+        self.energies = np.geomspace(*energy_range, num_points)
+        self.tables = {}
+        with np.errstate(invalid="ignore"):
+            for grating in gratings:
+                cff = _get_cff(
+                    self.energies, grating, gratings=gratings, **self._kwargs
+                )
+                theta_m2, theta_gr = _get_pgm_angles(
+                    self.energies,
+                    grating,
+                    gratings=gratings,
+                    cff=cff,
+                    **self._kwargs,
+                    **self._angle_kwargs,
+                )
+                self.tables[grating] = {
+                    "cff": cff,
+                    "theta_m2": theta_m2,
+                    "theta_gr": theta_gr,
+                }
+
+    @classmethod
+    def from_pgm(cls, pgm, gratings=None, **kwargs):
+        """Create the tables with the geometry of the ``pgm`` device."""
+        return cls(
+            pgm._gratings.get() if gratings is None else gratings,
+            r2=pgm._r2.get(),
+            r1=pgm._r1.get(),
+            m=pgm._m.get(),
+            x_inc=pgm._x_inc.get(),
+            x_diff=pgm._x_diff.get(),
+            b=pgm._b.get(),
+            **kwargs,
+        )
+
+    def _interp(self, energies, grating, key):
+        return np.interp(energies, self.energies, self.tables[grating][key])
+
+    def cff(self, energies, grating):
+        """Return the interpolated cff for the energies (in eV)."""
+        return self._interp(energies, grating, "cff")
+
+    def angles(self, energies, grating):
+        """Return the interpolated (theta_m2, theta_gr) for the energies (in eV)."""
+        return (
+            self._interp(energies, grating, "theta_m2"),
+            self._interp(energies, grating, "theta_gr"),
+        )
+
+    def energy(self, theta_m2, theta_gr, grating):
+        """Return the energies (in eV) for the M2/grating angles."""
+        return _get_pgm_energy(
+            theta_m2,
+            theta_gr,
+            grating,
+            m=self._kwargs["m"],
+            gratings=self._gratings,
+            **self._angle_kwargs,
+        )
+
+    def round_trip_error(self):
+        """
+        Report the accuracy of the tables per grating.
+
+        The interpolation errors are evaluated against the exact kinematics in the
+        middle of the grid intervals (where they are the largest), and the energy
+        round-trip error is ``energy(angles(E)) - E`` for the interpolated angles.
+        """
+        energies = np.sqrt(self.energies[1:] * self.energies[:-1])
+        rows = []
+        # The kinematics are undefined (NaN) outside of the working range of a
+        # grating, which is reported as the "valid_fraction" of the energy grid.
+        with np.errstate(invalid="ignore"), warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            for grating in self._gratings:
+                cff = _get_cff(
+                    energies, grating, gratings=self._gratings, **self._kwargs
+                )
+                theta_m2, theta_gr = _get_pgm_angles(
+                    energies,
+                    grating,
+                    gratings=self._gratings,
+                    cff=cff,
+                    **self._kwargs,
+                    **self._angle_kwargs,
+                )
+                interp_m2, interp_gr = self.angles(energies, grating)
+                rows.append(
+                    {
+                        "grating": grating,
+                        "valid_fraction": np.isfinite(cff).mean(),
+                        "cff_max_abs_err": np.nanmax(
+                            np.abs(self.cff(energies, grating) - cff)
+                        ),
+                        "theta_m2_max_abs_err": np.nanmax(np.abs(interp_m2 - theta_m2)),
+                        "theta_gr_max_abs_err": np.nanmax(np.abs(interp_gr - theta_gr)),
+                        "energy_max_rel_err": np.nanmax(
+                            np.abs(
+                                self.energy(interp_m2, interp_gr, grating) - energies
+                            )
+                            / energies
+                        ),
+                    }
+                )
+        return pd.DataFrame(rows).set_index("grating")
+
+
 class CFFSignalRO(SirepoSignalWithParent):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._cff_inputs = None
 
-    def get(self):
-        energy = self.parent.energy.get()
+    def _get_inputs(self):
+        """Return the current values of all the inputs of the cff calculation."""
         grating = self.parent.grating_name.get()
-        _r2 = self.parent._r2.get()
-        _r1 = self.parent._r1.get()
-        _m = self.parent._m.get()
+        return (
+            self.parent.energy.get(),
+            grating,
+            self.parent._r2.get(),
+            self.parent._r1.get(),
+            self.parent._m.get(),
+            # The grating table is a mutable dict, so the grating parameters are
+            # compared by value:
+            tuple(sorted(self.parent._gratings.get()[grating].items())),
+        )
+
+    def get(self):
+        inputs = self._get_inputs()
+        if inputs == self._cff_inputs:
+            return self._readback
+
+        energy, grating, _r2, _r1, _m, _ = inputs
         _gratings = self.parent._gratings.get()
 
-        _cff = _get_cff(energy, grating, r2=_r2, r1=_r1, m=_m, gratings=_gratings)
+        with hot_path_timer.time("pgm.cff"):
+            _cff = _get_cff(energy, grating, r2=_r2, r1=_r1, m=_m, gratings=_gratings)
 
-        self._sirepo_dict["cff"] = _cff
+        if self._sirepo_dict.get("cff") != _cff:
+            self._sirepo_dict["cff"] = _cff
 
+        self._cff_inputs = inputs
         self._readback = _cff
         # self._value = _cff
 
@@ -234,6 +400,10 @@ class PreMirrorAngleSignal(SirepoSignalWithParent):
         self._value = float(value)
         return NullStatus()
 
+    def _record_model(self, transaction, value):
+        """Record the model edits of the move to ``value`` in the transaction."""
+        transaction.set(self, np.radians(value - 90.0) * 1e3)  # in mrad
+
 
 class GratingAngleSignal(SirepoSignalWithParent):
     def __init__(self, *args, **kwargs):
@@ -251,35 +421,55 @@ class GratingAngleSignal(SirepoSignalWithParent):
         self._value = float(value)
         return NullStatus()
 
+    def _record_model(self, transaction, value):
+        """Record the model edits of the move to ``value`` in the transaction."""
+        transaction.set(self, np.radians(value - 90.0) * 1e3)  # in mrad
+
 
 class GratingNameSignal(Signal):
     # TODO: update the parent class SignalWithParent to rely on `self.put()`.
     def put(self, value):
-        super().put(value)
+        with hot_path_timer.time("pgm.grating_name.put"):
+            self._put(value)
 
-        _m = self.parent._m.get()
-        _b = self.parent._b.get()
-        _x_inc = self.parent._x_inc.get()
-        _x_diff = self.parent._x_diff.get()
-        _gratings = self.parent._gratings.get()
+    def _put(self, value):
+        pgm = self.parent
+        _gratings = pgm._gratings.get()
+        grating = _gratings[value]
 
         energy = _get_pgm_energy(
-            self.parent.pre_mirror_angle.get(),
-            self.parent.grating_angle.get(),
-            m=_m,
+            pgm.pre_mirror_angle.get(),
+            pgm.grating_angle.get(),
+            m=pgm._m.get(),
             grating=value,
             gratings=_gratings,
-            x_inc=_x_inc,
-            x_diff=_x_diff,
-            b=_b,
+            x_inc=pgm._x_inc.get(),
+            x_diff=pgm._x_diff.get(),
+            b=pgm._b.get(),
         )
+        with hot_path_timer.time("pgm.cff"):
+            _cff = _get_cff(
+                energy,
+                value,
+                r2=pgm._r2.get(),
+                r1=pgm._r1.get(),
+                m=pgm._m.get(),
+                gratings=_gratings,
+            )
 
-        for k, v in _gratings[value].items():
-            getattr(self.parent, f"_{k}").put(v)
+        # The groove densities and the cff of the new grating are written together:
+        with ModelTransaction() as transaction:
+            for k, v in grating.items():
+                transaction.set(getattr(pgm, f"_{k}"), v)
+            transaction.set(pgm.cff, _cff)
 
-        self.parent.energy._readback = energy
-        self.parent.energy._value = energy
-        self.parent.cff.get()
+        super().put(value)
+        for k, v in grating.items():
+            getattr(pgm, f"_{k}")._readback = v
+        pgm.energy._readback = energy
+        pgm.energy._value = energy
+        pgm.cff._readback = _cff
+        pgm.cff._cff_inputs = pgm.cff._get_inputs()
 
     def set(self, *args, **kwargs):
         self.put(*args, **kwargs)
@@ -288,39 +478,22 @@ class GratingNameSignal(Signal):
 
 class PGMEnergySignal(SignalWithParent):
     def set(self, value):  # value is in eV.
-        self._readback = float(value)
-
-        connection.data["models"]["simulation"]["photonEnergy"] = float(value)
-
-        _gratings = self.parent._gratings.get()
-        grating = self.parent.grating_name.get()
-
-        _r2 = self.parent._r2.get()
-        _r1 = self.parent._r1.get()
-        _m = self.parent._m.get()
-        _b = self.parent._b.get()
-        _x_inc = self.parent._x_inc.get()
-        _x_diff = self.parent._x_diff.get()
-        _cff = self.parent.cff.get()
-
-        theta_pm, theta_gr = _get_pgm_angles(
-            e_ph=value,
-            grating=grating,
-            r2=_r2,
-            r1=_r1,
-            m=_m,
-            gratings=_gratings,
-            x_inc=_x_inc,
-            x_diff=_x_diff,
-            b=_b,
-            cff=_cff,
-        )
-
-        self.parent.pre_mirror_angle.set(theta_pm)
-        self.parent.grating_angle.set(theta_gr)
-
+        with hot_path_timer.time("pgm.energy.set"):
+            return self._set(value)
+
+    def _set(self, value):
+        value = float(value)
+        positions = self.parent._get_positions(value)
+        with ModelTransaction() as transaction:
+            self.parent._set_model(transaction, value, positions)
+        self.parent._set_readbacks(value, positions)
         return NullStatus()
 
+    def _record_model(self, transaction, value):
+        """Record the model edits of the move to ``value`` in the transaction."""
+        value = float(value)
+        self.parent._set_model(transaction, value, self.parent._get_positions(value))
+
 
 _ari_gratings = {
     "LowE": {"a0": 50, "a1": 0.01868, "a2": 1.95e-06, "a3": 4e-9},
@@ -421,11 +594,59 @@ class PGM(Device):
         sirepo_param="grooveDensity3",
     )
 
+    def _get_positions(self, energy):
+        """Return the cff and the M2/grating angles (in degrees) for the energy (in eV)."""
+        grating = self.grating_name.get()
+        kwargs = {
+            "r2": self._r2.get(),
+            "r1": self._r1.get(),
+            "m": self._m.get(),
+            "gratings": self._gratings.get(),
+        }
+        with hot_path_timer.time("pgm.cff"):
+            cff = float(_get_cff(energy, grating, **kwargs))
+        with hot_path_timer.time("pgm.angles"):
+            theta_m2, theta_gr = _get_pgm_angles(
+                energy,
+                grating,
+                x_inc=self._x_inc.get(),
+                x_diff=self._x_diff.get(),
+                b=self._b.get(),
+                cff=cff,
+                **kwargs,
+            )
+        return {"cff": cff, "theta_m2": float(theta_m2), "theta_gr": float(theta_gr)}
 
-pgm = PGM(name="pgm")
-pgm.grating_name.set("HighR")
-
-pgm.energy.set(connection.data["models"]["simulation"]["photonEnergy"])
+    def _set_model(self, transaction, energy, positions):
+        """Record the model edits of the energy and the positions in the transaction."""
+        transaction.set_param(
+            connection.data["models"]["simulation"], "photonEnergy", energy
+        )
+        transaction.set(self.cff, positions["cff"])
+        # The angles are in mrad in the model:
+        for signal, key in [
+            (self.pre_mirror_angle, "theta_m2"),
+            (self.grating_angle, "theta_gr"),
+        ]:
+            transaction.set(signal, np.radians(positions[key] - 90.0) * 1e3)
+
+    def _set_readbacks(self, energy, positions):
+        """Sync the readbacks with the model, once the transaction is applied."""
+        self.energy._readback = energy
+        for signal, key in [
+            (self.pre_mirror_angle, "theta_m2"),
+            (self.grating_angle, "theta_gr"),
+        ]:
+            signal._readback = signal._value = positions[key]
+        self.cff._readback = positions["cff"]
+        self.cff._cff_inputs = self.cff._get_inputs()
+
+
+with startup_timer.phase("device construction"):
+    pgm = PGM(name="pgm")
+    pgm.grating_name.set("HighR")
+
+    pgm.energy.set(connection.data["models"]["simulation"]["photonEnergy"])
 pgm.kind = "hinted"
 
 after_v_slit.kind = "hinted"
@@ -0,0 +1,97 @@
+startup_timer.start_file(__file__)
+
+import numpy as np
+from ophyd import Component as Cpt
+from ophyd import Device, Signal
+from ophyd.sim import NullStatus
+
+DEFAULT_DETUNING = -6.0  # eV, the EPU is set below the PGM energy
+
+
+class BeamlineEnergySignal(SignalWithParent):
+    def set(self, value):  # value is in eV.
+        with hot_path_timer.time("beamline_energy.set"):
+            self.parent._move(float(value))
+        self._readback = float(value)
+        return NullStatus()
+
+    def _record_model(self, transaction, value):
+        """Record the model edits of the move to ``value`` in the transaction."""
+        energy = float(value)
+        beamline_energy = self.parent
+        beamline_energy._pgm.energy._record_model(transaction, energy)
+        epu_energy = energy + beamline_energy.get_detuning(energy)
+        beamline_energy._epu.energy._record_model(transaction, epu_energy)
+
+
+class BeamlineEnergy(Device):
+    """
+    Move the EPU and the PGM together to the beamline (photon) energy.
+
+    The undulator magnetic field, the cff and both PGM angles are computed
+    together for each energy, and all the Sirepo model parameters are written
+    in one ``ModelTransaction``. The EPU is detuned from the PGM energy by
+    ``detuning``, either a constant offset in eV or a table of
+    ``[pgm_energy, offset]`` pairs which is linearly interpolated (and held
+    constant outside of its range).
+
+    Usage
+    -----
+
+        uid, = RE(bp.scan([after_v_slit], beamline_energy.energy, 790, 810, 11))
+
+        beamline_energy.detuning.put([[250, -2.0], [800, -6.0], [1500, -10.0]])
+
+    """
+
+    energy = Cpt(BeamlineEnergySignal, kind="hinted")
+    epu_energy = Cpt(Signal, value=np.nan, kind="normal")
+    detuning = Cpt(Signal, value=DEFAULT_DETUNING, kind="config")
+
+    def __init__(self, *args, epu, pgm, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._epu = epu
+        self._pgm = pgm
+        self.energy._readback = pgm.energy.get()
+        self.epu_energy.put(epu.energy.get())
+
+    def get_detuning(self, energy):
+        """Return the EPU detuning (in eV) at the PGM energy (in eV)."""
+        detuning = self.detuning.get()
+        if np.isscalar(detuning):
+            return float(detuning)
+        energies, offsets = np.array(sorted(detuning), dtype=float).T
+        return float(np.interp(energy, energies, offsets))
+
+    def _get_positions(self, energy):
+        """
+        Return the positions of all the axes for the beamline energy (in eV).
+
+        The returned dictionary has the EPU energy and magnetic field, and the
+        PGM cff and M2/grating angles (in degrees).
+        """
+        positions = self._pgm._get_positions(energy)
+        epu_energy = energy + self.get_detuning(energy)
+        positions["epu_energy"] = epu_energy
+        positions["magn_field"] = float(self._epu._select_magn_field(epu_energy))
+        return positions
+
+    def _move(self, energy):
+        positions = self._get_positions(energy)
+        epu, pgm = self._epu, self._pgm
+
+        # All the model parameters are written in one transaction, to the same
+        # dictionaries the EPU/PGM signals write to.
+        with ModelTransaction() as transaction:
+            transaction.set(epu.magn_field_ver, positions["magn_field"])
+            pgm._set_model(transaction, energy, positions)
+
+        # Keep the readbacks of the EPU and PGM signals in sync with the model:
+        epu.magn_field_ver._readback = positions["magn_field"]
+        epu.energy._readback = positions["epu_energy"]
+        pgm._set_readbacks(energy, positions)
+        self.epu_energy.put(positions["epu_energy"])
+
+
+with startup_timer.phase("device construction"):
+    beamline_energy = BeamlineEnergy(name="beamline_energy", epu=epu, pgm=pgm)
@@ -0,0 +1,164 @@
+startup_timer.start_file(__file__)
+
+import os
+
+import numpy as np
+from ophyd import Component as Cpt
+from ophyd import Device, Signal
+from ophyd.sim import NullStatus
+
+
+def _get_fwhm(coords, profile):
+    """
+    Return the full width at half maximum of the profile.
+
+    The half-maximum crossings are linearly interpolated between the outermost
+    samples above and the neighbor samples below the half maximum.
+    """
+    above = np.flatnonzero(profile >= profile.max() / 2)
+    if len(above) == 0 or profile.max() <= 0:
+        return np.nan
+    half = profile.max() / 2
+    edges = []
+    for inside, outside in [(above[0], above[0] - 1), (above[-1], above[-1] + 1)]:
+        if outside < 0 or outside >= len(profile):
+            edges.append(coords[inside])
+            continue
+        fraction = (profile[inside] - half) / (profile[inside] - profile[outside])
+        edges.append(coords[inside] + fraction * (coords[outside] - coords[inside]))
+    return abs(edges[1] - edges[0])
+
+
+def get_beam_statistics(image, horizontal_extent, vertical_extent):
+    """
+    Compute the statistics of a beam image from its projections.
+
+    Returns a dictionary with the total flux, the peak intensity, the centroid,
+    the RMS size and the FWHM in both directions (in the units of the extents),
+    and the horizontal and vertical projections.
+    """
+    image = np.asarray(image, dtype=float)
+    n_y, n_x = image.shape
+    x = np.linspace(*horizontal_extent, n_x)
+    y = np.linspace(*vertical_extent, n_y)
+    projection_x = image.sum(axis=0)
+    projection_y = image.sum(axis=1)
+    flux = projection_x.sum()
+
+    stats = {
+        "flux": flux,
+        "peak": image.max(),
+        "projection_x": projection_x,
+        "projection_y": projection_y,
+    }
+    for axis, coords, projection in [("x", x, projection_x), ("y", y, projection_y)]:
+        if flux > 0:
+            centroid = coords @ projection / flux
+            rms = np.sqrt((coords - centroid) ** 2 @ projection / flux)
+        else:
+            centroid, rms = np.nan, np.nan
+        stats[f"centroid_{axis}"] = centroid
+        stats[f"rms_{axis}"] = rms
+        stats[f"fwhm_{axis}"] = _get_fwhm(coords, projection)
+    return stats
+
+
+class BeamStatistics(Device):
+    """
+    Reduce the image of a watchpoint detector to beam statistics at each event.
+
+    Triggering this device triggers the ``source`` watchpoint, takes the
+    resource/datum documents of the image it has just written and computes the
+    statistics of ``get_beam_statistics()``. The image is not parsed again: the
+    handler returns it from ``handler_cache``, where it was stored when the
+    source read its result file. The scalars are hinted, so they are plotted and
+    tabulated directly.
+
+    With ``keep_image=False``, the image is not stored: the source's
+    asset documents are dropped and its result file is deleted, so the run only
+    contains the statistics.
+
+    Usage
+    -----
+
+        after_v_slit_stats = BeamStatistics(after_v_slit, name="after_v_slit_stats")
+        uid, = RE(bp.scan([after_v_slit_stats], pgm.energy, 790, 810, 11))
+        db[uid].table()  # flux, centroids, sizes as columns
+
+    """
+
+    flux = Cpt(Signal, value=np.nan, kind="hinted")
+    peak = Cpt(Signal, value=np.nan, kind="normal")
+    centroid_x = Cpt(Signal, value=np.nan, kind="hinted")
+    centroid_y = Cpt(Signal, value=np.nan, kind="hinted")
+    rms_x = Cpt(Signal, value=np.nan, kind="hinted")
+    rms_y = Cpt(Signal, value=np.nan, kind="hinted")
+    fwhm_x = Cpt(Signal, value=np.nan, kind="hinted")
+    fwhm_y = Cpt(Signal, value=np.nan, kind="hinted")
+    projection_x = Cpt(Signal, value=np.array([]), kind="normal")
+    projection_y = Cpt(Signal, value=np.array([]), kind="normal")
+
+    def __init__(self, source, *args, handler_registry=None, keep_image=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        if handler_registry is None:
+            handler_registry = globals()["handler_registry"]
+        self._source = source
+        self._handler_registry = handler_registry
+        self.keep_image = keep_image
+        self._asset_docs = []
+
+    def _get_datum(self):
+        """Return the handler, datum kwargs and file of the latest image of the source."""
+        self._asset_docs = list(self._source.collect_asset_docs())
+        docs = dict(self._asset_docs)
+        resource, datum = docs["resource"], docs["datum"]
+        path = os.path.join(resource["root"], resource["resource_path"])
+        handler = self._handler_registry[resource["spec"]]
+        return handler(path, **resource["resource_kwargs"]), datum["datum_kwargs"], path
+
+    def trigger(self):
+        self._source.trigger().wait()
+        handler, datum_kwargs, path = self._get_datum()
+        image = handler(**datum_kwargs)
+        with hot_path_timer.time("beam_statistics"):
+            stats = get_beam_statistics(
+                image,
+                self._source.horizontal_extent.get(),
+                self._source.vertical_extent.get(),
+            )
+        for key, value in stats.items():
+            getattr(self, key).put(value)
+        if not self.keep_image:
+            self._asset_docs = []
+            if hasattr(handler, "evict"):
+                handler.evict(**datum_kwargs)
+            os.remove(path)
+        return NullStatus()
+
+    def read(self):
+        res = super().read()
+        if self.keep_image:
+            res.update(self._source.read())
+        return res
+
+    def describe(self):
+        res = super().describe()
+        if self.keep_image:
+            res.update(self._source.describe())
+        return res
+
+    def collect_asset_docs(self):
+        items, self._asset_docs = self._asset_docs, []
+        yield from items
+
+    def stage(self):
+        self._source.stage()
+        return super().stage()
+
+    def unstage(self):
+        self._source.unstage()
+        return super().unstage()
+
+
+after_v_slit_stats = BeamStatistics(after_v_slit, name="after_v_slit_stats")
+sample_stats = BeamStatistics(sample, name="sample_stats")
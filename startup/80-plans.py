@@ -1,7 +1,13 @@
-print(f"{datetime.datetime.now().isoformat()} Loading {__file__}...")
+startup_timer.start_file(__file__)
+
+import itertools
 
 import bluesky.plan_stubs as bps
 import bluesky.plans as bp
+import bluesky.preprocessors as bpp
+import numpy as np
+from ophyd import Component as Cpt
+from ophyd import Device, Signal
 
 
 def scan_spectra_vs_mag_field(
@@ -28,4 +34,394 @@ def scan_spectra_vs_mag_field(
     return uid
 
 
+def _interpolation_errors(x, y):
+    """
+    Estimate the relative interpolation error in each interval of the (x, y) curve.
+
+    In each interval, the linear interpolation at the midpoint is compared with
+    the quadratics through the interval and its left or right neighbor point.
+    Their difference estimates both the curvature of the curve and the
+    uncertainty of the interpolation (the quadratics disagree where the curve is
+    poorly sampled). At least 3 points are needed.
+    """
+    if len(x) < 3:
+        raise ValueError(f"At least 3 points are needed, got {len(x)}")
+    x_mid = (x[1:] + x[:-1]) / 2
+    linear = (y[1:] + y[:-1]) / 2
+    errors = np.zeros(len(x_mid))
+    for i, mid in enumerate(x_mid):
+        for first in [i - 1, i]:
+            if first < 0 or first + 3 > len(x):
+                continue
+            coeffs = np.polyfit(x[first : first + 3], y[first : first + 3], 2)
+            errors[i] = max(errors[i], abs(np.polyval(coeffs, mid) - linear[i]))
+    return errors / np.abs(linear)
+
+
+def adaptive_scan_spectra_vs_mag_field(
+    dets=[single_electron_spectrum],
+    parameter=undulator.verticalAmplitude if undulator is not None else None,
+    start=0.075,
+    stop=1.5,
+    num_initial=6,
+    max_spectra=41,
+    tolerance=0.01,
+    harm_num=1,
+    initial_energy=0.1,
+    final_energy=1100.0,
+    num_points_per_spectrum=2000,
+    extractor=None,
+    md=None,
+):
+    """
+    Sample the magnetic field adaptively to calibrate the harmonic energy curve.
+
+    The scan starts with ``num_initial`` uniformly spaced spectra. After each
+    round, the energy of the harmonic ``harm_num`` vs. the magnetic field is taken
+    from the peaks found so far by the ``extractor`` (``harmonics_extractor`` by
+    default), the relative interpolation error of each interval is estimated (see
+    ``_interpolation_errors()``), and new spectra are simulated in the middle of
+    the intervals where it is above ``tolerance``. While the harmonic is found in
+    fewer than 3 spectra, the largest interval between the measured magnetic
+    fields is bisected instead. The magnetic fields are measured only once. The
+    scan stops when all the intervals are within ``tolerance`` or after
+    ``max_spectra`` spectra.
+
+    Usage
+    -----
+
+        uid, = RE(adaptive_scan_spectra_vs_mag_field(tolerance=0.005))
+        df_harm = harmonics_extractor.harmonics
+
+    """
+    if extractor is None:
+        extractor = harmonics_extractor
+
+    _md = {
+        "detectors": [det.name for det in dets],
+        "motors": [parameter.name],
+        "plan_name": "adaptive_scan_spectra_vs_mag_field",
+        "plan_args": {
+            "start": start,
+            "stop": stop,
+            "num_initial": num_initial,
+            "max_spectra": max_spectra,
+            "tolerance": tolerance,
+            "harm_num": harm_num,
+        },
+        "hints": {"dimensions": [([parameter.name], "primary")]},
+    }
+    _md.update(md or {})
+
+    @bpp.stage_decorator(dets)
+    @bpp.run_decorator(md=_md)
+    def inner_scan():
+        positions = list(np.linspace(start, stop, num_initial))
+        measured = []
+        while positions:
+            for position in positions:
+                yield from bps.mv(parameter, position)
+                yield from bps.trigger_and_read(list(dets) + [parameter])
+            measured = sorted(measured + positions)
+
+            harmonics = extractor.harmonics.sort_values("magn_field")
+            harmonics = harmonics[np.isfinite(harmonics[f"harmonic{harm_num}"])]
+            magn_field = harmonics["magn_field"].to_numpy()
+            if len(magn_field) < 3:
+                # Too few peaks to estimate the errors, bisect the largest gap:
+                largest = np.argsort(np.diff(measured))[::-1][:1]
+                candidates = [(measured[i] + measured[i + 1]) / 2 for i in largest]
+            else:
+                errors = _interpolation_errors(
+                    magn_field, harmonics[f"harmonic{harm_num}"].to_numpy()
+                )
+                candidates = [
+                    (magn_field[i] + magn_field[i + 1]) / 2
+                    for i in np.argsort(errors)[::-1]
+                    if errors[i] > tolerance
+                ]
+
+            atol = 1e-9 * abs(stop - start)
+            positions = [
+                position
+                for position in candidates
+                if not np.isclose(position, measured, rtol=0, atol=atol).any()
+            ]
+            positions = positions[: max_spectra - len(measured)]
+
+    # Prepare initial conditions:
+    yield from bps.mv(
+        single_electron_spectrum.initialEnergy,
+        initial_energy,
+        single_electron_spectrum.finalEnergy,
+        final_energy,
+        single_electron_spectrum.photonEnergyPointCount,
+        num_points_per_spectrum,
+    )
+
+    return (yield from inner_scan())
+
+
+class WindowedSpectrum(Device):
+    """The spectrum combined from a coarse spectrum and high-resolution windows."""
+
+    photon_energy = Cpt(Signal, kind="normal")
+    image = Cpt(Signal, kind="normal")
+    num_windows = Cpt(Signal, value=0, kind="normal")
+
+
+def _get_harmonic_windows(peak_energies, harmonic_list, half_width, low, high):
+    """
+    Get the (low, high) energy windows around the harmonics of a coarse spectrum.
+
+    Narrow harmonics can fall between the points of a coarse spectrum, most often
+    the fundamental at high magnetic fields. The fundamental energy is therefore
+    estimated from the spacing of the detected (odd) harmonics, each harmonic is
+    searched around the detected peak closest to its predicted energy, or around
+    the prediction itself, with a proportionally wider window, if no peak was
+    detected there. Overlapping windows are merged.
+    """
+    if len(peak_energies) == 0:
+        return []
+    if len(peak_energies) > 1:
+        fundamental = np.median(np.diff(peak_energies)) / 2
+    else:
+        fundamental = peak_energies[0]
+
+    windows = []
+    for harm_num in harmonic_list:
+        predicted = harm_num * fundamental
+        closest = peak_energies[np.argmin(np.abs(peak_energies - predicted))]
+        if abs(closest - predicted) < fundamental / 2:
+            center, width = closest, half_width
+        else:
+            center, width = predicted, harm_num * half_width
+        if center - width < high and center + width > low:
+            windows.append((max(center - width, low), min(center + width, high)))
+
+    merged = []
+    for window_low, window_high in sorted(windows):
+        if merged and window_low <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(window_high, merged[-1][1]))
+        else:
+            merged.append((window_low, window_high))
+    return merged
+
+
+def _combine_spectra(energies, intensities, fine_spectra):
+    """Replace the coarse points inside each high-resolution window by the window."""
+    keep = np.ones(len(energies), dtype=bool)
+    for fine_energies, _ in fine_spectra:
+        keep &= (energies < fine_energies[0]) | (energies > fine_energies[-1])
+    all_energies = np.concatenate(
+        [energies[keep], *[fine_energies for fine_energies, _ in fine_spectra]]
+    )
+    all_intensities = np.concatenate(
+        [intensities[keep], *[fine_intensities for _, fine_intensities in fine_spectra]]
+    )
+    order = np.argsort(all_energies, kind="stable")
+    return all_energies[order], all_intensities[order]
+
+
+def windowed_scan_spectra_vs_mag_field(
+    det=single_electron_spectrum,
+    parameter=undulator.verticalAmplitude if undulator is not None else None,
+    start=0.075,
+    stop=1.5,
+    num_spectra=21,
+    initial_energy=0.1,
+    final_energy=1100.0,
+    num_coarse_points=500,
+    num_fine_points=100,
+    window_steps=2,
+    harmonic_list=[1, 3, 5],
+    method="scipy",
+    thres=0.10,
+    filter_thres=0.2,
+    md=None,
+):
+    """
+    Scan the spectra vs. the magnetic field, in high resolution around the harmonics only.
+
+    For each magnetic field, a coarse spectrum of ``num_coarse_points`` points
+    (stored in the "coarse" stream) locates the peaks of the harmonics in
+    ``harmonic_list``. Each peak is then simulated again with ``num_fine_points``
+    points in a window of +/- ``window_steps`` coarse steps around it (stored in
+    the "fine" stream). The coarse spectrum with the windows spliced in, on its
+    non-uniform energy grid, is read as one event of the primary stream, with the
+    same data keys as the spectra of ``scan_spectra_vs_mag_field()``, so the rest
+    of the analysis is unchanged (``_get_spectra_arrays()`` pads the spectra of
+    different lengths). The energy range of ``det`` is restored at the end of the
+    scan.
+
+    Usage
+    -----
+
+        uid, = RE(windowed_scan_spectra_vs_mag_field())
+        df_harm = harmonics_extractor.harmonics
+
+    """
+    combined = WindowedSpectrum(name=det.name)
+    latest_spectra = LatestSpectra(
+        handler_registry,
+        energy_key=f"{det.name}_photon_energy",
+        intensity_key=f"{det.name}_image",
+    )
+    half_width = (
+        window_steps * (final_energy - initial_energy) / (num_coarse_points - 1)
+    )
+
+    _md = {
+        "detectors": [det.name],
+        "motors": [parameter.name],
+        "num_points": num_spectra,
+        "num_intervals": num_spectra - 1,
+        "plan_name": "windowed_scan_spectra_vs_mag_field",
+        "plan_args": {
+            "start": start,
+            "stop": stop,
+            "num_spectra": num_spectra,
+            "num_coarse_points": num_coarse_points,
+            "num_fine_points": num_fine_points,
+            "window_steps": window_steps,
+        },
+        "hints": {"dimensions": [([parameter.name], "primary")]},
+    }
+    _md.update(md or {})
+
+    def set_energy_range(low, high, num_points):
+        yield from bps.mv(
+            det.initialEnergy,
+            low,
+            det.finalEnergy,
+            high,
+            det.photonEnergyPointCount,
+            num_points,
+        )
+
+    @bpp.subs_decorator(latest_spectra)
+    @bpp.stage_decorator([det])
+    @bpp.run_decorator(md=_md)
+    def inner_scan():
+        for position in np.linspace(start, stop, num_spectra):
+            yield from bps.mv(parameter, position)
+
+            yield from set_energy_range(initial_energy, final_energy, num_coarse_points)
+            yield from bps.trigger_and_read([det, parameter], name="coarse")
+            energies, intensities = latest_spectra.spectra["coarse"]
+
+            peaks = detect_peaks(
+                energies,
+                intensities[np.newaxis, :],
+                method=method,
+                thres=thres,
+                filter_thres=filter_thres,
+            )
+            windows = _get_harmonic_windows(
+                peaks.energies, harmonic_list, half_width, initial_energy, final_energy
+            )
+
+            fine_spectra = []
+            for low, high in windows:
+                yield from set_energy_range(low, high, num_fine_points)
+                yield from bps.trigger_and_read([det], name="fine")
+                fine_spectra.append(latest_spectra.spectra["fine"])
+
+            energies, intensities = _combine_spectra(
+                energies, intensities, fine_spectra
+            )
+            combined.photon_energy.put(energies)
+            combined.image.put(intensities)
+            combined.num_windows.put(len(windows))
+            yield from bps.trigger_and_read([combined, parameter])
+
+    energy_range = (
+        det.initialEnergy.get(),
+        det.finalEnergy.get(),
+        det.photonEnergyPointCount.get(),
+    )
+    return (
+        yield from bpp.finalize_wrapper(
+            inner_scan(), lambda: set_energy_range(*energy_range)
+        )
+    )
+
+
+def _predict_models(motor, positions, report):
+    """
+    Return the Sirepo data which the scan of ``motor`` will simulate at each of the
+    ``positions``, without moving anything.
+
+    The model edits of each move are recorded in a ``ModelTransaction`` and
+    applied to a copy of ``connection.data``. The motor must be a Sirepo signal or
+    define ``_record_model()`` (the EPU, PGM and beamline energies), so its edits
+    only depend on the position and not on the readbacks of the scan.
+    """
+    if hasattr(motor, "_record_model"):
+        record_model = motor._record_model
+    elif type(motor).set is sirepo_ophyd.SirepoSignal.set:
+
+        def record_model(transaction, value):
+            transaction.set(motor, value)
+
+    else:
+        raise TypeError(
+            f"The Sirepo model at the positions of {motor.name} cannot be predicted"
+        )
+    snapshots = []
+    for position in positions:
+        transaction = ModelTransaction()
+        record_model(transaction, position)
+        snapshot = transaction.apply(connection.data)
+        snapshot["report"] = report
+        snapshots.append(snapshot)
+    return snapshots
+
+
+def pipelined_scan(dets, motor, start, stop, num, depth=3, *, md=None):
+    """
+    Scan ``motor`` like ``bp.scan`` while the next Sirepo simulations run ahead.
+
+    Up to ``depth`` simulations for the upcoming points run concurrently on copies
+    of the simulation (see ``SimulationPipeline``), while the scan itself still
+    moves, triggers and reads one point at a time, so the documents come out in
+    the usual order. The Sirepo data of the points are predicted from the motor's
+    model edits before the run opens, without moving it (see
+    ``_predict_models()``), so the motor must be a Sirepo signal or one of the
+    energy signals. The first detector must be a Sirepo detector.
+
+    Usage
+    -----
+
+        RE(pipelined_scan([after_v_slit], pgm.energy, 240, 260, 21, depth=4))
+
+    """
+    positions = list(np.linspace(start, stop, num))
+    snapshots = _predict_models(motor, positions, _get_report_name(dets[0]))
+    pipeline = SimulationPipeline(connection, depth=depth, cache=simulation_cache)
+    steps = itertools.count()
+
+    def per_step(detectors, step, pos_cache):
+        next_point = next(steps) + depth
+        if next_point < len(snapshots):
+            pipeline.submit(snapshots[next_point])
+        yield from bps.one_nd_step(detectors, step, pos_cache)
+
+    def inner_scan():
+        for snapshot in snapshots[:depth]:
+            pipeline.submit(snapshot)
+        _md = {"pipeline_depth": depth}
+        _md.update(md or {})
+        return (
+            yield from bp.list_scan(dets, motor, positions, per_step=per_step, md=_md)
+        )
+
+    def close_pipeline():
+        pipeline.close()
+        yield from bps.null()
+
+    pipeline.install()
+    return (yield from bpp.finalize_wrapper(inner_scan(), close_pipeline))
+
+
 # RE(bp.scan([sample], epu.energy, 100, 800, 8))
@@ -1,26 +1,125 @@
-print(f"{datetime.datetime.now().isoformat()} Loading {__file__}...")
+startup_timer.start_file(__file__)
+
+import itertools
 
 import matplotlib.pyplot as plt
+import numpy as np
+
+
+class ImageStream:
+    """
+    Stream the images of a run frame by frame, without loading the whole stack.
+
+    The frames are read and filled one event at a time, so only the current
+    frame (or chunk of ``chunk_size`` frames) is kept in memory.
+
+    Usage
+    -----
+
+        images = ImageStream(db[uid], "sample_image")
+        vmin, vmax = images.limits()
+        for chunk in images.chunks():
+            ...
+        plot_images(images, nrows=2, ncols=4)
+
+    """
+
+    def __init__(self, hdr, field, stream_name="primary", chunk_size=16):
+        self._hdr = hdr
+        self._field = field
+        self._stream_name = stream_name
+        self._chunk_size = chunk_size
+
+    def __iter__(self):
+        frames = self._hdr.data(self._field, stream_name=self._stream_name, fill=True)
+        for frame in frames:
+            yield np.asarray(frame)
+
+    def __len__(self):
+        return self._hdr.stop["num_events"].get(self._stream_name, 0)
 
+    def chunks(self):
+        """Yield the frames stacked in arrays of up to ``chunk_size`` frames."""
+        frames = iter(self)
+        while True:
+            chunk = list(itertools.islice(frames, self._chunk_size))
+            if not chunk:
+                return
+            yield np.stack(chunk)
 
-def plot_images(data, nrows=2, ncols=4):
+    def limits(self):
+        """Return the (min, max) of all frames, computed in one pass."""
+        return image_limits(self.chunks())
+
+
+def image_limits(frames):
+    """Return the (min, max) over an iterable of frames or chunks, in one pass."""
+    vmin, vmax = np.inf, -np.inf
+    for frame in frames:
+        vmin = min(vmin, np.nanmin(frame))
+        vmax = max(vmax, np.nanmax(frame))
+    return vmin, vmax
+
+
+def downsample_image(image, max_size=256):
+    """
+    Average the image in blocks, so that it has at most ``max_size`` pixels per axis.
+
+    The trailing rows/columns which do not fill a whole block are dropped.
+    """
+    image = np.asarray(image)
+    factors = [max(int(np.ceil(size / max_size)), 1) for size in image.shape]
+    if factors == [1, 1]:
+        return image
+    (ny, fy), (nx, fx) = [(size // f, f) for size, f in zip(image.shape, factors)]
+    return image[: ny * fy, : nx * fx].reshape(ny, fy, nx, fx).mean(axis=(1, 3))
+
+
+def plot_images(
+    data, nrows=2, ncols=4, max_size=256, vmin=None, vmax=None, limits="all"
+):
     """
+    Plot the first ``nrows * ncols`` images with the same color scale.
+
+    ``data`` is a stack of images or any iterable of images, e.g. an
+    ``ImageStream``. The frames are read once: the color limits are accumulated
+    over the full-resolution frames of the whole stack (or only over the plotted
+    frames with ``limits="plotted"``), while only the downsampled previews (at
+    most ``max_size`` pixels per axis) of the plotted frames are kept.
+
     Usage
     -----
 
         nrows, ncols = 2, 4
         uid, = RE(bp.scan([sample], epu.energy, 100, 800, nrows * ncols))
-        hdr = db[uid]
-        data = np.array(list(hdr.data("sample_image")))
-        plot_images(data, nrows=nrows, ncols=ncols)
+        plot_images(ImageStream(db[uid], "sample_image"), nrows=nrows, ncols=ncols)
 
     """
-    fig, ax = plt.subplots(nrows=nrows, ncols=ncols)
-
-    for row in range(nrows):
-        print(f"{row = }")
-        for col in range(ncols):
-            print(f"  {col = } --> {ax[row][col]}")
-            ax[row][col].imshow(
-                data[row * ncols + col], vmin=data.min(), vmax=data.max()
-            )
+    if limits not in ["all", "plotted"]:
+        raise ValueError(f"Unknown limits: {limits}. Allowed limits: all, plotted")
+    num_plots = nrows * ncols
+    previews, shapes = [], []
+    frame_limits = [np.inf, -np.inf]
+    frames = data if limits == "all" else itertools.islice(data, num_plots)
+    for frame in frames:
+        frame = np.asarray(frame)
+        frame_limits = [
+            min(frame_limits[0], np.nanmin(frame)),
+            max(frame_limits[1], np.nanmax(frame)),
+        ]
+        if len(previews) < num_plots:
+            previews.append(downsample_image(frame, max_size=max_size))
+            shapes.append(frame.shape)
+    if vmin is None:
+        vmin = frame_limits[0]
+    if vmax is None:
+        vmax = frame_limits[1]
+
+    fig, ax = plt.subplots(nrows=nrows, ncols=ncols, squeeze=False)
+    for axis, preview, (ny, nx) in zip(ax.ravel(), previews, shapes):
+        # The extent keeps the pixel coordinates of the full-resolution frame.
+        axis.imshow(preview, vmin=vmin, vmax=vmax, extent=(0, nx, ny, 0))
+    return fig
+
+
+startup_timer.report()
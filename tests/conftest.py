@@ -0,0 +1,210 @@
+import os
+import sys
+import threading
+import types
+
+import intake
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from databroker.v1 import Broker
+from ophyd import Component as Cpt
+from ophyd import Device, Signal
+from ophyd.sim import NullStatus
+from sirepo_bluesky.sirepo_bluesky import SirepoBluesky
+
+from benchmarks._startup import PROFILE_DIR, load_startup
+from tools.sirepo_standin import make_server, undulator_spectrum
+
+MODELS = {
+    "undulator": {"period": 62.0, "length": 3.0, "horizontalAmplitude": 0.0},
+    "electronBeam": {"energy": 3.0},
+}
+
+# The definitions of the base file which need a session (the catalog, see
+# load_devices() of the benchmarks):
+BASE_SKIP = ("DATABROKER_CONFIG_DIR", "_")
+
+
+class Undulator(Device):
+    verticalAmplitude = Cpt(Signal, value=0.5)
+
+
+class Spectrum(Device):
+    """A spectrum detector with the data keys of the Sirepo intensity report."""
+
+    initialEnergy = Cpt(Signal, value=0.1, kind="config")
+    finalEnergy = Cpt(Signal, value=1100.0, kind="config")
+    photonEnergyPointCount = Cpt(Signal, value=2000, kind="config")
+    photon_energy = Cpt(Signal, kind="normal")
+    image = Cpt(Signal, kind="normal")
+
+    def __init__(self, *args, undulator, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._undulator = undulator
+
+    def trigger(self):
+        energies = np.linspace(
+            self.initialEnergy.get(),
+            self.finalEnergy.get(),
+            self.photonEnergyPointCount.get(),
+        )
+        magn_field = self._undulator.verticalAmplitude.get()
+        undulator = dict(MODELS["undulator"], verticalAmplitude=magn_field)
+        models = dict(MODELS, undulator=undulator)
+        self.photon_energy.put(energies)
+        self.image.put(undulator_spectrum(models, energies))
+        return NullStatus()
+
+
+@pytest.fixture(scope="session")
+def peak_finding():
+    """
+    The definitions of 20-peak-finding.py, loaded into a module so the workers of
+    the process pools can unpickle its functions (in IPython, they are found in
+    __main__).
+    """
+    module = types.ModuleType("profile_peak_finding")
+    sys.modules[module.__name__] = module
+    yield load_startup("20-peak-finding.py", namespace=vars(module))
+    del sys.modules[module.__name__]
+
+
+@pytest.fixture
+def open_catalog(tmp_path):
+    """Return a function opening the embedded catalog of the profile in tmp_path."""
+
+    def open_catalog():
+        with open(
+            os.path.join(PROFILE_DIR, "configs", "databroker", "local-embedded.yml")
+        ) as f:
+            config = f.read().replace(
+                "/tmp/sirepo-bluesky-data/databroker", str(tmp_path / "databroker")
+            )
+        path = tmp_path / "local-embedded.yml"
+        path.write_text(config)
+        os.makedirs(tmp_path / "databroker", exist_ok=True)
+        return Broker(intake.open_catalog(str(path))["local-embedded"].get())
+
+    return open_catalog
+
+
+@pytest.fixture
+def profile(open_catalog):
+    """
+    The analysis startup files and plans with a synthetic spectrum detector,
+    subscribed like in the profile, with the embedded catalog as ``db``.
+    """
+    undulator = Undulator(name="undulator")
+    namespace = {
+        "undulator": undulator,
+        "single_electron_spectrum": Spectrum(
+            name="single_electron_spectrum", undulator=undulator
+        ),
+    }
+    # From the base file, only the timers are loaded.
+    ns = load_startup("00-base.py", namespace=namespace, skip=BASE_SKIP)
+    ns["handler_registry"] = {}
+    ns = load_startup(
+        "20-peak-finding.py",
+        "21-harmonics-callback.py",
+        "22-hot-path-timing.py",
+        "80-plans.py",
+        namespace=ns,
+    )
+
+    # The subscriptions of the startup files:
+    db = open_catalog()
+    RE = RunEngine({})
+    RE.subscribe(db.insert)
+    RE.subscribe(ns["harmonics_extractor"])
+    RE.subscribe(ns["hot_path_timing"])
+    ns["secondary_stream_sources"].append(ns["hot_path_timing"])
+    RE.preprocessors.append(
+        lambda plan: ns["secondary_streams_wrapper"](
+            plan, ns["secondary_stream_sources"]
+        )
+    )
+    ns.update(RE=RE, db=db)
+    return ns
+
+
+@pytest.fixture
+def start_standin():
+    """
+    Return a function starting the Sirepo stand-in server (seeded from
+    tools/data/srw-seed.json) and returning its URL. The servers are shut down
+    after the test.
+    """
+    servers = []
+
+    def start_standin(**kwargs):
+        server = make_server(port=0, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://localhost:{server.server_port}"
+
+    yield start_standin
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def sirepo_session(start_standin, open_catalog):
+    """
+    Return a function opening the ARI simulation of a stand-in server, with the
+    Sirepo objects, a RunEngine and the embedded catalog as ``db``. The keyword
+    arguments are passed to the server (e.g. ``latency``).
+    """
+    pytest.importorskip("Shadow")  # imported by sirepo_bluesky.sirepo_ophyd
+    from sirepo_bluesky.sirepo_ophyd import create_classes
+    from sirepo_bluesky.srw_handler import SRWFileHandler
+
+    def sirepo_session(**kwargs):
+        connection = SirepoBluesky(start_standin(**kwargs))
+        connection.auth("srw", "00000004")
+        classes, objects = create_classes(
+            connection=connection, extra_model_fields=["undulator", "intensityReport"]
+        )
+        db = open_catalog()
+        db.reg.register_handler("srw", SRWFileHandler, overwrite=True)
+        RE = RunEngine({})
+        RE.subscribe(db.insert)
+        return dict(
+            objects,
+            connection=connection,
+            classes=classes,
+            objects=objects,
+            RE=RE,
+            db=db,
+        )
+
+    return sirepo_session
+
+
+@pytest.fixture
+def sirepo_devices(sirepo_session):
+    """
+    The EPU (with the harmonics table), PGM and beamline energy devices of the
+    startup files on the simulation of a stand-in server, constructed like in the
+    startup files.
+    """
+    ns = load_startup("00-base.py", namespace=sirepo_session(), skip=BASE_SKIP)
+    ns = load_startup(
+        "11-sirepo-execution.py",
+        "20-peak-finding.py",
+        "30-epu-energy.py",
+        "31-pgm-energy.py",
+        "32-beamline-energy.py",
+        namespace=dict(ns, USE_SIREPO=False),
+    )
+    df_harm = ns["load_harmonics_json"](path=ns["HARMONICS_JSON"])
+    ns["epu"] = epu = ns["EPU"](name="epu", harmonics_df=df_harm)
+    ns["pgm"] = pgm = ns["PGM"](name="pgm")
+    pgm.grating_name.set("HighR")
+    pgm.energy.set(ns["connection"].data["models"]["simulation"]["photonEnergy"])
+    ns["beamline_energy"] = ns["BeamlineEnergy"](
+        name="beamline_energy", epu=epu, pgm=pgm
+    )
+    return ns
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+
+def test_interpolation_errors(profile):
+    interpolation_errors = profile["_interpolation_errors"]
+    x = np.linspace(0.0, 1.0, 5)
+    # A line is interpolated exactly, a parabola is not:
+    np.testing.assert_allclose(interpolation_errors(x, 1 + x), 0, atol=1e-12)
+    assert np.all(interpolation_errors(x, 1 + x**2) > 0)
+    with pytest.raises(ValueError, match="At least 3 points"):
+        interpolation_errors(x[:2], x[:2])
+
+
+def test_adaptive_scan_few_peaks(profile, open_catalog):
+    """The scan goes on while the harmonic is found in fewer than 3 spectra."""
+    RE = profile["RE"]
+    (uid,) = RE(
+        profile["adaptive_scan_spectra_vs_mag_field"](
+            start=0.1,
+            stop=1.0,
+            num_initial=3,
+            max_spectra=9,
+            harm_num=5,
+            final_energy=300.0,
+            num_points_per_spectrum=1000,
+        )
+    )
+
+    magn_field = open_catalog()[uid].table()["undulator_verticalAmplitude"]
+    assert len(magn_field) == 9
+    assert magn_field.is_unique
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from benchmarks._startup import load_startup
+
+FWHM_PER_SIGMA = 2 * np.sqrt(2 * np.log(2))
+
+
+@pytest.fixture(scope="module")
+def get_beam_statistics():
+    ns = load_startup(
+        "35-beam-statistics.py", skip=("after_v_slit_stats", "sample_stats")
+    )
+    return ns["get_beam_statistics"]
+
+
+def _gaussian(x0, sigma_x, y0, sigma_y, horizontal_extent, vertical_extent, shape):
+    y = np.linspace(*vertical_extent, shape[0])[:, np.newaxis]
+    x = np.linspace(*horizontal_extent, shape[1])
+    return 1e12 * np.exp(-0.5 * (((x - x0) / sigma_x) ** 2 + ((y - y0) / sigma_y) ** 2))
+
+
+@pytest.mark.parametrize("shape", [(151, 201), (60, 40)])
+def test_gaussian(get_beam_statistics, shape):
+    extents = (-0.5e-3, 0.5e-3), (-0.25e-3, 0.25e-3)
+    x0, sigma_x, y0, sigma_y = 0.1e-3, 0.08e-3, -0.02e-3, 0.03e-3
+    image = _gaussian(x0, sigma_x, y0, sigma_y, *extents, shape)
+    stats = get_beam_statistics(image, *extents)
+
+    assert stats["flux"] == pytest.approx(image.sum())
+    assert stats["peak"] == image.max()
+    np.testing.assert_allclose(stats["projection_x"], image.sum(axis=0))
+    np.testing.assert_allclose(stats["projection_y"], image.sum(axis=1))
+    # The Gaussian is sampled well within the extents, so the moments are exact
+    # up to the sampling; the FWHM is interpolated between the samples:
+    spacing_x = np.diff(extents[0])[0] / (shape[1] - 1)
+    spacing_y = np.diff(extents[1])[0] / (shape[0] - 1)
+    assert stats["centroid_x"] == pytest.approx(x0, abs=1e-3 * spacing_x)
+    assert stats["centroid_y"] == pytest.approx(y0, abs=1e-3 * spacing_y)
+    assert stats["rms_x"] == pytest.approx(sigma_x, rel=1e-3)
+    assert stats["rms_y"] == pytest.approx(sigma_y, rel=1e-3)
+    fwhm_x, fwhm_y = FWHM_PER_SIGMA * sigma_x, FWHM_PER_SIGMA * sigma_y
+    assert stats["fwhm_x"] == pytest.approx(fwhm_x, abs=spacing_x / 2)
+    assert stats["fwhm_y"] == pytest.approx(fwhm_y, abs=spacing_y / 2)
+
+
+def test_empty_image(get_beam_statistics):
+    stats = get_beam_statistics(np.zeros((10, 20)), (-1, 1), (-1, 1))
+    assert stats["flux"] == 0
+    for key in ["centroid_x", "rms_y", "fwhm_x", "fwhm_y"]:
+        assert np.isnan(stats[key])
@@ -0,0 +1,35 @@
+import bluesky.plans as bp
+import numpy as np
+
+
+def test_one_transaction_per_point(sirepo_devices, monkeypatch):
+    ns = sirepo_devices
+    ModelTransaction = ns["ModelTransaction"]
+    commit = ModelTransaction.commit
+    diffs = []
+
+    def recording_commit(self):
+        diffs.append(commit(self))
+        return diffs[-1]
+
+    monkeypatch.setattr(ModelTransaction, "commit", recording_commit)
+    beamline_energy, epu, pgm = ns["beamline_energy"], ns["epu"], ns["pgm"]
+    energies = [255.0, 260.0, 265.0]
+    ns["RE"](bp.list_scan([beamline_energy], beamline_energy.energy, energies))
+
+    assert len(diffs) == len(energies)
+    models = ns["connection"].data["models"]
+    for diff in diffs:
+        params = sorted(param for param, _, _ in diff)
+        assert params == sorted(
+            ["photonEnergy", "cff", "grazingAngle", "grazingAngle", "verticalAmplitude"]
+        )
+    # The last transaction left the model and the readbacks in sync:
+    assert models["simulation"]["photonEnergy"] == energies[-1]
+    assert pgm.energy.get() == energies[-1]
+    epu_energy = energies[-1] + beamline_energy.get_detuning(energies[-1])
+    assert beamline_energy.epu_energy.get() == epu_energy
+    assert epu.energy.get() == epu_energy
+    assert models["undulator"]["verticalAmplitude"] == epu.magn_field_ver.get()
+    # The forward and inverse interpolations of the table agree to about 1e-3:
+    np.testing.assert_allclose(epu._get_energy(), epu_energy, rtol=1e-3)
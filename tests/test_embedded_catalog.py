@@ -0,0 +1,24 @@
+import time
+
+import bluesky.plans as bp
+
+
+def test_runs_read_back(profile, open_catalog):
+    """The runs are read back by uid, scan_id, recency and time after reopening."""
+    RE, det = profile["RE"], profile["single_electron_spectrum"]
+    det.photonEnergyPointCount.put(100)
+    before = time.time()
+    uids = [RE(bp.count([det], num=2))[0] for _ in range(3)]
+
+    db = open_catalog()
+    for scan_id, uid in enumerate(uids, start=1):
+        hdr = db[uid]
+        assert hdr.start["scan_id"] == scan_id
+        assert hdr.stop["exit_status"] == "success"
+        assert db[scan_id].start["uid"] == uid
+        table = hdr.table()
+        assert len(table) == 2
+        assert table[f"{det.name}_image"].iloc[0].shape == (100,)
+    assert db[-1].start["uid"] == uids[-1]
+    assert {hdr.start["uid"] for hdr in db(since=before)} == set(uids)
+    assert list(db(since=time.time() + 60)) == []
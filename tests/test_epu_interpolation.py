@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from benchmarks._startup import load_devices
+
+
+@pytest.fixture(scope="module")
+def devices():
+    pytest.importorskip("Shadow")  # imported by sirepo_bluesky.sirepo_ophyd
+    return load_devices()
+
+
+def _harmonics_table(devices):
+    """The harmonics table of the profile, with an outlier in the harmonic 1."""
+    df = devices["load_harmonics_json"](path=devices["HARMONICS_JSON"]).copy()
+    df.loc[df.index[len(df) // 2], "harmonic1"] *= 1.5
+    return df
+
+
+def test_inverse_is_monotonic(devices):
+    df = _harmonics_table(devices)
+    epu = devices["EPU"](name="epu", harmonics_df=df)
+    harm_nums = epu._get_harmonic_list()
+    assert 1 in harm_nums and len(harm_nums) > 1
+    for harm_num in harm_nums:
+        forward, inverse = epu._get_interpolators(harm_num)
+        magn_field = np.asarray(df["magn_field"], dtype=float)
+        energy = np.asarray(df[f"harmonic{harm_num}"], dtype=float)
+        valid = np.isfinite(magn_field) & np.isfinite(energy)
+        magn_fields = np.linspace(magn_field[valid].min(), magn_field[valid].max())
+        energies = forward(magn_fields)
+        assert np.all(np.diff(energies) < 0), harm_num
+        # The inverse is monotonic over the energy range, and inverts the forward
+        # interpolation (exactly at the points of the table, as both splines go
+        # through them, and within a tenth of their spacing between them):
+        inverse_fields = inverse(np.linspace(energies.min(), energies.max()))
+        assert np.all(np.diff(inverse_fields) < 0), harm_num
+        spacing = np.diff(np.unique(magn_field[valid])).min()
+        np.testing.assert_allclose(inverse(energies), magn_fields, atol=spacing / 10)
+
+
+def test_interpolators_are_cached(devices):
+    df = _harmonics_table(devices)
+    epu = devices["EPU"](name="epu", harmonics_df=df)
+    interpolators = epu._get_interpolators(1)
+    assert epu._get_interpolators() is interpolators  # harm_num is 1
+    energies = np.array([300.0, 400.0])
+    np.testing.assert_allclose(
+        epu._get_magn_field(energies), [epu._get_magn_field(e) for e in energies]
+    )
+    epu.harmonics_df = df
+    assert epu._get_interpolators(1) is not interpolators
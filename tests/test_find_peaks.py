@@ -0,0 +1,51 @@
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import peakutils
+import pytest
+
+from benchmarks._startup import DATA_DIR, load_startup
+
+
+def _baseline_find_peaks(df, harm_num=0, thres=0.10, filter_thres=0.2):
+    """The original find_peaks() (without the prints and the plot)."""
+    rows = []
+    for energy, intensity, mag_field in zip(
+        df["single_electron_spectrum_photon_energy"],
+        df["single_electron_spectrum_image"],
+        df["undulator_verticalAmplitude"],
+    ):
+        energy, intensity = np.asarray(energy), np.asarray(intensity)
+        idx = peakutils.indexes(intensity, thres=thres)
+        filtered_peaks_idx = [idx[0]]
+        for i in idx[1:]:
+            if intensity[i - 1] / intensity[i] >= filter_thres:
+                filtered_peaks_idx.append(i)
+        if len(filtered_peaks_idx) > harm_num:  # the original raised IndexError
+            rows.append((mag_field, energy[filtered_peaks_idx][harm_num]))
+    return pd.DataFrame(rows, columns=["mag_field", "energy"])
+
+
+@pytest.fixture(scope="module")
+def ns():
+    return load_startup("20-peak-finding.py")
+
+
+@pytest.fixture(scope="module")
+def df():
+    return pd.read_json(os.path.join(DATA_DIR, "scan-spectra-vs-und-magn-field.json"))
+
+
+@pytest.mark.parametrize("harm_num", [0, 1, 2, 3])
+@pytest.mark.parametrize("thres, filter_thres", [(0.05, 0.2), (0.10, 0.2), (0.1, 0.5)])
+def test_find_peaks_baseline(ns, df, harm_num, thres, filter_thres):
+    fig, ax = plt.subplots()
+    lookup = ns["find_peaks"](
+        df, harm_num=harm_num, thres=thres, filter_thres=filter_thres, ax=ax
+    )
+    plt.close(fig)
+    expected = _baseline_find_peaks(df, harm_num, thres, filter_thres)
+    assert len(lookup) > 0
+    pd.testing.assert_frame_equal(lookup, expected, check_dtype=False)
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks._startup import load_startup, synthetic_scan
+
+
+@pytest.fixture(scope="module")
+def ns():
+    return load_startup("20-peak-finding.py")
+
+
+@pytest.fixture(scope="module")
+def model(ns):
+    return ns["HarmonicsModel"](e0=1221.1, k=6.54)
+
+
+def test_from_spectra(ns, model):
+    flux_map = ns["FluxMap"].from_spectra(synthetic_scan("21x2000"), model)
+    assert flux_map.harmonics[:3] == [1, 3, 5]
+    table = flux_map.tables[1]
+    assert np.all(np.diff(table["energy"]) >= 0)
+    np.testing.assert_allclose(
+        table["energy"], model.energy(table["magn_field"]), rtol=0.01
+    )
+    harm_num, magn_field, flux = flux_map.best_harmonic(500.0)
+    assert harm_num == 1 and flux > 0
+
+
+def test_from_spectra_repeated_fields(ns, model):
+    """The peaks of the spectra taken at the same magnetic field are all kept."""
+    df = synthetic_scan("21x2000")
+    flux_map = ns["FluxMap"].from_spectra(df, model)
+    repeated = ns["FluxMap"].from_spectra(pd.concat([df, df]), model)
+    assert repeated.harmonics == flux_map.harmonics
+    for harm_num in flux_map.harmonics:
+        for key, values in flux_map.tables[harm_num].items():
+            np.testing.assert_allclose(repeated.tables[harm_num][key][::2], values)
+            np.testing.assert_allclose(repeated.tables[harm_num][key][1::2], values)
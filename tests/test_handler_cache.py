@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+from conftest import BASE_SKIP
+from sirepo_bluesky.srw_handler import SRWFileHandler, read_srw_file
+
+from benchmarks._startup import load_startup
+from tools.sirepo_standin import _srw_text
+
+
+@pytest.fixture(scope="module")
+def handler_cache():
+    """The definitions of the handler cache, with the SRW handler only."""
+    ns = load_startup("00-base.py", skip=BASE_SKIP)
+    ns["SRWFileHandler"] = SRWFileHandler  # imported in a timed phase
+    return load_startup(
+        "05-handler-cache.py",
+        namespace=ns,
+        skip=("CachingShadowFileHandler", "handler_registry"),
+    )
+
+
+@pytest.fixture
+def srw_files(tmp_path):
+    rng = np.random.default_rng(0)
+    image_path = tmp_path / "image.dat"
+    image_path.write_text(
+        _srw_text(rng.random((30, 40)), (250, 250, 1), (-1e-3, 1e-3, 40), (0, 1, 30))
+    )
+    spectrum_path = tmp_path / "spectrum.dat"
+    spectrum_path.write_text(
+        _srw_text(rng.random(200) * 1e12, (0.1, 1100, 200), (0, 0, 1), (0, 0, 1))
+    )
+    return {2: str(image_path), 1: str(spectrum_path)}
+
+
+@pytest.mark.parametrize("ndim", [2, 1])
+def test_read_srw_data(handler_cache, srw_files, ndim):
+    data = handler_cache["_read_srw_data"](srw_files[ndim], ndim=ndim)
+    expected = read_srw_file(srw_files[ndim], ndim=ndim)["data"]
+    assert data.shape == expected.shape
+    np.testing.assert_array_equal(data, expected)
+
+
+def test_lru_byte_bound(handler_cache):
+    array_bytes = np.zeros(100).nbytes
+    cache = handler_cache["HandlerCache"](max_bytes=3 * array_bytes)
+    for key in "abc":
+        cache.get(key, lambda: np.zeros(100))
+    cache.get("a", lambda: pytest.fail("'a' is cached"))  # the most recent now
+    cache.get("d", lambda: np.zeros(100))
+    assert [key in cache for key in "abcd"] == [True, False, True, True]
+    cache.get("e", lambda: np.zeros(100))
+    assert [key in cache for key in "abcde"] == [True, False, False, True, True]
+
+    cache.get("big", lambda: np.zeros(400))  # larger than the cache, not kept
+    assert "big" not in cache
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 6)
+    assert (stats["entries"], stats["bytes"]) == (3, 3 * array_bytes)
+
+    data = cache.get("a", lambda: None)
+    with pytest.raises(ValueError, match="read-only"):
+        data[0] = 1.0
+
+
+def test_caching_handler(handler_cache, srw_files, monkeypatch):
+    cache = handler_cache["HandlerCache"]()
+    monkeypatch.setitem(handler_cache, "handler_cache", cache)
+    handler = handler_cache["CachingSRWFileHandler"](srw_files[2], ndim=2)
+    data = handler()
+    assert handler() is data
+    assert cache.stats()["misses"] == 1
+
+    # A rewritten file is decoded again:
+    with open(srw_files[2], "a") as f:
+        f.write("\n")
+    os.utime(srw_files[2], ns=(0, 0))
+    assert handler() is not data
+    assert cache.stats()["misses"] == 2
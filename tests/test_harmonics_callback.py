@@ -0,0 +1,19 @@
+import numpy as np
+
+
+def test_harmonics_stream(profile, open_catalog):
+    RE = profile["RE"]
+    (uid,) = RE(
+        profile["scan_spectra_vs_mag_field"](
+            start=0.3, stop=1.0, num_spectra=5, num_points_per_spectrum=500
+        )
+    )
+
+    hdr = open_catalog()[uid]
+    assert hdr.stop["exit_status"] == "success"
+    assert len(hdr.table()) == 5
+    harmonics = hdr.table("harmonics")
+    expected = profile["harmonics_extractor"].harmonics
+    assert list(harmonics.columns[1:]) == list(expected.columns)
+    np.testing.assert_allclose(harmonics[expected.columns].to_numpy(), expected)
+    assert "timing" not in hdr.stream_names  # the timer is disabled
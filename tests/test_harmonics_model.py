@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from benchmarks._startup import load_devices, load_startup
+
+
+@pytest.fixture(scope="module")
+def model():
+    ns = load_startup("20-peak-finding.py")
+    return ns["HarmonicsModel"](e0=1221.1, k=6.54)
+
+
+def test_magn_field(model):
+    magn_field = np.linspace(0.0, 1.5, 16)
+    for harm_num in [1, 3, 5]:
+        energy = model.energy(magn_field, harm_num)
+        np.testing.assert_allclose(model.magn_field(energy, harm_num), magn_field)
+
+
+@pytest.mark.parametrize("energy", [1300.0, [500.0, 1300.0], 0.0, np.nan])
+def test_magn_field_unreachable(model, energy):
+    with pytest.raises(ValueError, match="cannot be reached with the harmonic 1"):
+        model.magn_field(energy)
+
+
+def test_epu_unreachable_energy(model):
+    pytest.importorskip("Shadow")  # imported by sirepo_bluesky.sirepo_ophyd
+    ns = load_devices()
+    epu = ns["EPU"](name="epu", model=model)
+    epu.energy.set(500.0)
+    magn_field = epu.magn_field_ver.get()
+    with pytest.raises(ValueError, match="cannot be reached"):
+        epu.energy.set(1300.0)
+    assert epu.magn_field_ver.get() == magn_field
+    assert epu.energy.get() == 500.0
+
+
+def test_epu_unreachable_energy_restores_harmonic(model):
+    pytest.importorskip("Shadow")  # imported by sirepo_bluesky.sirepo_ophyd
+    ns = load_devices()
+    # The flux map covers 3800 eV with the harmonic 3, beyond the reach of the model
+    # (3 * e0 = 3663 eV):
+    flux_map = ns["FluxMap"](
+        {
+            1: {"energy": [100, 1200], "magn_field": [1.4, 0.1], "flux": [1, 1]},
+            3: {"energy": [3000, 4000], "magn_field": [0.6, 0.0], "flux": [2, 2]},
+        }
+    )
+    epu = ns["EPU"](name="epu", model=model, flux_map=flux_map)
+    epu.auto_harmonic.put(True)
+    epu.energy.set(500.0)
+    assert epu.harm_num.get() == 1
+    magn_field = epu.magn_field_ver.get()
+
+    with pytest.raises(ValueError, match="cannot be reached with the harmonic 3"):
+        epu.energy.set(3800.0)
+    assert epu.harm_num.get() == 1
+    assert epu.magn_field_ver.get() == magn_field
+    assert epu.energy.get() == 500.0
+
+    epu.energy.set(3200.0)
+    assert epu.harm_num.get() == 3
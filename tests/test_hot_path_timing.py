@@ -0,0 +1,40 @@
+import time
+
+
+def test_timer(profile):
+    timer = profile["HotPathTimer"]()
+    with timer.time("stage"):
+        time.sleep(0.01)
+    assert timer.take_point() == {}  # disabled
+
+    timer.enabled = True
+    for _ in range(2):
+        with timer.time("stage"):
+            time.sleep(0.01)
+    timer.wrap("other", time.sleep)(0.01)
+    point = timer.take_point()
+    assert set(point) == {"stage", "other"}
+    assert point["stage"] >= 0.02 and point["other"] >= 0.01
+    assert timer.take_point() == {}
+
+
+def test_timing_stream(profile, open_catalog):
+    RE, timer = profile["RE"], profile["hot_path_timer"]
+    det = profile["single_electron_spectrum"]
+    det.trigger = timer.wrap("spectrum.trigger", det.trigger)
+    timer.enabled = True
+    (uid,) = RE(
+        profile["scan_spectra_vs_mag_field"](
+            start=0.3, stop=1.0, num_spectra=3, num_points_per_spectrum=500
+        )
+    )
+
+    hdr = open_catalog()[uid]
+    assert hdr.stop["exit_status"] == "success"
+    assert set(hdr.stream_names) == {"primary", "harmonics", "timing"}
+    timing = hdr.table("timing")
+    assert list(timing.columns[1:]) == ["spectrum_trigger", "point"]
+    assert len(timing) == 3
+    assert (timing["point"] >= timing["spectrum_trigger"]).all()
+    summary = profile["hot_path_timing"].summary
+    assert summary.loc["spectrum.trigger", "count"] == 3
@@ -0,0 +1,84 @@
+import copy
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="module")
+def ModelTransaction():
+    pytest.importorskip("Shadow")  # imported by sirepo_bluesky.sirepo_ophyd
+    from benchmarks._startup import load_startup
+
+    ns = load_startup("11-sirepo-execution.py", namespace={"USE_SIREPO": False})
+    return ns["ModelTransaction"]
+
+
+@pytest.fixture
+def data():
+    return {
+        "models": {
+            "simulation": {"photonEnergy": 250.0},
+            "grating": {"cff": 2.0, "grazingAngle": 30.0},
+        }
+    }
+
+
+def test_commit(ModelTransaction, data):
+    models = data["models"]
+    with ModelTransaction() as transaction:
+        transaction.set_param(models["simulation"], "photonEnergy", 300.0)
+        transaction.set_param(models["grating"], "cff", 2.0)  # unchanged
+        transaction.set_param(models["grating"], "grazingAngle", 31.0)
+        transaction.set_param(models["grating"], "grazingAngle", 32.0)  # last wins
+        assert models["simulation"]["photonEnergy"] == 250.0  # not applied yet
+    assert transaction.diff == [
+        ("photonEnergy", 250.0, 300.0),
+        ("grazingAngle", 30.0, 32.0),
+    ]
+    assert models["simulation"]["photonEnergy"] == 300.0
+    assert models["grating"] == {"cff": 2.0, "grazingAngle": 32.0}
+
+
+@pytest.mark.parametrize("value", [np.nan, np.inf, -np.inf])
+def test_invalid_value(ModelTransaction, data, value):
+    original = copy.deepcopy(data)
+    with pytest.raises(ValueError, match="the model is not updated"):
+        with ModelTransaction() as transaction:
+            transaction.set_param(data["models"]["simulation"], "photonEnergy", 300.0)
+            transaction.set_param(data["models"]["grating"], "cff", value)
+    assert data == original
+    assert transaction.diff == []
+
+
+def test_exception_in_the_block(ModelTransaction, data):
+    original = copy.deepcopy(data)
+    with pytest.raises(RuntimeError, match="interrupted"):
+        with ModelTransaction() as transaction:
+            transaction.set_param(data["models"]["simulation"], "photonEnergy", 300.0)
+            raise RuntimeError("interrupted")
+    assert data == original
+
+
+def test_apply(ModelTransaction, data):
+    original = copy.deepcopy(data)
+    transaction = ModelTransaction()
+    transaction.set_param(data["models"]["grating"], "cff", 2.5)
+    applied = transaction.apply(data)
+    assert applied["models"]["grating"]["cff"] == 2.5
+    assert applied["models"]["simulation"] == original["models"]["simulation"]
+    assert data == original
+
+    transaction.set_param({"cff": 2.0}, "cff", 3.0)
+    with pytest.raises(ValueError, match="not in the Sirepo data"):
+        transaction.apply(data)
+
+
+def test_pgm_out_of_range(sirepo_devices):
+    """An energy without PGM angles leaves the model and the PGM untouched."""
+    pgm, connection = sirepo_devices["pgm"], sirepo_devices["connection"]
+    original = copy.deepcopy(connection.data)
+    energy, cff = pgm.energy.get(), pgm.cff.get()
+    with pytest.raises(ValueError, match="the model is not updated"):
+        pgm.energy.set(-10.0)
+    assert connection.data == original
+    assert (pgm.energy.get(), pgm.cff.get()) == (energy, cff)
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+from benchmarks._startup import synthetic_scan
+
+PARAMS = [("scipy", 0.05, 0.2), ("peakutils", 0.10, 0.2)]
+
+
+def test_render_peak_reports(peak_finding, tmp_path):
+    path = str(tmp_path / "{method}-{thres:.2f}-{filter_thres:.2f}.png")
+    futures = peak_finding["render_peak_reports"](
+        synthetic_scan("21x2000"), PARAMS, path=path, max_workers=2
+    )
+    assert list(futures) == PARAMS
+    paths = [future.result(timeout=60) for future in futures.values()]
+    assert paths == [
+        str(tmp_path / "scipy-0.05-0.20.png"),
+        str(tmp_path / "peakutils-0.10-0.20.png"),
+    ]
+    for path in paths:
+        with open(path, "rb") as f:
+            assert f.read(8) == b"\x89PNG\r\n\x1a\n"
+
+
+def test_unknown_method(peak_finding, tmp_path, monkeypatch):
+    """The parameters are validated before the pool is created."""
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("the pool is created before the validation")
+
+    monkeypatch.setitem(peak_finding, "ProcessPoolExecutor", no_pool)
+    with pytest.raises(ValueError, match="Unknown method: find"):
+        peak_finding["render_peak_reports"](
+            synthetic_scan("21x200"),
+            PARAMS + [("find", 0.1, 0.2)],
+            path=str(tmp_path / "{method}.png"),
+        )
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,68 @@
+import pytest
+
+
+@pytest.fixture
+def pgm(sirepo_devices, monkeypatch):
+    """The PGM, counting the cff calculations."""
+    ns = sirepo_devices
+    get_cff = ns["_get_cff"]
+    calls = []
+
+    def counting_get_cff(*args, **kwargs):
+        calls.append(args)
+        return get_cff(*args, **kwargs)
+
+    monkeypatch.setitem(ns, "_get_cff", counting_get_cff)
+    pgm = ns["pgm"]
+    pgm.calls = calls
+    pgm.get_cff = get_cff
+    pgm.cff.get()
+    calls.clear()
+    return pgm
+
+
+def _expected_cff(pgm):
+    return pgm.get_cff(
+        pgm.energy.get(),
+        pgm.grating_name.get(),
+        r2=pgm._r2.get(),
+        r1=pgm._r1.get(),
+        m=pgm._m.get(),
+        gratings=pgm._gratings.get(),
+    )
+
+
+def test_cff_is_memoized(sirepo_devices, pgm):
+    model = sirepo_devices["objects"]["grating"].cff._sirepo_dict
+    cff = pgm.cff.get()
+    for _ in range(3):
+        assert pgm.cff.get() == cff
+    assert pgm.calls == []
+    assert model["cff"] == cff
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda pgm: pgm.energy.set(300.0),
+        lambda pgm: pgm.grating_name.put("LowE"),
+        lambda pgm: pgm._r2.put(pgm._r2.get() * 1.1),
+        lambda pgm: pgm._r1.put(pgm._r1.get() * 1.1),
+        lambda pgm: pgm._m.put(2),
+        # The grating table is compared by value, so it can be edited in place:
+        lambda pgm: pgm._gratings.get()["HighR"].update(a1=0.06),
+    ],
+    ids=["energy", "grating", "r2", "r1", "m", "grating_table"],
+)
+def test_cff_is_invalidated(sirepo_devices, pgm, change):
+    model = sirepo_devices["objects"]["grating"].cff._sirepo_dict
+    cff = pgm.cff.get()
+    change(pgm)
+    new_cff = pgm.cff.get()
+    assert new_cff != cff
+    assert new_cff == _expected_cff(pgm)
+    assert model["cff"] == new_cff
+    # The cff is computed once, by the move (energy, grating) or by the readback:
+    assert len(pgm.calls) == 1
+    assert pgm.cff.get() == new_cff
+    assert len(pgm.calls) == 1
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from benchmarks._startup import load_devices
+from benchmarks.bench_kinematics import PGM_ANGLE_KWARGS, PGM_KWARGS
+
+
+@pytest.fixture(scope="module")
+def devices():
+    pytest.importorskip("Shadow")  # imported by sirepo_bluesky.sirepo_ophyd
+    return load_devices()
+
+
+@pytest.fixture(scope="module")
+def tables(devices):
+    return devices["PGMLookupTable"](
+        devices["_ari_gratings"], **PGM_KWARGS, **PGM_ANGLE_KWARGS
+    )
+
+
+def test_round_trip_error(devices, tables):
+    report = tables.round_trip_error()
+    assert list(report.index) == list(devices["_ari_gratings"])
+    assert (report["valid_fraction"] == 1.0).all()
+    assert (report["cff_max_abs_err"] < 1e-8).all()
+    assert (report["theta_m2_max_abs_err"] < 1e-6).all()
+    assert (report["theta_gr_max_abs_err"] < 1e-6).all()
+    assert (report["energy_max_rel_err"] < 1e-7).all()
+
+    # The interpolation errors decrease with the square of the grid spacing:
+    coarse = devices["PGMLookupTable"](
+        devices["_ari_gratings"], **PGM_KWARGS, **PGM_ANGLE_KWARGS, num_points=2_001
+    ).round_trip_error()
+    ratio = coarse["energy_max_rel_err"] / report["energy_max_rel_err"]
+    assert ((ratio > 50) & (ratio < 200)).all()
+
+
+@pytest.mark.parametrize("grating", ["LowE", "HighE", "HighR"])
+def test_lookup_matches_the_kinematics(devices, tables, grating):
+    energies = np.random.default_rng(0).uniform(20.0, 2000.0, 50)
+    gratings = devices["_ari_gratings"]
+    cff = [
+        devices["_get_cff"](energy, grating, gratings=gratings, **PGM_KWARGS)
+        for energy in energies
+    ]
+    np.testing.assert_allclose(tables.cff(energies, grating), cff, rtol=1e-8)
+    angles = [
+        devices["_get_pgm_angles"](
+            energy, grating, gratings=gratings, **PGM_KWARGS, **PGM_ANGLE_KWARGS
+        )
+        for energy in energies
+    ]
+    np.testing.assert_allclose(
+        np.transpose(tables.angles(energies, grating)), angles, rtol=1e-8
+    )
+    np.testing.assert_allclose(
+        tables.energy(*tables.angles(energies, grating), grating), energies, rtol=1e-7
+    )
@@ -0,0 +1,104 @@
+import time
+
+import bluesky.plans as bp
+import numpy as np
+import pytest
+from conftest import BASE_SKIP
+from ophyd import Component as Cpt
+from ophyd import Device, Signal
+
+from benchmarks._startup import load_startup
+
+LATENCY = 0.3  # s, the duration of each simulation
+
+
+class FailingDetector(Device):
+    """A detector failing at its second trigger."""
+
+    value = Cpt(Signal, value=0.0)
+
+    def trigger(self):
+        self.value.put(self.value.get() + 1)
+        if self.value.get() > 1:
+            raise RuntimeError("The detector failed")
+        return super().trigger()
+
+
+@pytest.fixture
+def pipelined(sirepo_session):
+    session = sirepo_session(latency=LATENCY)
+    ns = load_startup("00-base.py", namespace=session, skip=BASE_SKIP)
+    ns = load_startup(
+        "11-sirepo-execution.py", "80-plans.py", namespace=dict(ns, USE_SIREPO=False)
+    )
+    ns["simulation_cache"] = None
+    return ns
+
+
+def _run(ns, plan):
+    start_time = time.monotonic()
+    (uid,) = ns["RE"](plan)
+    return ns["db"][uid], time.monotonic() - start_time
+
+
+def test_pipelined_scan(pipelined):
+    ns = pipelined
+    connection, watchpoint = ns["connection"], ns["after_v_slit"]
+    motor = ns["undulator"].verticalAmplitude
+    positions = np.linspace(0.4, 0.65, 6)
+    depth = 3
+    num_simulations = len(connection.simulation_list())
+
+    plain, plain_duration = _run(ns, bp.list_scan([watchpoint], motor, positions))
+    hdr, duration = _run(
+        ns, ns["pipelined_scan"]([watchpoint], motor, 0.4, 0.65, 6, depth=depth)
+    )
+
+    assert hdr.stop["exit_status"] == "success"
+    assert hdr.start["pipeline_depth"] == depth
+    table = hdr.table(fill=True)
+    assert list(table.index) == list(range(1, 7))
+    np.testing.assert_allclose(table["undulator_verticalAmplitude"], positions)
+    expected = plain.table(fill=True)
+    for image, expected_image in zip(
+        table["after_v_slit_image"], expected["after_v_slit_image"]
+    ):
+        np.testing.assert_array_equal(image, expected_image)
+    # The simulations run ``depth`` at a time:
+    assert duration < 2 * plain_duration / depth
+    assert len(connection.simulation_list()) == num_simulations
+
+
+def test_pipelined_scan_error(pipelined):
+    ns = pipelined
+    connection, watchpoint = ns["connection"], ns["after_v_slit"]
+    motor = ns["undulator"].verticalAmplitude
+    num_simulations = len(connection.simulation_list())
+    run_simulation = connection.run_simulation
+
+    detector = FailingDetector(name="failing")
+    with pytest.raises(RuntimeError, match="The detector failed"):
+        ns["RE"](ns["pipelined_scan"]([watchpoint, detector], motor, 0.4, 0.65, 6))
+    assert ns["db"][-1].stop["exit_status"] == "fail"
+    assert len(connection.simulation_list()) == num_simulations
+    assert connection.run_simulation == run_simulation  # the pipeline is uninstalled
+
+
+def test_predict_models(pipelined):
+    """The models are predicted without moving the motor."""
+    ns = pipelined
+    connection, motor = ns["connection"], ns["undulator"].verticalAmplitude
+    magn_field = motor.get()
+    data = connection.data
+    snapshots = ns["_predict_models"](motor, [0.4, 0.5], "watchpointReport9")
+    assert [s["models"]["undulator"]["verticalAmplitude"] for s in snapshots] == [
+        0.4,
+        0.5,
+    ]
+    assert snapshots[0]["report"] == "watchpointReport9"
+    assert motor.get() == magn_field
+    assert connection.data is data
+    assert data["models"]["undulator"]["verticalAmplitude"] == magn_field
+
+    with pytest.raises(TypeError, match="cannot be predicted"):
+        ns["_predict_models"](Signal(name="soft"), [0.4], "watchpointReport9")
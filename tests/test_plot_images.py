@@ -0,0 +1,40 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from benchmarks._startup import load_startup
+
+
+@pytest.fixture(scope="module")
+def ns():
+    return load_startup("90-utils.py")
+
+
+@pytest.fixture
+def stack():
+    stack = np.arange(10 * 30 * 20, dtype=float).reshape(10, 30, 20)
+    stack[9, 0, 0] = -1.0  # the limits are in the frames which are not plotted
+    return stack
+
+
+def _clims(fig):
+    clims = {axis.images[0].get_clim() for axis in fig.axes if axis.images}
+    plt.close(fig)
+    return clims
+
+
+def test_limits_of_the_stack(ns, stack):
+    frames = (frame for frame in stack)  # read once
+    fig = ns["plot_images"](frames, nrows=2, ncols=2, max_size=8)
+    assert sum(bool(axis.images) for axis in fig.axes) == 4
+    assert fig.axes[0].images[0].get_array().shape == (7, 6)
+    assert _clims(fig) == {(-1.0, stack.max())}
+
+
+def test_limits_of_the_plotted_frames(ns, stack):
+    fig = ns["plot_images"](stack, nrows=2, ncols=2, limits="plotted")
+    assert _clims(fig) == {(0.0, stack[:4].max())}
+    fig = ns["plot_images"](stack, nrows=2, ncols=2, vmin=0.0, vmax=1.0)
+    assert _clims(fig) == {(0.0, 1.0)}
+    with pytest.raises(ValueError, match="Unknown limits"):
+        ns["plot_images"](stack, limits="first")
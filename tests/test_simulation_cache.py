@@ -0,0 +1,108 @@
+import os
+import time
+
+import pytest
+
+from benchmarks._startup import load_startup
+
+
+class Connection:
+    """A Sirepo connection running the simulations instantly, counting the runs."""
+
+    def __init__(self, server="http://localhost:8000", sim_id="00000004"):
+        self.server = server
+        self.sim_type = "srw"
+        self.sim_id = sim_id
+        self.data = {"models": {"undulator": {"verticalAmplitude": 0.5}}}
+        self.data["report"] = "intensityReport"
+        self.runs = 0
+
+    def run_simulation(self):
+        self.runs += 1
+        return {"state": "completed", "runs": self.runs}, 1.0
+
+    def get_datafile(self, file_index=-1):
+        amplitude = self.data["models"]["undulator"]["verticalAmplitude"]
+        return f"{amplitude}".encode() * 100
+
+
+@pytest.fixture(scope="module")
+def execution():
+    pytest.importorskip("Shadow")  # imported by sirepo_bluesky.sirepo_ophyd
+    return load_startup("11-sirepo-execution.py", namespace={"USE_SIREPO": False})
+
+
+@pytest.fixture
+def cache(execution, tmp_path):
+    connection = Connection()
+    cache = execution["SimulationCache"](connection, path=str(tmp_path))
+    cache.install()
+    yield cache
+    cache.uninstall()
+
+
+def _set_model(connection, amplitude):
+    connection.data["models"]["undulator"]["verticalAmplitude"] = amplitude
+
+
+def test_hits_and_misses(cache):
+    connection = cache._connection
+    for amplitude in [0.5, 0.6, 0.5, 0.6, 0.7]:
+        _set_model(connection, amplitude)
+        res, _ = connection.run_simulation()
+        assert connection.get_datafile() == f"{amplitude}".encode() * 100
+    assert connection.runs == 3
+    assert res == {"state": "completed", "runs": 3}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 3, 3)
+
+    cache.clear()
+    assert cache.stats()["entries"] == cache.stats()["hits"] == 0
+
+
+def test_hash_of_the_simulation(execution):
+    get_model_hash = execution["_get_model_hash"]
+    connection = Connection()
+    key = get_model_hash(connection)
+    assert get_model_hash(Connection()) == key
+    assert get_model_hash(Connection(server="http://sirepo:8000")) != key
+    assert get_model_hash(Connection(sim_id="00000005")) != key
+    assert get_model_hash(connection, report="watchpointReport9") != key
+
+
+def test_lru_eviction(execution, cache):
+    connection = cache._connection
+    keys = []
+    for amplitude in [0.1, 0.2, 0.3]:
+        _set_model(connection, amplitude)
+        connection.run_simulation()
+        keys.append(execution["_get_model_hash"](connection))
+    entry_size = cache.stats()["bytes"] // 3
+    # The first result is the oldest, but it is used again last:
+    for i, key in enumerate(keys):
+        for path in cache._paths(key):
+            os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+    assert cache.load(keys[0]) is not None
+
+    cache.max_bytes = 3 * entry_size - 1
+    _set_model(connection, 0.4)
+    connection.run_simulation()
+    assert keys[0] in cache
+    assert keys[1] not in cache and keys[2] not in cache
+    assert cache.stats()["entries"] == 2
+
+
+def test_interrupted_write(execution, cache):
+    connection = cache._connection
+    connection.run_simulation()
+    key = execution["_get_model_hash"](connection)
+    result_path, _ = cache._paths(key)
+    # The result of an interrupted write was not renamed into place:
+    os.rename(result_path, f"{result_path}.tmp")
+    assert key not in cache
+    assert cache.load(key) is None
+    assert cache.stats()["entries"] == 1  # the data file only
+
+    connection.run_simulation()
+    assert (cache.misses, cache.hits, connection.runs) == (2, 0, 2)
+    assert key in cache
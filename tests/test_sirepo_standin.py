@@ -0,0 +1,78 @@
+import json
+
+import bluesky.plans as bp
+import numpy as np
+import pytest
+import sirepo_bluesky.sirepo_bluesky
+from conftest import BASE_SKIP
+from sirepo_bluesky.sirepo_bluesky import SirepoBluesky
+
+from benchmarks._startup import load_startup
+from tools.sirepo_standin import undulator_spectrum
+
+
+def test_default_seed(start_standin):
+    connection = SirepoBluesky(start_standin())
+    data, _ = connection.auth("srw", "00000004")
+    titles = [element["title"] for element in data["models"]["beamline"]]
+    assert {"Grating", "After V Slit", "Sample"} <= set(titles)
+
+    connection.data["report"] = "intensityReport"
+    res, duration = connection.run_simulation()
+    assert res["state"] == "completed"
+    assert duration >= 0
+
+
+def test_list_scan(sirepo_session):
+    """A scan of the magnetic field over the watchpoint, read back from the catalog."""
+    session = sirepo_session()
+    watchpoint, undulator = session["after_v_slit"], session["undulator"]
+    magn_fields = [0.4, 0.5, 0.6]
+    (uid,) = session["RE"](
+        bp.list_scan([watchpoint], undulator.verticalAmplitude, magn_fields)
+    )
+
+    hdr = session["db"][uid]
+    assert hdr.stop["exit_status"] == "success"
+    table = hdr.table(fill=True)
+    assert list(table["undulator_verticalAmplitude"]) == magn_fields
+    # The flux of the watchpoint is the spectrum of the undulator at the photon
+    # energy, for the magnetic field of each point:
+    models = session["connection"].data["models"]
+    energy = models["simulation"]["photonEnergy"]
+    for magn_field, image in zip(magn_fields, table["after_v_slit_image"]):
+        assert image.shape == (100, 100)
+        undulator_models = dict(models["undulator"], verticalAmplitude=magn_field)
+        flux = undulator_spectrum(dict(models, undulator=undulator_models), [energy])
+        np.testing.assert_allclose(image.sum(), flux[0], rtol=1e-4)
+
+
+@pytest.fixture
+def auth_with_cache(tmp_path):
+    ns = load_startup("00-base.py", skip=BASE_SKIP)
+    ns.update(sirepo_bluesky=sirepo_bluesky, SIMULATION_CACHE_DIR=str(tmp_path))
+    ns = load_startup("10-sirepo.py", namespace=ns, skip=("SIMULATION_CACHE_DIR",))
+    return ns["auth_with_cache"]
+
+
+def test_auth_with_cache(start_standin, auth_with_cache, tmp_path):
+    url, other_url = start_standin(), start_standin()
+    data, _ = auth_with_cache(SirepoBluesky(url), "srw", "00000004")
+    path = tmp_path / f"http_localhost_{url.rsplit(':', 1)[1]}" / "srw-00000004.json"
+    assert json.loads(path.read_text())["server"] == url
+
+    connection = SirepoBluesky(url)
+    cached, _ = auth_with_cache(connection, "srw", "00000004", offline=True)
+    assert cached == data
+    exception = sirepo_bluesky.sirepo_bluesky.SirepoBlueskyClientException
+    with pytest.raises(exception, match="offline mode"):
+        connection.run_simulation()
+
+    # The copy of another server is not used, even at its path:
+    with pytest.raises(RuntimeError, match="no cached simulation"):
+        auth_with_cache(SirepoBluesky(other_url), "srw", "00000004", offline=True)
+    other_path = tmp_path / f"http_localhost_{other_url.rsplit(':', 1)[1]}"
+    other_path.mkdir()
+    (other_path / path.name).write_text(path.read_text())
+    with pytest.raises(RuntimeError, match="no cached simulation"):
+        auth_with_cache(SirepoBluesky(other_url), "srw", "00000004", offline=True)
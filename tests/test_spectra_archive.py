@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from benchmarks._startup import load_startup, synthetic_scan
+
+
+@pytest.fixture(scope="module")
+def archive(tmp_path_factory):
+    ns = load_startup("20-peak-finding.py")
+    path = str(tmp_path_factory.mktemp("archive") / "scan.spectra")
+    ns["export_spectra"](synthetic_scan("8x50"), path=path)
+    return ns["load_spectra"](path=path)
+
+
+def _fields(archive):
+    return np.asarray(archive["undulator_verticalAmplitude"])
+
+
+@pytest.mark.parametrize(
+    "rows",
+    [
+        slice(None),
+        slice(2, 6),
+        slice(1, None, 3),
+        slice(None, None, -1),
+        slice(5, 2, -1),
+        slice(6, None, -2),
+        slice(5, 5),
+        [4, 0, 2],
+    ],
+)
+def test_select(archive, rows):
+    expected = _fields(archive)[rows]
+    np.testing.assert_array_equal(_fields(archive.select(rows)), expected)
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        (slice(1, 7), slice(None, None, -1)),
+        (slice(1, 7), slice(4, 1, -2)),
+        (slice(None, None, -1), slice(1, 4)),
+        (slice(None, None, -1), slice(None, None, -1)),
+        ([5, 1, 3], slice(None, None, -1)),
+    ],
+)
+def test_select_twice(archive, first, second):
+    expected = _fields(archive)[first][second]
+    selected = archive.select(first).select(second)
+    np.testing.assert_array_equal(_fields(selected), expected)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks._startup import synthetic_scan
+
+PARAMS = [
+    (method, thres, filter_thres)
+    for method in ["scipy", "peakutils"]
+    for thres in [0.05, 0.07, 0.10]
+    for filter_thres in [0.2, 0.5]
+]
+
+
+@pytest.fixture(scope="module")
+def ns(peak_finding):
+    return peak_finding
+
+
+@pytest.fixture(scope="module")
+def df():
+    return synthetic_scan("21x2000")
+
+
+def _serial_sweep(ns, df):
+    """The peaks of detect_peaks() for each combination, one row per peak."""
+    energies, intensities, mag_fields = ns["_get_spectra_arrays"](df)
+    tables = []
+    for method, thres, filter_thres in PARAMS:
+        peaks = ns["detect_peaks"](
+            energies, intensities, method=method, thres=thres, filter_thres=filter_thres
+        )
+        counts = np.diff(peaks.offsets)
+        tables.append(
+            pd.DataFrame(
+                {
+                    "method": method,
+                    "thres": thres,
+                    "filter_thres": filter_thres,
+                    "spectrum": np.repeat(np.arange(len(counts)), counts),
+                    "energy": peaks.energies,
+                    "intensity": peaks.intensities,
+                }
+            )
+        )
+    return pd.concat(tables, ignore_index=True)
+
+
+@pytest.mark.parametrize("chunk_size, max_workers", [(64, None), (4, 2), (4, 1)])
+def test_sweep_matches_detect_peaks(ns, df, chunk_size, max_workers):
+    peaks_df = ns["sweep_peaks"](
+        df, PARAMS, chunk_size=chunk_size, max_workers=max_workers
+    )
+    expected = _serial_sweep(ns, df)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(peaks_df[expected.columns], expected)
+
+
+def test_single_chunk_runs_serially(ns, df, monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError("no process pool for a single chunk")
+
+    monkeypatch.setitem(ns, "ProcessPoolExecutor", no_pool)
+    peaks_df = ns["sweep_peaks"](df, PARAMS, chunk_size=len(df))
+    assert len(peaks_df) == len(_serial_sweep(ns, df))
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+from conftest import MODELS
+
+
+def _fundamental(magn_field):
+    """The energy of the fundamental of the synthetic spectra (tools/sirepo_standin.py)."""
+    period = MODELS["undulator"]["period"]
+    k = 0.0934 * period * magn_field
+    return (
+        949.6 * MODELS["electronBeam"]["energy"] ** 2 / (period / 10 * (1 + k**2 / 2))
+    )
+
+
+def _peak_errors(profile, table, harm_num):
+    """The error of the detected peak of the harmonic in each spectrum [eV]."""
+    energies, intensities, mag_fields = profile["_get_spectra_arrays"](table)
+    peaks = profile["detect_peaks"](energies, intensities, thres=0.01, filter_thres=0)
+    errors = []
+    for magn_field, start, stop in zip(mag_fields, peaks.offsets, peaks.offsets[1:]):
+        expected = harm_num * _fundamental(magn_field)
+        errors.append(np.min(np.abs(peaks.energies[start:stop] - expected)))
+    return np.array(errors)
+
+
+def test_windowed_scan(profile, open_catalog):
+    RE, det = profile["RE"], profile["single_electron_spectrum"]
+    (uid,) = RE(
+        profile["windowed_scan_spectra_vs_mag_field"](
+            start=0.3, stop=1.0, num_spectra=3, num_coarse_points=500
+        )
+    )
+
+    hdr = open_catalog()[uid]
+    table = hdr.table()
+    assert len(table) == 3
+    assert len(profile["harmonics_extractor"].harmonics) == 3
+    fine = hdr.table("fine")
+    for energies, num_windows in zip(
+        table["single_electron_spectrum_photon_energy"],
+        table["single_electron_spectrum_num_windows"],
+    ):
+        # The coarse points outside of the windows and all the fine points:
+        assert np.all(np.diff(energies) >= 0)
+        assert len(energies) > 500 - 10 * num_windows + 100 * num_windows - 1
+    # The samples of each window are in one of the combined spectra:
+    for fine_energies in fine[f"{det.name}_photon_energy"]:
+        assert any(
+            np.isin(fine_energies, energies).all()
+            for energies in table[f"{det.name}_photon_energy"]
+        )
+    # The energy range of the detector is restored:
+    assert det.initialEnergy.get() == 0.1
+    assert det.finalEnergy.get() == 1100.0
+    assert det.photonEnergyPointCount.get() == 2000
+
+
+def test_windowed_scan_precision(profile, open_catalog):
+    """The peaks of the combined spectra are more precise than of the coarse ones."""
+    RE = profile["RE"]
+    (uid,) = RE(
+        profile["windowed_scan_spectra_vs_mag_field"](
+            start=0.4, stop=1.0, num_spectra=4, num_coarse_points=500
+        )
+    )
+
+    hdr = open_catalog()[uid]
+    coarse_step = (1100.0 - 0.1) / 499
+    in_range = 3 * _fundamental(hdr.table()["undulator_verticalAmplitude"]) < 1100.0
+    for harm_num in [1, 3]:
+        combined = _peak_errors(profile, hdr.table(), harm_num)
+        coarse = _peak_errors(profile, hdr.table("coarse"), harm_num)
+        if harm_num == 3:
+            combined, coarse = combined[in_range], coarse[in_range]
+        assert np.all(combined < coarse_step / 10)
+        assert combined.mean() < coarse.mean() / 5
+
+
+def test_ragged_spectra(profile):
+    """The spectra of different lengths are padded without adding peaks."""
+    df = pd.DataFrame(
+        {
+            "single_electron_spectrum_photon_energy": [
+                np.linspace(0, 10, 11),
+                np.linspace(0, 10, 6),
+            ],
+            "single_electron_spectrum_image": [
+                np.sin(np.linspace(0, 10, 11)) + 2,
+                np.array([0.0, 1.0, 0.0, 1.0, 2.0, 3.0]),
+            ],
+            "undulator_verticalAmplitude": [0.5, 1.0],
+        }
+    )
+    energies, intensities, mag_fields = profile["_get_spectra_arrays"](df)
+    assert energies.shape == intensities.shape == (2, 11)
+    np.testing.assert_array_equal(energies[1, 5:], 10.0)
+    peaks = profile["detect_peaks"](energies, intensities, thres=0, filter_thres=0)
+    np.testing.assert_array_equal(peaks.energies[peaks.offsets[1] :], [2.0])
@@ -0,0 +1,423 @@
+"""
+A local stand-in for the Sirepo server, for throughput testing of the scans.
+
+It implements the endpoints used by ``sirepo_bluesky.SirepoBluesky`` and returns
+synthetic SRW results computed from an analytic undulator model instead of
+running the SRW solver:
+
+- "intensityReport": the on-axis single-electron spectrum, a sum of the odd
+  harmonics of the undulator (``sinc**2`` lines weighted by the ``F_n(K)``
+  factors), over the energy range of the report;
+- "watchpointReport<id>": a Gaussian beam whose flux is the undulator spectrum
+  at the photon energy of the simulation.
+
+The simulation itself (models and schema) is seeded from a file in the format of
+the local copy kept by ``auth_with_cache()`` in ``10-sirepo.py``. By default, it
+is the minimal ARI simulation shipped in ``tools/data/srw-seed.json`` (the
+undulator, the spectrum report, the grating and the watchpoints used by the
+profile). To get the same devices as with the real server, seed it from the
+local copy instead
+(``--seed ~/.cache/profile_sirepo_ari/http_localhost_8000/srw-00000004.json``).
+The latency of the simulations and the failures (failed simulations, HTTP
+errors) are configurable.
+
+Usage
+-----
+
+    python tools/sirepo_standin.py --port 8000 --latency 0.2 --failure-rate 0.01
+
+    # then, in another terminal:
+    USE_SIREPO=yes ipython --profile=sirepo_ari
+
+"""
+import argparse
+import base64
+import copy
+import hashlib
+import json
+import os
+import random
+import string
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from scipy import special
+
+DEFAULT_SEED = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "srw-seed.json"
+)
+
+
+def _srw_text(data, e_range, x_range, y_range, label="Intensity, ph/s/.1%bw/mm^2"):
+    """Format the data as an SRW ASCII file (the format of ``read_srw_file()``)."""
+    header = [f"#{label} (C-aligned, inner loop is vs Photon Energy)"]
+    for (start, stop, num), name, unit in zip(
+        [e_range, x_range, y_range],
+        ["Photon Energy", "Horizontal Position", "Vertical Position"],
+        ["eV", "m", "m"],
+    ):
+        header += [
+            f"#{start} #Initial {name} [{unit}]",
+            f"#{stop} #Final {name} [{unit}]",
+            f"#{num} #Number of points vs {name}",
+        ]
+    header.append("#1 #Number of components")
+    values = "\n".join(f"{value:.6e}" for value in np.ravel(data))
+    return "\n".join(header) + "\n" + values + "\n"
+
+
+def undulator_spectrum(models, energies):
+    """
+    Return the on-axis single-electron spectrum of the undulator at the energies.
+
+    The energy of the fundamental is ``949.6 * E_GeV**2 / (period_cm * (1 + K**2 / 2))``
+    with ``K = 0.0934 * period_mm * B``. Each odd harmonic ``n`` is a
+    ``sinc**2`` line of relative width ``1 / (n * N)``, where ``N`` is the number of
+    periods, weighted by the ``F_n(K)`` function of the planar undulator.
+    """
+    undulator = models["undulator"]
+    electron_energy = models.get("electronBeam", {}).get("energy", 3.0)  # [GeV]
+    period = undulator["period"]  # [mm]
+    num_periods = max(undulator["length"] / (period * 1e-3), 1.0)
+    magn_field = np.hypot(
+        undulator.get("verticalAmplitude", 0.0),
+        undulator.get("horizontalAmplitude", 0.0),
+    )
+    k = 0.0934 * period * magn_field
+    fundamental = 949.6 * electron_energy**2 / (period / 10 * (1 + k**2 / 2))
+
+    energies = np.asarray(energies, dtype=float)
+    intensities = np.zeros_like(energies)
+    max_harm_num = int(energies.max() / fundamental) + 2
+    for harm_num in range(1, max_harm_num + 1, 2):
+        xi = harm_num * k**2 / (4 * (1 + k**2 / 2))
+        bessel = special.jv((harm_num - 1) / 2, xi) - special.jv((harm_num + 1) / 2, xi)
+        if k > 0:
+            weight = (harm_num * k / (1 + k**2 / 2)) ** 2 * bessel**2
+        else:
+            weight = float(harm_num == 1)
+        detuning = num_periods * (energies / fundamental - harm_num)
+        intensities += weight * np.sinc(detuning) ** 2
+    return 1e14 * num_periods**2 * intensities
+
+
+class Simulations:
+    """The simulations of the stand-in server and the results of their reports."""
+
+    def __init__(self, data, schema, rng):
+        self.schema = schema
+        self._rng = rng
+        self._lock = threading.Lock()
+        sim_id = data["models"]["simulation"]["simulationId"]
+        self._simulations = {sim_id: data}
+        self._results = {}
+        self._jobs = {}
+
+    def get(self, sim_id):
+        with self._lock:
+            return copy.deepcopy(self._simulations[sim_id])
+
+    def list(self):
+        with self._lock:
+            return [
+                {
+                    "simulationId": sim_id,
+                    "name": data["models"]["simulation"]["name"],
+                    "folder": data["models"]["simulation"].get("folder", "/"),
+                    "isExample": False,
+                }
+                for sim_id, data in self._simulations.items()
+            ]
+
+    def copy(self, sim_id, name, folder):
+        new_id = "".join(self._rng.choice(string.digits) for _ in range(8))
+        with self._lock:
+            data = copy.deepcopy(self._simulations[sim_id])
+            data["models"]["simulation"].update(
+                {"simulationId": new_id, "name": name, "folder": folder}
+            )
+            self._simulations[new_id] = data
+        return copy.deepcopy(data)
+
+    def delete(self, sim_id):
+        with self._lock:
+            self._simulations.pop(sim_id, None)
+            for key in [key for key in self._results if key[0] == sim_id]:
+                del self._results[key]
+
+    def run(self, data):
+        """Compute the report of the simulation and keep its result file."""
+        sim_id, report = data["simulationId"], data["report"]
+        models = data["models"]
+        if report == "intensityReport":
+            params = models["intensityReport"]
+            e_range = (
+                params["initialEnergy"],
+                params["finalEnergy"],
+                int(params["photonEnergyPointCount"]),
+            )
+            intensities = undulator_spectrum(models, np.linspace(*e_range))
+            text = _srw_text(intensities, e_range, (0, 0, 1), (0, 0, 1))
+        elif report.startswith("watchpointReport"):
+            energy = models["simulation"]["photonEnergy"]
+            flux = undulator_spectrum(models, [energy])[0]
+            num_points = 100
+            x = np.linspace(-0.5e-3, 0.5e-3, num_points)
+            y = np.linspace(-0.25e-3, 0.25e-3, num_points)
+            xx, yy = np.meshgrid(x, y)
+            image = np.exp(-0.5 * ((xx / 0.1e-3) ** 2 + (yy / 0.05e-3) ** 2))
+            image *= flux / image.sum()
+            text = _srw_text(
+                image,
+                (energy, energy, 1),
+                (x[0], x[-1], num_points),
+                (y[0], y[-1], num_points),
+            )
+        else:
+            raise ValueError(f"The report {report!r} is not supported")
+        with self._lock:
+            self._results[(sim_id, report)] = text.encode()
+
+    def get_result(self, sim_id, report):
+        with self._lock:
+            return self._results[(sim_id, report)]
+
+    def submit(self, data, duration):
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._jobs[job_id] = (time.monotonic() + duration, data)
+        return job_id
+
+    def poll(self, job_id):
+        """Return the job's data once it is done, or None while it is running."""
+        with self._lock:
+            done_at, data = self._jobs[job_id]
+            if time.monotonic() < done_at:
+                return None
+            del self._jobs[job_id]
+        return data
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # Set by make_server():
+    simulations = None
+    secret = "bluesky"
+    latency = 0.0
+    jitter = 0.0
+    poll_interval = None
+    failure_rate = 0.0
+    http_error_rate = 0.0
+    rng = random.Random()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, body, status=200, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", "sirepo_standin=1; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _inject_http_error(self):
+        if self.rng.random() < self.http_error_rate:
+            self._send({"state": "error", "error": "injected HTTP error"}, status=500)
+            return True
+        return False
+
+    def _simulation_duration(self):
+        return max(self.latency * (1 + self.jitter * self.rng.uniform(-1, 1)), 0.0)
+
+    def do_GET(self):
+        if self._inject_http_error():
+            return
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 5 and parts[0] == "download-data-file":
+            _, _, sim_id, report, _ = parts
+            try:
+                result = self.simulations.get_result(sim_id, report)
+            except KeyError:
+                self._send({"state": "error", "error": "no result"}, status=404)
+                return
+            self._send(result, content_type="application/octet-stream")
+        else:
+            self._send({"state": "error", "error": "not found"}, status=404)
+
+    def do_POST(self):
+        if self._inject_http_error():
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        handler = getattr(self, f"_post_{self.path.strip('/').replace('-', '_')}", None)
+        if handler is None:
+            self._send({"state": "error", "error": "not found"}, status=404)
+            return
+        self._send(handler(payload))
+
+    def _post_auth_bluesky_login(self, payload):
+        h = hashlib.sha256()
+        h.update(
+            ":".join(
+                [
+                    payload["authNonce"],
+                    payload["simulationType"],
+                    payload["simulationId"],
+                    self.secret,
+                ]
+            ).encode()
+        )
+        expected = "v1:" + base64.urlsafe_b64encode(h.digest()).decode()
+        if payload.get("authHash") != expected:
+            return {"state": "error", "error": "invalid authHash"}
+        try:
+            data = self.simulations.get(payload["simulationId"])
+        except KeyError:
+            return {"state": "error", "error": "simulation not found"}
+        return {"state": "ok", "data": data, "schema": self.simulations.schema}
+
+    def _post_simulation_list(self, payload):
+        return self.simulations.list()
+
+    def _post_copy_simulation(self, payload):
+        return self.simulations.copy(
+            payload["simulationId"], payload["name"], payload.get("folder", "/")
+        )
+
+    def _post_delete_simulation(self, payload):
+        self.simulations.delete(payload["simulationId"])
+        return {"state": "ok"}
+
+    def _post_run_simulation(self, payload):
+        duration = self._simulation_duration()
+        if self.poll_interval is None:
+            time.sleep(duration)
+            return self._complete(payload)
+        job_id = self.simulations.submit(payload, duration)
+        return self._pending(job_id)
+
+    def _post_run_status(self, payload):
+        data = self.simulations.poll(payload["jobId"])
+        if data is None:
+            return self._pending(payload["jobId"])
+        return self._complete(data)
+
+    def _pending(self, job_id):
+        return {
+            "state": "pending",
+            "nextRequestSeconds": self.poll_interval,
+            "nextRequest": {"jobId": job_id},
+        }
+
+    def _complete(self, data):
+        if self.rng.random() < self.failure_rate:
+            return {"state": "error", "error": "injected simulation failure"}
+        try:
+            self.simulations.run(data)
+        except (KeyError, ValueError) as e:
+            return {"state": "error", "error": str(e)}
+        return {"state": "completed"}
+
+
+def make_server(
+    seed=DEFAULT_SEED,
+    host="localhost",
+    port=8000,
+    secret="bluesky",
+    latency=0.0,
+    jitter=0.0,
+    poll_interval=None,
+    failure_rate=0.0,
+    http_error_rate=0.0,
+    random_seed=None,
+    verbose=False,
+):
+    """
+    Create the stand-in server (``port=0`` picks a free port).
+
+    Usage
+    -----
+
+        server = make_server(port=0, latency=0.05)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        connection = SirepoBluesky(f"http://localhost:{server.server_port}")
+        ...
+        server.shutdown()
+
+    """
+    with open(seed) as f:
+        cached = json.load(f)
+    rng = random.Random(random_seed)
+    handler = type(
+        "Handler",
+        (StandInHandler,),
+        {
+            "simulations": Simulations(cached["data"], cached["schema"], rng),
+            "secret": secret,
+            "latency": latency,
+            "jitter": jitter,
+            "poll_interval": poll_interval,
+            "failure_rate": failure_rate,
+            "http_error_rate": http_error_rate,
+            "rng": rng,
+        },
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--seed",
+        default=DEFAULT_SEED,
+        help="the simulation (a cache file of 10-sirepo.py, default: %(default)s)",
+    )
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--secret", default="bluesky")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="simulation time [s]"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="relative spread of the latency"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=None,
+        help="answer 'pending' and let the client poll run-status (like Sirepo)",
+    )
+    parser.add_argument(
+        "--failure-rate", type=float, default=0.0, help="fraction of failed simulations"
+    )
+    parser.add_argument(
+        "--http-error-rate",
+        type=float,
+        default=0.0,
+        help="fraction of requests answered with HTTP 500",
+    )
+    parser.add_argument("--random-seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(**vars(args))
+    print(f"Sirepo stand-in listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()